@@ -16,11 +16,11 @@ st.write("Get a quick vibe check on your text or images!")
 # API endpoint
 API_URL = "http://127.0.0.1:8000/api/v1/query/vibe"
 
-def get_vibe_check(text: str = None, files: List[bytes] = None) -> dict:
-    """Send request to the vibe check API"""
+def stream_vibe_check(text: str = None, files: List[bytes] = None):
+    """Send a streaming request to the vibe check API and yield bubbles as they arrive"""
     try:
         # Prepare the form data
-        data = {}
+        data = {"stream": "true"}
         files_data = []
         
         if text:
@@ -30,14 +30,37 @@ def get_vibe_check(text: str = None, files: List[bytes] = None) -> dict:
             for i, file in enumerate(files):
                 files_data.append(("images", file))
         
-        # Make the API request
-        response = requests.post(API_URL, data=data, files=files_data)
-        response.raise_for_status()
-        return response.json()
+        # Make the API request and read newline-delimited JSON events
+        with requests.post(API_URL, data=data, files=files_data, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "bubble":
+                    yield event["text"]
+                elif event["type"] == "error":
+                    st.error(f"Error from the API: {event['detail']}")
+                    return
     
     except requests.exceptions.RequestException as e:
         st.error(f"Error communicating with the API: {str(e)}")
-        return None
+
+def render_bubble(bubble: str):
+    st.markdown(
+        f"""
+        <div style="
+            background-color: #e3f2fd;
+            border-radius: 15px;
+            padding: 10px;
+            margin: 5px 0;
+            max-width: 80%;
+        ">
+            {bubble.strip()}
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
 
 # User input section
 text_input = st.text_area("Enter your text for a vibe check:", height=100)
@@ -54,33 +77,15 @@ if st.button("Get Vibe Check! 🎯"):
         
         # Get the vibe check
         if text_input or files:
-            result = get_vibe_check(text_input, files)
-            
-            if result:
+            # Display the response in chat bubble style as each bubble arrives
+            st.markdown("### Response:")
+
+            received = False
+            for bubble in stream_vibe_check(text_input, files):
+                received = True
+                render_bubble(bubble)
+
+            if received:
                 st.success("Vibe check complete! 🎉")
-                
-                # Display the response in chat bubble style
-                st.markdown("### Response:")
-                
-                # Split the response by chat bubbles if they exist
-                response_text = result.get("result", {}).get("text", "No response received")
-                bubbles = response_text.split("$endbubble")
-                
-                for bubble in bubbles:
-                    if bubble.strip():
-                        st.markdown(
-                            f"""
-                            <div style="
-                                background-color: #e3f2fd;
-                                border-radius: 15px;
-                                padding: 10px;
-                                margin: 5px 0;
-                                max-width: 80%;
-                            ">
-                                {bubble.strip()}
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
         else:
             st.warning("Please enter some text or upload an image to get a vibe check!") 
\ No newline at end of file
@@ -0,0 +1,122 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+from utils.cleaning import clean_many, clean_markdown, clean_text, clean_text_lines
+
+golden_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "cleaning")
+
+
+def reference_clean_text(text):
+    # The original multi-pass implementation, kept for comparison
+    text = "\n".join(line.strip() for line in text.splitlines())
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def reference_clean_markdown(md_text):
+    md_text = re.sub(r"\[.*?\]\(.*?\)", "", md_text)
+    md_text = re.sub(r"\n\s*\n", "\n\n", md_text)
+    md_text = re.sub(r"!\[\]\((.*?)\)", r"![Image](\1)", md_text)
+    md_text = re.sub(r"\!\[\]\(\)", "", md_text)
+    md_text = re.sub(r"Open Menu|Close Menu", "", md_text, flags=re.IGNORECASE)
+    md_text = re.sub(r"##\s+", "## ", md_text)
+    md_text = re.sub(r"\n{3,}", "\n\n", md_text)
+    return md_text.strip()
+
+
+def read(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return f.read()
+
+
+def verify():
+    """
+    Check every golden input against its recorded output. Returns the number
+    of mismatches.
+    """
+    failures = 0
+    inputs = sorted(glob.glob(os.path.join(golden_dir, "*.input.txt")))
+
+    for input_path in inputs:
+        name = os.path.basename(input_path)[: -len(".input.txt")]
+        text = read(input_path)
+        expected_text = read(os.path.join(golden_dir, f"{name}.clean_text.txt"))
+        expected_markdown = read(os.path.join(golden_dir, f"{name}.clean_markdown.txt"))
+
+        results = {
+            "clean_text": (clean_text(text), expected_text),
+            "clean_text_lines": (
+                "".join(clean_text_lines(text.splitlines(keepends=True))),
+                expected_text,
+            ),
+            "clean_markdown": (clean_markdown(text), expected_markdown),
+        }
+        for fn, (actual, expected) in results.items():
+            if actual != expected:
+                failures += 1
+                print(f"MISMATCH {name}: {fn}")
+
+    print(f"Verified {len(inputs)} golden files, {failures} mismatches")
+    return failures
+
+
+def load_corpus(corpus_dir, target_mb):
+    if corpus_dir:
+        paths = glob.glob(os.path.join(corpus_dir, "**", "*.txt"), recursive=True)
+        docs = [read(path) for path in paths]
+    else:
+        docs = [read(path) for path in glob.glob(os.path.join(golden_dir, "*.input.txt"))]
+
+    docs = [doc for doc in docs if doc]
+    corpus, size = [], 0
+    while size < target_mb * 1024 * 1024:
+        for doc in docs:
+            corpus.append(doc)
+            size += len(doc.encode("utf-8"))
+    return corpus, size
+
+
+def throughput(fn, corpus, size, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(corpus)
+        best = min(best, time.perf_counter() - started)
+    return size / best / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify and benchmark utils/cleaning.py")
+    parser.add_argument("--verify", action="store_true", help="Only run the golden check")
+    parser.add_argument("--corpus", help="Directory of .txt documents to benchmark on")
+    parser.add_argument("--mb", type=float, default=16, help="Corpus size to benchmark")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    if verify():
+        sys.exit(1)
+    if args.verify:
+        return
+
+    corpus, size = load_corpus(args.corpus, args.mb)
+    print(f"Benchmarking on {len(corpus)} documents, {size / (1024 * 1024):.1f} MB")
+
+    cases = {
+        "reference clean_text": lambda docs: [reference_clean_text(d) for d in docs],
+        "clean_text": lambda docs: [clean_text(d) for d in docs],
+        "reference clean_markdown": lambda docs: [reference_clean_markdown(d) for d in docs],
+        "clean_markdown": lambda docs: [clean_markdown(d) for d in docs],
+        "clean_many text": lambda docs: clean_many(docs, "text", args.processes),
+        "clean_many markdown": lambda docs: clean_many(docs, "markdown", args.processes),
+    }
+    for name, fn in cases.items():
+        print(f"{name:<26} {throughput(fn, corpus, size, args.repeat):8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,3 +9,15 @@ LSD_DB = os.getenv("LSD_DB")
 LSD_USER = os.getenv("LSD_USER")
 LSD_HOST = os.getenv("LSD_HOST")
 LSD_PASSWORD = os.getenv("LSD_PASSWORD")
+LSD_PORT = os.getenv("LSD_PORT")
+# A full libpq connection string, e.g. pointing at lsd_stub.py; overrides the above
+LSD_DSN = os.getenv("LSD_DSN")
+# Whether LSD accepts UNION ALL across sources for batched fetches
+LSD_BATCH_UNION = os.getenv("LSD_BATCH_UNION", "false").lower() == "true"
+
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "8"))
+SCRAPE_RATE_PER_HOST = float(os.getenv("SCRAPE_RATE_PER_HOST", "4"))
+SCRAPE_RETRIES = int(os.getenv("SCRAPE_RETRIES", "3"))
+
+CORPUS_DIR = os.getenv("CORPUS_DIR", "../datasets/corpus")
+CORPUS_SHARD_MB = int(os.getenv("CORPUS_SHARD_MB", "256"))
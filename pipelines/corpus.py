@@ -0,0 +1,207 @@
+import glob
+import hashlib
+import json
+import mmap
+import os
+import threading
+from datetime import datetime, timezone
+
+import pyarrow as pa
+
+SHARD_PATTERN = "shard-{:05d}.jsonl.zst"
+INDEX_FILE = "index.jsonl"
+
+codec = pa.Codec("zstd", compression_level=6)
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CorpusWriter:
+    """
+    Appends documents to size-capped shards of zstd-compressed JSON lines.
+
+    Every document is its own zstd frame, so a shard is still a valid zstd
+    stream (`zstdcat shard-00000.jsonl.zst`) while the index can point at any
+    single document by byte range. Rewriting a URL appends a new record and
+    the newest index entry wins; `compact` drops the stale bytes.
+    """
+
+    def __init__(self, directory, shard_max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.shard_max_bytes = shard_max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        shards = sorted(glob.glob(os.path.join(directory, "shard-*.jsonl.zst")))
+        self.shard_id = len(shards) - 1 if shards else 0
+        self.shard = None
+        self._open_shard()
+        self.index = open(os.path.join(directory, INDEX_FILE), "a", encoding="utf-8")
+
+    def _open_shard(self):
+        if self.shard is not None:
+            self.shard.close()
+        path = os.path.join(self.directory, SHARD_PATTERN.format(self.shard_id))
+        self.shard = open(path, "ab")
+
+    def write(self, url, text, **metadata):
+        """
+        Append one document and return its index entry.
+        """
+        record = {"url": url, "hash": content_hash(text), "text": text, **metadata}
+        raw = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        frame = codec.compress(raw, asbytes=True)
+
+        with self.lock:
+            size = self.shard.tell()
+            if size and size + len(frame) > self.shard_max_bytes:
+                self.shard_id += 1
+                self._open_shard()
+
+            offset = self.shard.tell()
+            self.shard.write(frame)
+            self.shard.flush()
+
+            entry = {
+                "url": url,
+                "hash": record["hash"],
+                "shard": self.shard_id,
+                "offset": offset,
+                "length": len(frame),
+                "size": len(raw),
+                "written_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self.index.write(json.dumps(entry) + "\n")
+            self.index.flush()
+
+        return entry
+
+    def close(self):
+        self.shard.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CorpusReader:
+    """
+    Random access and sequential iteration over a corpus directory, reading
+    shards through memory maps.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}
+        self.maps = {}
+
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from an interrupted writer
+                        continue
+                    self.entries[entry["url"]] = entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, url):
+        return url in self.entries
+
+    def _map(self, shard_id):
+        mapped = self.maps.get(shard_id)
+        if mapped is None:
+            path = os.path.join(self.directory, SHARD_PATTERN.format(shard_id))
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[shard_id] = mapped
+        return mapped
+
+    def read(self, entry):
+        mapped = self._map(entry["shard"])
+        frame = mapped[entry["offset"] : entry["offset"] + entry["length"]]
+        raw = codec.decompress(frame, decompressed_size=entry["size"], asbytes=True)
+        return json.loads(raw)
+
+    def get(self, url):
+        entry = self.entries.get(url)
+        return self.read(entry) if entry is not None else None
+
+    def __iter__(self):
+        """
+        Yield the live record for every URL, in on-disk order so reads are
+        sequential within each shard.
+        """
+        for entry in sorted(
+            self.entries.values(), key=lambda e: (e["shard"], e["offset"])
+        ):
+            yield self.read(entry)
+
+    def close(self):
+        for mapped in self.maps.values():
+            mapped.close()
+        self.maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def compact(directory, output_directory, shard_max_bytes=256 * 1024 * 1024):
+    """
+    Rewrite only the live record of each URL into a fresh corpus directory.
+    """
+    with CorpusReader(directory) as reader, CorpusWriter(
+        output_directory, shard_max_bytes
+    ) as writer:
+        for record in reader:
+            url, text = record.pop("url"), record.pop("text")
+            record.pop("hash", None)
+            writer.write(url, text, **record)
+
+
+def import_txt(raw_directory, directory):
+    """
+    Load the legacy one-file-per-article layout (`URL: ...` header line
+    followed by the cleaned text) into a corpus.
+    """
+    paths = sorted(
+        glob.glob(os.path.join(raw_directory, "**", "*.txt"), recursive=True)
+    )
+    with CorpusWriter(directory) as writer:
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                header, _, text = f.read().partition("\n")
+            url = header.removeprefix("URL: ") if header.startswith("URL: ") else path
+            writer.write(url, text)
+    return len(paths)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Corpus maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import legacy .txt files")
+    import_parser.add_argument("raw_directory")
+    import_parser.add_argument("directory")
+    compact_parser = subparsers.add_parser("compact", help="Drop superseded records")
+    compact_parser.add_argument("directory")
+    compact_parser.add_argument("output_directory")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        print(f"Imported {import_txt(args.raw_directory, args.directory)} documents")
+    else:
+        compact(args.directory, args.output_directory)
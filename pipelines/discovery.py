@@ -0,0 +1,216 @@
+import time
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+
+ARTICLE_PREFIX = "/content"
+REQUEST_TIMEOUT = 20
+NEXT_PAGE_LABELS = ("older", "older posts", "next", "next page")
+
+
+def article_path(href, base_url):
+    """
+    The `/content/...` path of a link, or None if it isn't an article.
+    """
+    parsed = urlparse(urljoin(base_url, href))
+    if parsed.netloc and parsed.netloc != urlparse(base_url).netloc:
+        return None
+    if not parsed.path.startswith(ARTICLE_PREFIX):
+        return None
+    return parsed.path
+
+
+def _get(session, url):
+    response = session.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response
+
+
+def _xml_text(root, tag):
+    # Sitemaps and feeds are namespaced inconsistently, match on local name
+    return [
+        el.text.strip()
+        for el in root.iter()
+        if el.tag.split("}")[-1] == tag and el.text
+    ]
+
+
+def discover_from_sitemap(base_url, session, known, incremental=False):
+    """
+    Enumerate article links from /sitemap.xml, following sitemap indexes.
+    Sitemaps aren't ordered by recency, so every link is always returned.
+    """
+    found = []
+    queue = [urljoin(base_url, "/sitemap.xml")]
+    seen = set()
+
+    while queue:
+        sitemap_url = queue.pop(0)
+        if sitemap_url in seen:
+            continue
+        seen.add(sitemap_url)
+
+        root = ET.fromstring(_get(session, sitemap_url).content)
+        for loc in _xml_text(root, "loc"):
+            if root.tag.endswith("sitemapindex"):
+                queue.append(loc)
+                continue
+            path = article_path(loc, base_url)
+            if path is not None:
+                found.append(path)
+
+    return found, False
+
+
+def discover_from_feed(base_url, session, listing_url, known, incremental=False):
+    """
+    Enumerate article links from the RSS feed of the listing page, newest
+    first. In incremental mode this stops at the first known article.
+    """
+    root = ET.fromstring(_get(session, f"{listing_url}?format=rss").content)
+    found = []
+    for link in _xml_text(root, "link"):
+        path = article_path(link, base_url)
+        if path is None:
+            continue
+        if incremental and path in known:
+            return found, True
+        found.append(path)
+    return found, False
+
+
+def discover_from_listing(
+    base_url, session, listing_url, known, incremental=False, max_pages=500
+):
+    """
+    Walk the paginated HTML listing, newest first, following "next"/"older"
+    links. In incremental mode this stops at the first known article.
+    """
+    found = []
+    page_url = listing_url
+
+    for _ in range(max_pages):
+        soup = BeautifulSoup(_get(session, page_url).text, "html.parser")
+
+        for a in soup.find_all("a", href=True):
+            path = article_path(a["href"].split("#")[0], base_url)  # type: ignore
+            if path is None or path in found:
+                continue
+            if incremental and path in known:
+                return found, True
+            found.append(path)
+
+        next_link = soup.find("a", rel="next") or soup.find(
+            "a", string=lambda s: s and s.strip().lower() in NEXT_PAGE_LABELS
+        )
+        if next_link is None or not next_link.get("href"):  # type: ignore
+            break
+        page_url = urljoin(page_url, next_link["href"])  # type: ignore
+
+    return found, False
+
+
+def discover_with_selenium(
+    base_url, listing_url, known, incremental=False, scroll_pause_time=2
+):
+    """
+    Fallback: render the infinite-scroll listing in headless Chrome.
+    """
+    # Imported lazily so the fast paths never pay for a browser
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    service = Service()  # type: ignore
+    driver = webdriver.Chrome(service=service, options=chrome_options)
+
+    try:
+        driver.get(listing_url)
+        last_height = driver.execute_script("return document.body.scrollHeight")
+
+        while True:
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            time.sleep(scroll_pause_time)
+            new_height = driver.execute_script("return document.body.scrollHeight")
+
+            if new_height == last_height:
+                break
+            last_height = new_height
+
+        soup = BeautifulSoup(driver.page_source, "html.parser")
+    finally:
+        driver.quit()
+
+    found = []
+    for a in soup.find_all("a", href=True):
+        path = article_path(a["href"].split("#")[0], base_url)  # type: ignore
+        if path is not None:
+            found.append(path)
+    return found, False
+
+
+STRATEGIES = ("sitemap", "feed", "listing", "selenium")
+
+
+def discover(base_url, listing_url, mode="auto", known=None, incremental=False):
+    """
+    Return the set of article paths using the requested strategy. In "auto"
+    mode the HTTP strategies are tried in order and Selenium is only used if
+    all of them fail or find nothing. Outside incremental runs the feed is
+    never taken as the whole archive, only merged with a later strategy.
+    """
+    known = set(known or ())
+    modes = STRATEGIES if mode == "auto" else (mode,)
+    # Feeds only list the newest items, so a full crawl adds what they find
+    # to the next strategy's results instead of stopping there
+    partial = set()
+    session = requests.Session()
+    session.headers["User-Agent"] = "y-pipelines/1.0"
+
+    for strategy in modes:
+        try:
+            if strategy == "sitemap":
+                found, stopped = discover_from_sitemap(
+                    base_url, session, known, incremental
+                )
+            elif strategy == "feed":
+                found, stopped = discover_from_feed(
+                    base_url, session, listing_url, known, incremental
+                )
+            elif strategy == "listing":
+                found, stopped = discover_from_listing(
+                    base_url, session, listing_url, known, incremental
+                )
+            elif strategy == "selenium":
+                found, stopped = discover_with_selenium(
+                    base_url, listing_url, known, incremental
+                )
+            else:
+                raise ValueError(f"Unknown discovery mode {strategy}")
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Discovery via {strategy} failed: {e}")
+            continue
+
+        # Reaching an already-known link means there is nothing older to find
+        if not found and not stopped:
+            continue
+
+        if strategy == "feed" and mode == "auto" and not incremental:
+            print(f"Feed lists {len(found)} articles, checking for older ones")
+            partial.update(found)
+            continue
+
+        if incremental:
+            found = [path for path in found if path not in known]
+        print(f"Discovered {len(found)} articles via {strategy}")
+        return partial | set(found)
+
+    if partial:
+        print(f"Discovered {len(partial)} articles via feed only")
+    return partial
@@ -1,5 +1,191 @@
-import psycopg2
+import asyncio
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
 import config
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+# Characters that could end the FROM clause or start another statement
+UNSAFE_URL = re.compile(r"[\s'\";|\\`]")
+
+
+def lsd_dsn():
+    """
+    Connection string built with libpq quoting rather than string formatting,
+    so credentials containing quotes or spaces can't break it.
+    """
+    if config.LSD_DSN:
+        return config.LSD_DSN
+    return psycopg2.extensions.make_dsn(
+        host=config.LSD_HOST,
+        port=config.LSD_PORT,
+        dbname=config.LSD_DB,
+        user=config.LSD_USER,
+        password=config.LSD_PASSWORD,
+    )
+
+
+def lsd_source(url):
+    """
+    Validate a URL before it's interpolated into a FROM clause. LSD takes the
+    source as a bare identifier, so it can't be sent as a bind parameter.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        raise ValueError(f"Not an http(s) URL: {url!r}")
+    if UNSAFE_URL.search(url):
+        raise ValueError(f"URL contains characters LSD can't take: {url!r}")
+    return url
+
+
+def text_query(url):
+    return f"""
+    FROM {lsd_source(url)}
+    |> SELECT TEXT as text
+    """
+
+
+def batch_query(urls):
+    """
+    One statement that fetches several sources, tagged with their position so
+    rows can be matched back to URLs.
+    """
+    return "\nUNION ALL\n".join(
+        f"FROM {lsd_source(url)} |> SELECT {i} as position, TEXT as text"
+        for i, url in enumerate(urls)
+    )
+
+
+class AutocommitConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.autocommit = True
+
+
+class LSDPool:
+    """
+    Thread-safe LSD connection pool.
+
+    Nothing connects until the first query. Connections idle for longer than
+    `health_check_interval` are pinged before reuse and replaced if dead, and
+    a query that fails on a broken connection is retried once on a fresh one.
+    """
+
+    def __init__(self, maxconn, dsn=None, health_check_interval=30.0):
+        self.maxconn = maxconn
+        self.dsn = dsn
+        self.health_check_interval = health_check_interval
+        self.pool = None
+        self.last_used = {}
+        self.lock = threading.Lock()
+
+    def _get_pool(self):
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    # LSD queries are read-only, so autocommit skips the
+                    # implicit BEGIN/ROLLBACK round trips around each one
+                    self.pool = psycopg2.pool.ThreadedConnectionPool(
+                        0,
+                        self.maxconn,
+                        self.dsn or lsd_dsn(),
+                        connection_factory=AutocommitConnection,
+                    )
+        return self.pool
+
+    def _checkout(self):
+        pool = self._get_pool()
+        conn = pool.getconn()
+        # Fresh connections have no entry and don't need a ping
+        idle = time.monotonic() - self.last_used.get(id(conn), time.monotonic())
+
+        if conn.closed or (idle > self.health_check_interval and not _alive(conn)):
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._checkout()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.last_used[id(conn)] = time.monotonic()
+            self._get_pool().putconn(conn, close=broken or bool(conn.closed))
+
+    def _execute(self, query):
+        for attempt in range(2):
+            try:
+                with self.connection() as conn, conn.cursor() as curs:
+                    curs.execute(query)
+                    return curs.fetchall()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if attempt:
+                    raise
+
+    def fetch_text(self, url):
+        rows = self._execute(text_query(url))
+        return rows[0][0] if rows else None
+
+    def fetch_many(self, urls):
+        """
+        Fetch several URLs in one round trip. Returns a dict of URL to text,
+        with None for sources that produced no row.
+        """
+        urls = list(urls)
+        if not urls:
+            return {}
+        if config.LSD_BATCH_UNION and len(urls) > 1:
+            texts = {url: None for url in urls}
+            for position, text in self._execute(batch_query(urls)):
+                texts[urls[int(position)]] = text
+            return texts
+        return {url: self.fetch_text(url) for url in urls}
+
+    def closeall(self):
+        if self.pool is not None and not self.pool.closed:
+            self.pool.closeall()
+        self.pool = None
+        self.last_used = {}
+
+
+class AsyncLSDPool:
+    """
+    asyncio front end for `LSDPool`. psycopg2 has no native async support,
+    so queries run in worker threads with at most `maxconn` in flight.
+    """
+
+    def __init__(self, maxconn, dsn=None, health_check_interval=30.0):
+        self.pool = LSDPool(maxconn, dsn, health_check_interval)
+        self.semaphore = asyncio.Semaphore(maxconn)
+
+    async def fetch_text(self, url):
+        async with self.semaphore:
+            return await asyncio.to_thread(self.pool.fetch_text, url)
+
+    async def fetch_many(self, urls):
+        async with self.semaphore:
+            return await asyncio.to_thread(self.pool.fetch_many, urls)
+
+    async def close(self):
+        await asyncio.to_thread(self.pool.closeall)
+
 
-lsd_conn = psycopg2.connect(
-    f"host='{config.LSD_HOST}' dbname='{config.LSD_DB}' password='{config.LSD_PASSWORD}'")
+def _alive(conn):
+    try:
+        with conn.cursor() as curs:
+            curs.execute("SELECT 1")
+            curs.fetchone()
+        return True
+    except psycopg2.Error:
+        return False
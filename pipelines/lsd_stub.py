@@ -0,0 +1,139 @@
+import argparse
+import json
+import re
+import socketserver
+import struct
+import threading
+
+SOURCE = re.compile(r"FROM\s+(\S+)\s*\|>\s*SELECT\s+(?:(\d+)\s+as\s+position,\s*)?TEXT", re.I)
+
+
+class LSDStubHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough of the Postgres v3 simple-query protocol for psycopg2
+    to connect and run LSD `FROM <url> |> SELECT TEXT` queries, answering
+    from the server's `pages` dict instead of the network.
+    """
+
+    def read_message(self, typed=True):
+        header = self.rfile.read(5 if typed else 4)
+        if len(header) < (5 if typed else 4):
+            return None, b""
+        if typed:
+            kind, length = header[:1], struct.unpack("!I", header[1:])[0]
+        else:
+            kind, length = b"", struct.unpack("!I", header)[0]
+        return kind, self.rfile.read(length - 4)
+
+    def send(self, kind, payload=b""):
+        self.wfile.write(kind + struct.pack("!I", len(payload) + 4) + payload)
+
+    def ready(self):
+        self.send(b"Z", b"I")
+        self.wfile.flush()
+
+    def handle(self):
+        _, startup = self.read_message(typed=False)
+        # SSLRequest: decline and wait for the real startup packet
+        if startup[:4] == struct.pack("!I", 80877103):
+            self.wfile.write(b"N")
+            self.wfile.flush()
+            _, startup = self.read_message(typed=False)
+
+        self.send(b"R", struct.pack("!I", 0))
+        for key, value in (
+            ("server_version", "14.0"),
+            ("server_encoding", "UTF8"),
+            ("client_encoding", "UTF8"),
+            ("DateStyle", "ISO, MDY"),
+            ("integer_datetimes", "on"),
+            ("standard_conforming_strings", "on"),
+        ):
+            self.send(b"S", key.encode() + b"\0" + value.encode() + b"\0")
+        self.send(b"K", struct.pack("!II", 1, 1))
+        self.ready()
+
+        while True:
+            kind, payload = self.read_message()
+            if kind in (None, b"X"):
+                return
+            if kind == b"Q":
+                self.answer(payload.rstrip(b"\0").decode("utf-8"))
+            else:
+                self.error(f"Unsupported message {kind!r}")
+            self.ready()
+
+    def answer(self, query):
+        sources = SOURCE.findall(query)
+        if not sources:
+            # Health checks, BEGIN/ROLLBACK and anything else get an empty OK
+            if query.strip().upper().startswith("SELECT"):
+                self.rows(["?column?"], [["1"]])
+            else:
+                self.send(b"C", query.strip().split()[0].upper().encode() + b"\0")
+            return
+
+        batched = any(position for _, position in sources)
+        rows = []
+        for url, position in sources:
+            text = self.server.pages.get(url)
+            if text is not None:
+                rows.append([position, text] if batched else [text])
+        self.rows(["position", "text"] if batched else ["text"], rows)
+
+    def rows(self, columns, rows):
+        description = struct.pack("!H", len(columns))
+        for column in columns:
+            # Every column is sent as text (OID 25)
+            description += column.encode() + b"\0" + struct.pack("!IHIhih", 0, 0, 25, -1, -1, 0)
+        self.send(b"T", description)
+
+        for row in rows:
+            data = struct.pack("!H", len(row))
+            for value in row:
+                encoded = str(value).encode("utf-8")
+                data += struct.pack("!i", len(encoded)) + encoded
+            self.send(b"D", data)
+        self.send(b"C", f"SELECT {len(rows)}".encode() + b"\0")
+
+    def error(self, message):
+        fields = b"SERROR\0C0A000\0M" + message.encode() + b"\0\0"
+        self.send(b"E", fields)
+
+
+class LSDStub(socketserver.ThreadingTCPServer):
+    """
+    Local stand-in for LSD. `pages` maps URL to the text LSD would return.
+
+    Start it on port 0 and point `LSD_DSN` (or `LSDPool(dsn=...)`) at
+    `stub.dsn` to exercise the pipeline without network access.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, pages, host="127.0.0.1", port=0):
+        super().__init__((host, port), LSDStubHandler)
+        self.pages = pages
+
+    @property
+    def dsn(self):
+        host, port = self.server_address[:2]
+        return f"host={host} port={port} dbname=lsd user=lsd sslmode=disable"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local LSD stub")
+    parser.add_argument("pages", help="JSON file mapping URL to page text")
+    parser.add_argument("--port", type=int, default=5433)
+    args = parser.parse_args()
+
+    with open(args.pages, encoding="utf-8") as f:
+        stub = LSDStub(json.load(f), port=args.port)
+    print(f"LSD stub listening, LSD_DSN='{stub.dsn}'")
+    stub.serve_forever()
@@ -1,78 +1,132 @@
-import os
-import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from logging import error
+from urllib.parse import urlparse
 
+import config
 from alive_progress import alive_bar
-from bs4 import BeautifulSoup
-from lsd import lsd_conn
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
+from corpus import CorpusWriter, content_hash
+from discovery import STRATEGIES, discover
+from lsd import LSDPool
 from utils.cleaning import clean_text
+from utils.manifest import Manifest
+from utils.ratelimit import HostRateLimiter, retry
 from yaspin import yaspin
 from yaspin.spinners import Spinners
 
-url = "https://www.tetragrammaton.com/articles"
-article_extensions = set()
-articles_data = []
-
-
-with yaspin(Spinners.earth, text="Loading Chrome webdriver") as sp:
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    service = Service()  # type: ignore
-    driver = webdriver.Chrome(service=service, options=chrome_options)
-
-with yaspin(Spinners.earth, text="Traversing links") as sp:
-    driver.get(url)
-
-    scroll_pause_time = 2
-    last_height = driver.execute_script("return document.body.scrollHeight")
-
-    while True:
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(scroll_pause_time)
-        new_height = driver.execute_script("return document.body.scrollHeight")
-
-        if new_height == last_height:
-            break
-        last_height = new_height
-
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-
-    driver.quit()
-
-    for a in soup.find_all("a", href=True):
-        if a["href"].startswith("/content"):  # type: ignore
-            article_extensions.add(a["href"].split("#")[0])  # type: ignore
-
-
-with alive_bar(len(article_extensions), spinner="dots_waves", title_length=60) as bar:
-    for extension in article_extensions:
-        sub_url = f"https://www.tetragrammaton.com{extension}"
-        bar.title(f"Parsing {sub_url}")
+base_url = "https://www.tetragrammaton.com"
+url = f"{base_url}/articles"
+output_dir = config.CORPUS_DIR
+manifest_path = f"{output_dir}/manifest.jsonl"
+
+
+def fetch_text(pool, limiter, sub_url):
+    limiter.wait(sub_url)
+    return pool.fetch_text(sub_url)
+
+
+def scrape_article(pool, limiter, manifest, writer, extension, retries):
+    """
+    Fetch, clean and store one article. Returns "written", "unchanged" or
+    "empty".
+    """
+    sub_url = f"{base_url}{extension}"
+    text = retry(lambda: fetch_text(pool, limiter, sub_url), retries=retries)
+    if not text:
+        return "empty"
+
+    content = clean_text(text)
+    digest = content_hash(content)
+
+    previous = manifest.get(sub_url)
+    if previous is None or previous["hash"] != digest:
+        writer.write(sub_url, content)
+        status = "written"
+    else:
+        status = "unchanged"
+
+    manifest.record(sub_url, digest)
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape articles through LSD")
+    parser.add_argument("--workers", type=int, default=config.SCRAPE_WORKERS)
+    parser.add_argument(
+        "--rate", type=float, default=config.SCRAPE_RATE_PER_HOST,
+        help="Maximum requests started per second per host",
+    )
+    parser.add_argument("--retries", type=int, default=config.SCRAPE_RETRIES)
+    parser.add_argument(
+        "--max-age-hours", type=float, default=None,
+        help="Refetch articles older than this; by default fetched articles are skipped",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Refetch every article"
+    )
+    parser.add_argument(
+        "--discovery", choices=("auto", *STRATEGIES), default="auto",
+        help="How to find article links; auto falls back to Selenium last",
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only discover articles that aren't in the manifest yet",
+    )
+    args = parser.parse_args()
+
+    manifest = Manifest(manifest_path)
+    max_age = args.max_age_hours * 3600 if args.max_age_hours is not None else None
+
+    with yaspin(Spinners.earth, text="Discovering links") as sp:
+        known = {urlparse(known_url).path for known_url in manifest.entries}
+        article_extensions = discover(
+            base_url, url, args.discovery, known, args.incremental
+        )
+    pending = [
+        extension
+        for extension in sorted(article_extensions)
+        if args.force or not manifest.is_fresh(f"{base_url}{extension}", max_age)
+    ]
+
+    writer = CorpusWriter(output_dir, config.CORPUS_SHARD_MB * 1024 * 1024)
+    pool = LSDPool(args.workers)
+    limiter = HostRateLimiter(args.rate)
+    counts = {"written": 0, "unchanged": 0, "empty": 0, "failed": 0}
+
+    with alive_bar(len(pending), spinner="dots_waves", title_length=60) as bar, \
+            ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(
+                scrape_article,
+                pool,
+                limiter,
+                manifest,
+                writer,
+                extension,
+                args.retries,
+            ): extension
+            for extension in pending
+        }
+
+        for future in as_completed(futures):
+            extension = futures[future]
+            bar.title(f"Parsed {base_url}{extension}")
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                error(f"Error scraping {extension}: {e}")
+                counts["failed"] += 1
+            bar()
 
-        output_file = f"../datasets/raw/{extension}.txt"
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    pool.closeall()
+    writer.close()
+    manifest.close()
 
-        with lsd_conn.cursor() as curs:
-            curs.execute(
-                f"""
-                FROM {sub_url}
-                |> SELECT TEXT as text
-                """
-            )
-            res = curs.fetchone()
+    print(
+        f"{len(pending)} scraped, {len(article_extensions) - len(pending)} skipped: "
+        + ", ".join(f"{count} {status}" for status, count in counts.items())
+    )
 
-            try:
-                with open(output_file, "w", encoding="utf-8") as f:
-                    f.write(
-                        "URL: {sub_url}\n" + clean_text(res[0])
-                        if res
-                        else bar.title("No text found")
-                    )
-            except Exception as e:
-                error(f"Error writing to file: {e}")
-                continue
 
-        bar()
+if __name__ == "__main__":
+    main()
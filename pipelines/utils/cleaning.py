@@ -1,36 +1,93 @@
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+
+# Rules are compiled once at import. Two of the original markdown rules,
+# `!\[\]\((.*?)\)` and `\!\[\]\(\)`, are dropped: both only match text of
+# the form `[](...)` on one line, which the link rule has already removed
+# by the time they ran, so they never changed the output.
+LINK = re.compile(r"\[.*?\]\(.*?\)")
+BLANK_LINES = re.compile(r"\n\s*\n")
+MENU = re.compile(r"Open Menu|Close Menu", flags=re.IGNORECASE)
+HEADER = re.compile(r"##\s+")
+NEWLINE_RUN = re.compile(r"\n{3,}")
+
+SERIAL_BATCH_SIZE = 64
+
+
+def clean_text_lines(lines):
+    """
+    Streaming form of `clean_text`: yields pieces of the cleaned output for
+    an iterable of lines (e.g. an open file) without holding the whole
+    document in memory. `"".join(clean_text_lines(...))` equals `clean_text`
+    on the concatenated input.
+    """
+    blank_run = 0
+    started = False
+    for raw in lines:
+        # Split on every boundary str.splitlines() knows, not just "\n"
+        for line in raw.splitlines() or [""]:
+            line = line.strip()
+            if not line:
+                blank_run += 1
+                continue
+            if started:
+                # k blank lines between two lines collapse to at most one
+                yield "\n\n" if blank_run else "\n"
+            started = True
+            blank_run = 0
+            yield line
 
 
 def clean_text(text):
     # Remove trailing and leading spaces from each line
-    text = "\n".join(line.strip() for line in text.splitlines())
+    text = "\n".join([line.strip() for line in text.splitlines()])
 
     # Replace multiple blank lines (more than 2) with just one blank line
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    if "\n\n\n" in text:
+        text = NEWLINE_RUN.sub("\n\n", text)
 
     return text.strip()
 
 
 def clean_markdown(md_text):
     # Remove navigation menu items (links in square brackets)
-    md_text = re.sub(r"\[.*?\]\(.*?\)", "", md_text)
+    if "](" in md_text:
+        md_text = LINK.sub("", md_text)
 
     # Remove excessive whitespace
-    md_text = re.sub(r"\n\s*\n", "\n\n", md_text)
-
-    # Preserve and format image links properly
-    md_text = re.sub(r"!\[\]\((.*?)\)", r"![Image](\1)", md_text)
-
-    # Remove broken image links and empty markdown elements
-    md_text = re.sub(r"\!\[\]\(\)", "", md_text)
+    md_text = BLANK_LINES.sub("\n\n", md_text)
 
     # Remove repeated 'Close Menu' and other UI elements
-    md_text = re.sub(r"Open Menu|Close Menu", "", md_text, flags=re.IGNORECASE)
+    md_text, removed = MENU.subn("", md_text)
 
     # Preserve section headers
-    md_text = re.sub(r"##\s+", "## ", md_text)
+    if "##" in md_text:
+        md_text = HEADER.sub("## ", md_text)
 
-    # Trim excessive newlines
-    md_text = re.sub(r"\n{3,}", "\n\n", md_text)
+    # Trim excessive newlines; only menu removal can create new runs here
+    if removed:
+        md_text = NEWLINE_RUN.sub("\n\n", md_text)
 
     return md_text.strip()
+
+
+CLEANERS = {"text": clean_text, "markdown": clean_markdown}
+
+
+def clean_many(texts, kind="text", processes=None, chunksize=None):
+    """
+    Clean a batch of documents, fanning out across a process pool. Small
+    batches are cleaned in-process since pool startup would dominate.
+    """
+    cleaner = CLEANERS[kind]
+    texts = list(texts)
+    if len(texts) < SERIAL_BATCH_SIZE or processes == 1:
+        return [cleaner(text) for text in texts]
+
+    processes = processes or os.cpu_count() or 1
+    # A few large chunks per worker keeps pickling overhead per document low
+    chunksize = chunksize or max(1, len(texts) // (processes * 4))
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(cleaner, texts, chunksize=chunksize))
@@ -0,0 +1,63 @@
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+
+class Manifest:
+    """
+    Append-only checkpoint of scraped articles.
+
+    Each line records a URL, the hash of its cleaned content and when it was
+    fetched. The last line for a URL wins, so a crash mid-run loses at most
+    the articles that were still in flight.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from an interrupted run
+                        continue
+                    self.entries[entry["url"]] = entry
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def get(self, url):
+        return self.entries.get(url)
+
+    def is_fresh(self, url, max_age_seconds):
+        """
+        Whether the URL was fetched recently enough to skip this run.
+        """
+        entry = self.entries.get(url)
+        if entry is None:
+            return False
+        if max_age_seconds is None:
+            return True
+        fetched_at = datetime.fromisoformat(entry["fetched_at"])
+        age = datetime.now(timezone.utc) - fetched_at
+        return age.total_seconds() < max_age_seconds
+
+    def record(self, url, content_hash, **extra):
+        entry = {
+            "url": url,
+            "hash": content_hash,
+            "fetched_at": datetime.now(timezone.utc).isoformat(),
+            **extra,
+        }
+        with self.lock:
+            self.entries[url] = entry
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
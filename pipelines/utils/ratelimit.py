@@ -0,0 +1,43 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class HostRateLimiter:
+    """
+    Spaces out requests to each host so that at most `rate` start per second,
+    no matter how many worker threads are running.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def retry(fn, retries=3, base_delay=1.0, max_delay=30.0):
+    """
+    Call `fn`, retrying on any exception with exponential backoff and jitter.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception:
+            if attempt == retries:
+                raise
+            delay = min(max_delay, base_delay * 2**attempt)
+            time.sleep(delay * random.uniform(0.5, 1.0))
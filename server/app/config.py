@@ -1,4 +1,7 @@
+from typing import List, Optional
+
 from dotenv import load_dotenv
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 load_dotenv()
@@ -13,7 +16,205 @@ class Settings(BaseSettings):
     chroma_global_store: str
     chroma_user_store: str
 
+    chroma_host: str = "chromadb"
+    # "http" talks to the Chroma server, "embedded" runs Chroma in-process
+    chroma_mode: str = "http"
+    # On-disk location for embedded Chroma; unset keeps it in memory
+    chroma_path: Optional[str] = None
+    # Warmup retries opening the store (e.g. while Chroma is still starting)
+    # after this many seconds, doubling up to the max
+    vector_store_retry_seconds: float = 1.0
+    vector_store_retry_max_seconds: float = 30.0
+
+    # "chroma" stores vectors in Chroma (see chroma_mode); "hnsw" keeps them in
+    # an in-process HNSW index over quantized vectors
+    vector_backend: str = "chroma"
+    # Directory for the hnsw backend, unset keeps it in memory. Only one
+    # process may open it, so run a single API worker and stop the server
+    # before reindexing into it.
+    vector_index_path: Optional[str] = None
+    # Every write is logged to disk before it returns; a full snapshot every
+    # this many seconds (and on shutdown) keeps the log short. 0 snapshots
+    # only on shutdown.
+    hnsw_snapshot_seconds: float = 300.0
+    # Deleted rows stay in the graph until a snapshot finds at least this
+    # share of all rows deleted and compacts them away
+    hnsw_compact_ratio: float = 0.25
+    # "int8" (4x smaller than float32) or "binary" (32x); candidates are
+    # rescored with the full-precision vectors either way
+    vector_quantization: str = "int8"
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 100
+    hnsw_ef_search: int = 64
+    # Candidates rescored with full vectors per requested result; unset uses 4
+    # for int8 and 16 for binary
+    vector_rescore_factor: Optional[int] = None
+    # Queries over at most this many (matching) rows skip the graph and scan
+    vector_exact_search_rows: int = 2048
+
+    embedding_model: str = "BAAI/bge-m3"
+    embedding_batch_size: int = 32
+    embedding_batch_wait_ms: float = 5.0
+    embedding_queue_size: int = 1024
+    embedding_cache_max_bytes: int = 256 * 1024 * 1024
+    embedding_cache_dir: Optional[str] = None
+    embedding_cache_disk_entries: int = 100_000
+    # "torch" runs the SentenceTransformer model as is; "onnx" runs an int8
+    # ONNX export of it with ONNX Runtime (see app.services.onnx_embedding)
+    embedding_backend: str = "torch"
+    # Directory of the ONNX export, created on first start if missing;
+    # unset uses models/onnx/<model name>
+    embedding_onnx_path: Optional[str] = None
+    # ONNX Runtime threads per encode call; 0 uses every physical core, so
+    # with several prefork workers use cores / workers instead
+    embedding_onnx_threads: int = 0
+    # Padded tokens per ONNX batch; long texts run in smaller batches
+    embedding_onnx_batch_tokens: int = 16384
+
+    # Users with more documents than this get their own collection; 0 disables
+    user_shard_threshold: int = 0
+
+    # "dense" for vector-only lookups, "hybrid" to fuse with BM25
+    retrieval_mode: str = "dense"
+    hybrid_candidate_multiplier: int = 4
+    rrf_k: int = 60
+    dedupe_threshold: float = 0.8
+    rerank_model: Optional[str] = None
+    rerank_budget_ms: float = 150.0
+    # How often hybrid retrieval checks the BM25 index against the global
+    # store, rebuilding it when another process has changed the store
+    bm25_resync_seconds: float = 300.0
+
+    ingest_chunk_size: int = 1000
+    ingest_chunk_overlap: int = 200
+    ingest_batch_size: int = 64
+    ingest_read_size: int = 64 * 1024
+    ingest_spool_dir: Optional[str] = None
+    # Upload job progress, shared by all workers on the host; unset uses
+    # "ingest-jobs" under the system temp directory
+    ingest_jobs_dir: Optional[str] = None
+    # pipelines/ directory whose corpus module reads the corpus when
+    # reindexing; unset uses the one next to server/ in the checkout
+    pipelines_dir: Optional[str] = None
+    reindex_batch_size: int = 256
+    # Texts per model forward pass when reindexing, independent of the
+    # request-path embedding_batch_size
+    reindex_embed_batch_size: int = 64
+
+    llm_max_connections: int = 100
+    llm_max_keepalive_connections: int = 20
+    llm_keepalive_expiry: float = 30.0
+    groq_timeout_seconds: float = 30.0
+    groq_max_concurrency: int = 32
+    gemini_timeout_seconds: float = 60.0
+    gemini_max_concurrency: int = 16
+    # Point the LLM clients at another endpoint, e.g. the bench fake servers
+    groq_base_url: Optional[str] = None
+    gemini_base_url: Optional[str] = None
+    xai_base_url: str = "https://api.x.ai/v1"
+    xai_timeout_seconds: float = 30.0
+    xai_max_concurrency: int = 32
+
+    # provider:model candidates per task, in order of preference until the
+    # router has latency numbers for them
+    llm_query_backends: List[str] = [
+        "groq:llama3-8b-8192",
+        "xai:grok-2-1212",
+        "gemini:gemini-2.0-flash",
+    ]
+    llm_vibe_backends: List[str] = [
+        "gemini:gemini-2.0-pro-exp-02-05",
+        "gemini:gemini-2.0-flash",
+        "groq:llama-3.3-70b-versatile",
+    ]
+    # Requests kept per backend for rolling latency and error stats
+    llm_stats_window: int = 200
+    # Samples needed before a backend's p95 is trusted as a hedge trigger
+    llm_min_samples: int = 20
+    # Backends failing more often than this are only used as a last resort
+    llm_max_error_rate: float = 0.25
+    llm_hedge_enabled: bool = True
+    # Fixed hedge delay; unset hedges at the primary's rolling p95
+    llm_hedge_delay_ms: Optional[float] = None
+    # Cap on the share of recent requests that may be hedged
+    llm_hedge_max_ratio: float = 0.1
+    llm_breaker_failures: int = 5
+    llm_breaker_cooldown_seconds: float = 30.0
+
+    ocr_max_image_side: int = 1600
+    ocr_jpeg_quality: int = 85
+    ocr_passthrough_bytes: int = 512 * 1024
+    ocr_cache_max_bytes: int = 16 * 1024 * 1024
+    ocr_cache_ttl_seconds: float = 3600.0
+    # OCR each image in its own request instead of one shared prompt
+    ocr_per_image: bool = False
+
+    response_cache_query_enabled: bool = True
+    response_cache_vibe_enabled: bool = True
+    response_cache_semantic_enabled: bool = True
+    # Vibe prompts carry OCR'd private messages, so near matches are only
+    # reused for the same client and the semantic tier is off by default
+    response_cache_vibe_semantic: bool = False
+    response_cache_max_entries: int = 2048
+    response_cache_ttl_seconds: float = 900.0
+    response_cache_similarity_threshold: float = 0.97
+
+    # Tokenizer used to budget RAG prompts; unset to estimate from characters.
+    # The routed models' own tokenizers differ (and aren't all published), so
+    # counts are multiplied by the margin before being compared against the
+    # smallest context window among a task's backends.
+    prompt_tokenizer: Optional[str] = "BAAI/bge-m3"
+    prompt_token_margin: float = 1.25
+    # Tokens kept free in the model's window for the completion
+    prompt_reserved_output_tokens: int = 1024
+    # Cap on retrieved context per prompt, below whatever the window allows
+    prompt_context_tokens: int = 3072
+    prompt_max_chunk_tokens: int = 768
+    prompt_min_chunk_tokens: int = 64
+    prompt_max_query_tokens: int = 1024
+
+    # Prometheus metrics and timing spans; off makes instrumentation a no-op
+    metrics_enabled: bool = True
+    # Fraction of requests traced with OpenTelemetry when an OTLP endpoint is set
+    trace_sample_rate: float = 0.05
+    trace_otlp_endpoint: Optional[str] = None
+    trace_service_name: str = "y-server"
+
+    # Rate limits and concurrency gates; off admits everything
+    admission_enabled: bool = True
+    # Token buckets per user and per client IP (requests/second, burst size);
+    # a rate of 0 disables that limit. The Streamlit frontends call the API
+    # from one host, so their end users share one IP bucket: its default is
+    # a ceiling for that whole host rather than a per-person limit. Lower it
+    # behind a proxy with rate_limit_trust_forwarded, where each client gets
+    # its own bucket; set it to 0 only if something upstream limits bursts.
+    rate_limit_user_rps: float = 2.0
+    rate_limit_user_burst: float = 10.0
+    rate_limit_ip_rps: float = 20.0
+    rate_limit_ip_burst: float = 60.0
+    rate_limit_max_keys: int = 10000
+    # Take the client IP from X-Forwarded-For (only behind a trusted proxy)
+    rate_limit_trust_forwarded: bool = False
+    # Concurrent requests per class of work, per worker
+    admission_ocr_limit: int = 8
+    admission_llm_limit: int = 64
+    admission_embedding_limit: int = 32
+    # Requests allowed to wait for a slot, and for how long, before a 503
+    admission_queue_size: int = 128
+    admission_queue_timeout_seconds: float = 10.0
+
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
+    @model_validator(mode="after")
+    def check_chunking(self) -> "Settings":
+        # Chunk cuts land in the second half of a chunk; a larger overlap
+        # would stop the chunker from making progress
+        if not 0 <= self.ingest_chunk_overlap < self.ingest_chunk_size // 2:
+            raise ValueError(
+                "ingest_chunk_overlap must be at least 0 and under half of "
+                "ingest_chunk_size"
+            )
+        return self
+
 
 settings = Settings()
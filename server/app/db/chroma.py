@@ -1,10 +1,49 @@
-from contextlib import asynccontextmanager
-from typing import AsyncGenerator, List
+import asyncio
+import hashlib
+import time
+from typing import List, Optional
 
-from sentence_transformers import SentenceTransformer
+from fastapi import HTTPException
 
-import chromadb
 from app.config import settings
+from app.db.embedded import EmbeddedChromaClient, EmbeddedClient
+from app.db.hnsw import QuantizedClient
+from app.services.bm25 import BM25Index
+from app.services.embedding import EmbeddingBatcher
+from app.services.embedding_cache import EmbeddingCache
+from app.services.retrieval import (dedupe_hits, merge_hits,
+                                    reciprocal_rank_fusion, rerank_hits)
+from app.services.startup import startup_timings
+from app.services.telemetry import telemetry
+
+EMBEDDING_MODEL = settings.embedding_model
+USER_SHARD_PREFIX = "user_store__"
+
+_embedding_model = None
+
+
+def load_embedding_model():
+    """
+    Load the embedding model once per process.
+
+    Heavy imports happen here rather than at module import. The prefork
+    server (`app.serve`) calls this before forking so workers share the
+    weights copy-on-write instead of each loading their own copy.
+    """
+    global _embedding_model
+    if _embedding_model is None and settings.embedding_backend == "onnx":
+        with startup_timings.phase("import onnxruntime"):
+            import onnxruntime  # noqa: F401
+
+            from app.services import onnx_embedding
+        with startup_timings.phase("load embedding model"):
+            _embedding_model = onnx_embedding.load()
+    elif _embedding_model is None:
+        with startup_timings.phase("import sentence_transformers"):
+            from sentence_transformers import SentenceTransformer
+        with startup_timings.phase("load embedding model"):
+            _embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+    return _embedding_model
 
 
 class VectorStore:
@@ -12,59 +51,235 @@ class VectorStore:
     Handles vector embedding and storage in ChromaDB.
     """
 
-    def __init__(self, chroma_client, embedding_model, global_store, user_store):
+    def __init__(
+        self, chroma_client, embedding_model, global_store, user_store, user_shards=None
+    ):
         self.chroma_client = chroma_client
         self.embedding_model = embedding_model
         self.global_store = global_store
         self.user_store = user_store
+        self.user_shards = user_shards or {}
+        # Shards being filled: new writes already go there, reads don't yet
+        self.moving_shards = {}
+        self.embedder = EmbeddingBatcher(
+            self._encode_batch,
+            max_batch_size=settings.embedding_batch_size,
+            max_wait_ms=settings.embedding_batch_wait_ms,
+            max_queue_size=settings.embedding_queue_size,
+        )
+        # The int8 ONNX export gives slightly different vectors than torch,
+        # so each backend gets its own cache entries
+        self.embedding_cache = EmbeddingCache(
+            f"{EMBEDDING_MODEL}:{settings.embedding_backend}",
+            max_bytes=settings.embedding_cache_max_bytes,
+            disk_dir=settings.embedding_cache_dir,
+            disk_capacity=settings.embedding_cache_disk_entries,
+        )
+        self.keyword_index = BM25Index()
+        self.keyword_synced_at = time.monotonic()
+        self._keyword_sync: Optional[asyncio.Task] = None
+        self.cross_encoder = None
 
     @classmethod
     async def create(cls, chroma_client) -> "VectorStore":
         """
         Async factory method for initializing VectorStore.
         """
-        embedding_model = SentenceTransformer("BAAI/bge-m3")
+        # Loading the model takes seconds, keep it off the event loop
+        embedding_model = await asyncio.to_thread(load_embedding_model)
 
         global_store = await chroma_client.get_or_create_collection(name="global_store")
         user_store = await chroma_client.get_or_create_collection(name="user_store")
 
-        return cls(chroma_client, embedding_model, global_store, user_store)
+        user_shards = {}
+        for name in await chroma_client.list_collections():
+            if name.startswith(USER_SHARD_PREFIX):
+                user_shards[name[len(USER_SHARD_PREFIX) :]] = (
+                    await chroma_client.get_collection(name=name)
+                )
+
+        vector_store = cls(
+            chroma_client, embedding_model, global_store, user_store, user_shards
+        )
+        vector_store.embedder.start()
+        return vector_store
+
+    async def load_retrieval_models(self, page_size: int = 5000) -> None:
+        """
+        Build the BM25 index over the global store and load the reranker,
+        when hybrid retrieval is enabled.
+        """
+        if settings.retrieval_mode != "hybrid":
+            return
+
+        self.keyword_index = await self._build_keyword_index(page_size)
+        self.keyword_synced_at = time.monotonic()
+
+        if settings.rerank_model:
+            from sentence_transformers import CrossEncoder
+
+            self.cross_encoder = await asyncio.to_thread(
+                CrossEncoder, settings.rerank_model
+            )
+
+    async def _build_keyword_index(self, page_size: int = 5000) -> BM25Index:
+        index = BM25Index()
+        offset = 0
+        while True:
+            page = await self.global_store.get(
+                include=["documents"], limit=page_size, offset=offset
+            )
+            if not page["ids"]:
+                break
+            for doc_id, text in zip(page["ids"], page["documents"]):
+                index.add(doc_id, text)
+            offset += len(page["ids"])
+        return index
+
+    def _maybe_resync_keywords(self) -> None:
+        """
+        Other processes (reindex, other workers) write to the global store
+        too, so every `bm25_resync_seconds` compare the collection's ids
+        with the index and rebuild it in the background when they differ.
+        """
+        if (
+            self._keyword_sync is not None
+            or time.monotonic() - self.keyword_synced_at < settings.bm25_resync_seconds
+        ):
+            return
+        self._keyword_sync = asyncio.create_task(self._resync_keywords())
+
+    async def _resync_keywords(self, page_size: int = 5000) -> None:
+        try:
+            # Ids are content hashes (document_id, reindex chunk ids), so
+            # edits that keep the count still change the fingerprint
+            fingerprint = 0
+            offset = 0
+            while True:
+                page = await self.global_store.get(
+                    include=[], limit=page_size, offset=offset
+                )
+                if not page["ids"]:
+                    break
+                fingerprint ^= ids_fingerprint(page["ids"])
+                offset += len(page["ids"])
+            if fingerprint != ids_fingerprint(list(self.keyword_index.texts)):
+                self.keyword_index = await self._build_keyword_index(page_size)
+        except Exception as e:
+            print("Error resyncing keyword index:", e)
+        finally:
+            self.keyword_synced_at = time.monotonic()
+            self._keyword_sync = None
+
+    async def close(self) -> None:
+        if self._keyword_sync is not None:
+            self._keyword_sync.cancel()
+        await self.embedder.stop()
+        self.embedding_cache.close()
+        await close_vector_client(self.chroma_client)
+
+    def _encode_batch(self, texts: List[str]) -> List[List[float]]:
+        return self.embedding_model.encode(texts, batch_size=len(texts))
 
     async def embed_text(self, text: str) -> List[float]:
         """
         Generate embeddings for a given text.
         """
-        return self.embedding_model.encode(text)
+        vector = self.embedding_cache.get(text)
+        if vector is not None:
+            return vector
+
+        with telemetry.span("embed", texts=1):
+            vector = await self.embedder.embed(text)
+        self.embedding_cache.put(text, vector)
+        return vector
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generate embeddings for several texts, encoding only cache misses.
+        """
+        vectors = [self.embedding_cache.get(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+        if missing:
+            with telemetry.span("embed", texts=len(missing)):
+                encoded = await self.embedder.embed_many([texts[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                self.embedding_cache.put(texts[i], vector)
+                vectors[i] = vector
+
+        return vectors
+
+    async def index_chunks(
+        self,
+        chunks: List[str],
+        source: str,
+        user_id: Optional[int] = None,
+    ) -> int:
+        """
+        Embed a batch of chunks and upsert them in one call, into the global
+        store or, if `user_id` is given, that user's collection.
+        """
+        if not chunks:
+            return 0
+
+        namespace = str(user_id) if user_id is not None else "global"
+        metadata = {"source": source}
+        if user_id is not None:
+            metadata["user_id"] = str(user_id)
+        collection = (
+            self.user_collection(user_id, writing=True)
+            if user_id is not None
+            else self.global_store
+        )
+
+        ids = [document_id(namespace, chunk) for chunk in chunks]
+        vectors = await self.embed_texts(chunks)
+        with telemetry.span("chroma.upsert", collection=collection.name):
+            await collection.upsert(
+                ids=ids,
+                documents=chunks,
+                metadatas=[metadata for _ in chunks],
+                embeddings=vectors,
+            )
+        if user_id is None:
+            self._index_keywords(ids, chunks)
+        return len(chunks)
 
     async def index_global_knowledge(self, doc_text: str) -> None:
         """
         Store external knowledge in the global vector DB.
         """
+        doc_id = document_id("global", doc_text)
         vector = await self.embed_text(doc_text)
-        await self.global_store.add(documents=[{"text": doc_text}], embeddings=[vector])
+        await self.global_store.upsert(
+            ids=[doc_id],
+            documents=[doc_text],
+            embeddings=[vector],
+        )
+        self._index_keywords([doc_id], [doc_text])
 
     async def index_user_doc(self, user_id: int, doc_text: str) -> None:
         """
         Store user-uploaded documents in the user vector DB.
         """
         vector = await self.embed_text(doc_text)
-        await self.user_store.add(
-            documents=[{"user_id": user_id, "text": doc_text}], embeddings=[vector]
+        collection = self.user_collection(user_id, writing=True)
+        await collection.upsert(
+            ids=[document_id(str(user_id), doc_text)],
+            documents=[doc_text],
+            metadatas=[{"user_id": str(user_id)}],
+            embeddings=[vector],
         )
+        await self.maybe_shard_user(user_id)
 
     async def retrieve_global_knowledge(self, query: str, top_k: int = 3) -> List[str]:
         """
         Retrieve relevant external knowledge based on query.
         """
         query_vector = await self.embed_text(query)
-        results = await self.global_store.query(
-            query_embeddings=[query_vector], n_results=top_k
-        )
-
-        if not results or "documents" not in results or not results["documents"]:
-            return []
-
-        return [doc["text"] for doc in results["documents"][0]]
+        hits = await self._query_global_hits(query, query_vector, top_k)
+        return [hit["text"] for hit in hits]
 
     async def retrieve_user_docs(
         self, user_id: int, query: str, top_k: int = 3
@@ -73,33 +288,389 @@ class VectorStore:
         Retrieve relevant user-specific documents.
         """
         query_vector = await self.embed_text(query)
-        results = await self.user_store.query(
-            query_embeddings=[query_vector], n_results=top_k
+        hits = await self._query_user_hits(user_id, query_vector, top_k)
+        return [hit["text"] for hit in hits]
+
+    async def retrieve_context(
+        self, query: str, user_id: Optional[int] = None, top_k: int = 3
+    ) -> dict:
+        """
+        Embed the query once and search the global and user stores concurrently.
+
+        Returns the hits from each store, a merged list ordered by score
+        (normalised per store, as hybrid and dense scores differ in scale),
+        the query's embedding and per-stage timings in milliseconds.
+        """
+        started = time.perf_counter()
+        query_vector = await self.embed_text(query)
+        timings = {"embed_ms": _elapsed_ms(started)}
+
+        async def search(name: str, hits_coro) -> List[dict]:
+            search_started = time.perf_counter()
+            hits = await hits_coro
+            timings[f"{name}_ms"] = _elapsed_ms(search_started)
+            for hit in hits:
+                hit["source"] = name
+            return hits
+
+        searches = [
+            search("global", self._query_global_hits(query, query_vector, top_k))
+        ]
+        if user_id:
+            searches.append(
+                search("user", self._query_user_hits(user_id, query_vector, top_k))
+            )
+
+        results = await asyncio.gather(*searches)
+        global_hits = results[0]
+        user_hits = results[1] if user_id else []
+
+        timings["total_ms"] = _elapsed_ms(started)
+
+        return {
+            "global": global_hits,
+            "user": user_hits,
+            "merged": merge_hits(global_hits, user_hits),
+            "query_vector": query_vector,
+            "timings": timings,
+        }
+
+    def user_collection(self, user_id: int, writing: bool = False):
+        """
+        The collection holding a user's documents: their own shard if they
+        have one, otherwise the shared user store. While a shard is being
+        filled, writes already go to it.
+        """
+        if writing and str(user_id) in self.moving_shards:
+            return self.moving_shards[str(user_id)]
+        return self.user_shards.get(str(user_id), self.user_store)
+
+    async def maybe_shard_user(self, user_id: int) -> None:
+        """
+        Move a user's documents out of the shared user store once they pass
+        `user_shard_threshold`, so their queries only scan their own vectors.
+        """
+        threshold = settings.user_shard_threshold
+        key = str(user_id)
+        if threshold <= 0 or key in self.user_shards or key in self.moving_shards:
+            return
+
+        where = {"user_id": key}
+        existing = await self.user_store.get(where=where, include=[])
+        if len(existing["ids"]) < threshold or key in self.moving_shards:
+            return
+
+        shard = await self.chroma_client.get_or_create_collection(
+            name=user_shard_name(user_id)
         )
+        # Route new writes to the shard first, so nothing lands in the user
+        # store after the copy below has read it
+        self.moving_shards[key] = shard
+        try:
+            records = await self.user_store.get(
+                where=where, include=["documents", "metadatas", "embeddings"]
+            )
+            await shard.upsert(
+                ids=records["ids"],
+                documents=records["documents"],
+                metadatas=records["metadatas"],
+                embeddings=records["embeddings"],
+            )
+            await self.user_store.delete(ids=records["ids"])
+            self.user_shards[key] = shard
+        finally:
+            del self.moving_shards[key]
+
+    def _index_keywords(self, ids: List[str], texts: List[str]) -> None:
+        if settings.retrieval_mode == "hybrid":
+            for doc_id, text in zip(ids, texts):
+                self.keyword_index.add(doc_id, text)
+
+    async def _query_global_hits(
+        self, query: str, query_vector, top_k: int
+    ) -> List[dict]:
+        if settings.retrieval_mode != "hybrid":
+            return await self._query_hits(self.global_store, query_vector, top_k)
+        return await self._query_hybrid_hits(query, query_vector, top_k)
+
+    async def _query_hybrid_hits(
+        self, query: str, query_vector, top_k: int
+    ) -> List[dict]:
+        """
+        Fuse dense and BM25 rankings of the global store with reciprocal rank
+        fusion, drop near-duplicate chunks, then optionally rerank the
+        survivors with a cross-encoder inside the latency budget.
+        """
+        self._maybe_resync_keywords()
+        candidates = top_k * settings.hybrid_candidate_multiplier
+        dense_hits = await self._query_hits(self.global_store, query_vector, candidates)
+        keyword_hits = self.keyword_index.search(query, candidates)
+
+        hits_by_id = {hit["id"]: hit for hit in dense_hits}
+        keyword_only = [
+            doc_id for doc_id, _ in keyword_hits if doc_id not in hits_by_id
+        ]
+        if keyword_only:
+            # The index may lag the store; serve the stored text, never a
+            # chunk that has since been deleted or rewritten elsewhere
+            current = await self.global_store.get(
+                ids=keyword_only, include=["documents"]
+            )
+            live = dict(zip(current["ids"], current["documents"]))
+            for doc_id in keyword_only:
+                if doc_id not in live:
+                    self.keyword_index.remove(doc_id)
+                    continue
+                if live[doc_id] != self.keyword_index.texts.get(doc_id):
+                    self.keyword_index.add(doc_id, live[doc_id])
+                hits_by_id[doc_id] = {
+                    "id": doc_id,
+                    "text": live[doc_id],
+                    "user_id": None,
+                    "distance": None,
+                }
+
+        fused = reciprocal_rank_fusion(
+            [
+                [hit["id"] for hit in dense_hits],
+                [doc_id for doc_id, _ in keyword_hits if doc_id in hits_by_id],
+            ],
+            k=settings.rrf_k,
+        )
+        for doc_id, score in fused.items():
+            hits_by_id[doc_id]["score"] = score
+
+        hits = sorted(hits_by_id.values(), key=lambda hit: hit["score"], reverse=True)
+        hits = dedupe_hits(hits, settings.dedupe_threshold)
+
+        if self.cross_encoder is not None:
+            reranked = await rerank_hits(
+                self.cross_encoder,
+                query,
+                hits[: top_k * 2],
+                settings.rerank_budget_ms,
+            )
+            if reranked is not None:
+                hits = reranked
+
+        return hits[:top_k]
+
+    async def _query_user_hits(
+        self, user_id: int, query_vector, top_k: int
+    ) -> List[dict]:
+        collection = self.user_collection(user_id)
+        return await self._query_hits(
+            collection, query_vector, top_k, where={"user_id": str(user_id)}
+        )
+
+    async def _query_hits(
+        self, collection, query_vector, top_k: int, where: Optional[dict] = None
+    ) -> List[dict]:
+        with telemetry.span("chroma.query", collection=collection.name):
+            results = await collection.query(
+                query_embeddings=[query_vector], n_results=top_k, where=where
+            )
 
         if not results or "documents" not in results or not results["documents"]:
             return []
 
-        return [
-            doc["text"]
-            for doc in results["documents"][0]
-            if "user_id" in doc and doc["user_id"] == str(user_id)
-        ]
+        distances = (results.get("distances") or [[]])[0]
+        metadatas = (results.get("metadatas") or [[]])[0]
+        hits = []
+        for i, doc in enumerate(results["documents"][0]):
+            distance = distances[i] if i < len(distances) else None
+            metadata = (metadatas[i] if i < len(metadatas) else None) or {}
+            hits.append(
+                {
+                    "id": results["ids"][0][i],
+                    "text": doc,
+                    "user_id": metadata.get("user_id"),
+                    "distance": distance,
+                    # Chroma returns distances; map them to a higher-is-better score
+                    "score": 1 / (1 + distance) if distance is not None else 0.0,
+                }
+            )
+        return hits
 
 
-@asynccontextmanager
-async def get_chroma_client():
-    client = await chromadb.AsyncHttpClient(host="chromadb", port=settings.chroma_port)
-    try:
-        yield client
-    finally:
-        pass
+def ids_fingerprint(ids: List[str]) -> int:
+    """
+    Order-independent hash of a set of ids; XOR-ing two disjoint sets'
+    fingerprints gives their union's.
+    """
+    fingerprint = 0
+    for doc_id in ids:
+        digest = hashlib.blake2b(doc_id.encode("utf-8"), digest_size=8).digest()
+        fingerprint ^= int.from_bytes(digest, "little")
+    return fingerprint
 
 
-async def get_vector_store() -> AsyncGenerator[VectorStore, None]:
+def document_id(namespace: str, doc_text: str) -> str:
     """
-    Dependency injection for ChromaDB vector store.
+    Deterministic id for a document, so re-indexing the same text upserts
+    instead of adding a duplicate vector.
     """
-    async with get_chroma_client() as chroma_client:
-        vector_store = await VectorStore.create(chroma_client)
-        yield vector_store
+    digest = hashlib.sha256(doc_text.encode("utf-8")).hexdigest()[:32]
+    return f"{namespace}:{digest}"
+
+
+def user_shard_name(user_id: int) -> str:
+    return f"{USER_SHARD_PREFIX}{user_id}"
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+async def create_vector_client():
+    """
+    Open the vector backend picked by `vector_backend` (and, for Chroma,
+    `chroma_mode`). Every backend serves the subset of Chroma's async client
+    and collection API that VectorStore uses.
+    """
+    if settings.vector_backend == "hnsw":
+        return EmbeddedClient(
+            QuantizedClient(settings.vector_index_path, settings.vector_quantization)
+        )
+    if settings.vector_backend != "chroma":
+        raise ValueError(f"Unknown vector backend {settings.vector_backend!r}")
+
+    if settings.chroma_mode == "embedded":
+        return EmbeddedChromaClient(settings.chroma_path)
+
+    with startup_timings.phase("import chromadb"):
+        import chromadb
+    return await chromadb.AsyncHttpClient(
+        host=settings.chroma_host, port=settings.chroma_port
+    )
+
+
+async def close_vector_client(client) -> None:
+    """
+    Let in-process backends flush to disk; the HTTP client needs nothing.
+    """
+    if isinstance(client, EmbeddedClient):
+        await client.close()
+
+
+class VectorStoreState:
+    """
+    Process-wide VectorStore owned by the FastAPI lifespan.
+
+    The embedding model and collections are opened once per worker in a
+    background task so the worker can answer /ping while it warms up.
+    """
+
+    def __init__(self):
+        self.status = "stopped"
+        self.error: Optional[str] = None
+        self.warmup_seconds: Optional[float] = None
+        self.attempts = 0
+        self.vector_store: Optional[VectorStore] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Begin loading the model and opening collections in the background.
+        """
+        if self._task is not None:
+            return
+        self.status = "warming"
+        self._task = asyncio.create_task(self._warmup())
+
+    async def stop(self) -> None:
+        """
+        Cancel a pending warmup and drop the shared store.
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self.vector_store is not None:
+            await self.vector_store.close()
+            self.vector_store = None
+        self.status = "stopped"
+
+    async def _warmup(self) -> None:
+        """
+        Open the store, retrying with capped exponential backoff so a Chroma
+        server that comes up after the API is picked up once it does.
+        """
+        started = time.perf_counter()
+        delay = settings.vector_store_retry_seconds
+        while True:
+            chroma_client = vector_store = None
+            try:
+                chroma_client = await create_vector_client()
+                vector_store = await VectorStore.create(chroma_client)
+                # First encode call allocates the inference buffers
+                await vector_store.embed_text("warmup")
+                await vector_store.load_retrieval_models()
+            except Exception as e:
+                print("Error warming up vector store:", e)
+                self.status = "retrying"
+                self.error = str(e)
+                await self._discard(chroma_client, vector_store)
+            else:
+                self.vector_store = vector_store
+                self.status = "ready"
+                self.error = None
+                self.warmup_seconds = round(time.perf_counter() - started, 3)
+                startup_timings.mark("vector store ready")
+                return
+
+            self.attempts += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.vector_store_retry_max_seconds)
+
+    @staticmethod
+    async def _discard(chroma_client, vector_store: Optional[VectorStore]) -> None:
+        """
+        Release whatever a failed warmup attempt had opened.
+        """
+        try:
+            if vector_store is not None:
+                await vector_store.close()
+            elif chroma_client is not None:
+                await close_vector_client(chroma_client)
+        except Exception as e:
+            print("Error closing vector store after failed warmup:", e)
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def describe(self) -> dict:
+        return {
+            "status": self.status,
+            "ready": self.ready,
+            "backend": settings.vector_backend,
+            "embedding_backend": settings.embedding_backend,
+            "warmup_seconds": self.warmup_seconds,
+            "failed_attempts": self.attempts,
+            "error": self.error,
+            "embedding_cache": (
+                self.vector_store.embedding_cache.stats()
+                if self.vector_store is not None
+                else None
+            ),
+        }
+
+
+vector_store_state = VectorStoreState()
+
+
+async def get_vector_store() -> VectorStore:
+    """
+    Dependency injection for the shared ChromaDB vector store.
+    """
+    if not vector_store_state.ready or vector_store_state.vector_store is None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Vector store is not ready ({vector_store_state.status})",
+            headers={"Retry-After": "5"},
+        )
+    return vector_store_state.vector_store
@@ -0,0 +1,83 @@
+import asyncio
+from typing import Optional
+
+from app.services.startup import startup_timings
+
+
+class EmbeddedCollection:
+    """
+    Async view of an in-process collection, matching the subset of Chroma's
+    `AsyncCollection` the app uses. Calls run in worker threads.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.name = collection.name
+
+    async def add(self, **kwargs):
+        return await asyncio.to_thread(self._collection.add, **kwargs)
+
+    async def upsert(self, **kwargs):
+        return await asyncio.to_thread(self._collection.upsert, **kwargs)
+
+    async def update(self, **kwargs):
+        return await asyncio.to_thread(self._collection.update, **kwargs)
+
+    async def delete(self, **kwargs):
+        return await asyncio.to_thread(self._collection.delete, **kwargs)
+
+    async def get(self, **kwargs):
+        return await asyncio.to_thread(self._collection.get, **kwargs)
+
+    async def query(self, **kwargs):
+        return await asyncio.to_thread(self._collection.query, **kwargs)
+
+    async def count(self) -> int:
+        return await asyncio.to_thread(self._collection.count)
+
+
+class EmbeddedClient:
+    """
+    Async facade over an in-process client, with the same interface as
+    `AsyncHttpClient` for the calls the app makes.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    async def get_or_create_collection(self, name: str, **kwargs):
+        collection = await asyncio.to_thread(
+            self._client.get_or_create_collection, name=name, **kwargs
+        )
+        return EmbeddedCollection(collection)
+
+    async def get_collection(self, name: str):
+        collection = await asyncio.to_thread(self._client.get_collection, name=name)
+        return EmbeddedCollection(collection)
+
+    async def list_collections(self):
+        return await asyncio.to_thread(self._client.list_collections)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._client.close)
+
+
+class EmbeddedChromaClient(EmbeddedClient):
+    """
+    In-process Chroma, for local development and benchmarks without a
+    Chroma server.
+
+    Data lives under `path` when given, otherwise only in memory.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        with startup_timings.phase("import chromadb"):
+            import chromadb
+
+        super().__init__(
+            chromadb.PersistentClient(path=path) if path else chromadb.EphemeralClient()
+        )
+
+    async def close(self) -> None:
+        # Chroma persists each write itself
+        pass
@@ -0,0 +1,1120 @@
+import fcntl
+import heapq
+import json
+import math
+import os
+import random
+import shutil
+import threading
+import uuid
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from app.config import settings
+
+SNAPSHOT_DIR = "snapshot"
+VECTORS_FILE = "vectors.f32"
+# Rows copied per step when compaction rewrites the vectors
+COMPACT_BATCH = 4096
+LOG_FILE = "log.jsonl"
+LOCK_FILE = "LOCK"
+MAX_LEVEL = 16
+# Candidates rescored per requested result; sign bits need a wider net
+RESCORE_FACTORS = {"int8": 4, "binary": 16}
+
+
+def _reserve(array: np.ndarray, capacity: int, fill=0) -> np.ndarray:
+    """
+    Grow `array` to hold `capacity` rows, doubling to amortize appends.
+    Read-only (memory-mapped) arrays are copied so they can be written.
+    """
+    if len(array) >= capacity and array.flags.writeable:
+        return array
+    grown = np.full(
+        (max(capacity, 2 * len(array), 64),) + array.shape[1:], fill, dtype=array.dtype
+    )
+    grown[: len(array)] = array
+    return grown
+
+
+class QuantizedCodes:
+    """
+    Compressed copies of the vectors, used to walk the graph.
+
+    "int8" keeps one byte per dimension plus a per-vector scale (4x smaller
+    than float32); "binary" keeps one sign bit per dimension (32x smaller).
+    """
+
+    def __init__(self, kind: str, dim: int):
+        if kind not in ("int8", "binary"):
+            raise ValueError(f"Unknown vector quantization {kind!r}")
+        self.kind = kind
+        self.dim = dim
+        if kind == "int8":
+            self.codes = np.zeros((0, dim), np.int8)
+        else:
+            self.codes = np.zeros((0, (dim + 7) // 8), np.uint8)
+        self.scales = np.zeros(0, np.float32)
+        self.norms = np.zeros(0, np.float32)
+
+    def reserve(self, capacity: int) -> None:
+        self.codes = _reserve(self.codes, capacity)
+        if self.kind == "int8":
+            self.scales = _reserve(self.scales, capacity)
+            self.norms = _reserve(self.norms, capacity)
+
+    def set(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        if self.kind == "binary":
+            self.codes[rows] = np.packbits(vectors > 0, axis=1)
+            return
+
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        dequantized = codes.astype(np.float32) * scales[:, None]
+        self.codes[rows] = codes
+        self.scales[rows] = scales
+        self.norms[rows] = (dequantized * dequantized).sum(axis=1)
+
+    def prepare(self, vector: np.ndarray):
+        if self.kind == "binary":
+            return vector, float(vector.sum())
+        return vector, float(vector @ vector)
+
+    def distances(self, query, rows: np.ndarray) -> np.ndarray:
+        """
+        Approximate distances from a prepared query to `rows`: squared L2 to
+        the dequantized int8 vectors, or for binary codes the negated inner
+        product with their +/-1 signs. The query itself stays full precision.
+        """
+        vector, norm = query
+        if self.kind == "binary":
+            bits = np.unpackbits(self.codes[rows], axis=1, count=self.dim)
+            # q . signs = 2 * (q . bits) - sum(q)
+            return norm - 2 * (bits @ vector)
+
+        dots = self.codes[rows] @ vector
+        return norm - 2 * self.scales[rows] * dots + self.norms[rows]
+
+    def save(self, directory: str, size: int) -> None:
+        np.save(os.path.join(directory, "codes.npy"), self.codes[:size])
+        if self.kind == "int8":
+            np.save(os.path.join(directory, "scales.npy"), self.scales[:size])
+            np.save(os.path.join(directory, "norms.npy"), self.norms[:size])
+
+    @classmethod
+    def load(cls, directory: str, kind: str, dim: int) -> "QuantizedCodes":
+        codes = cls(kind, dim)
+        codes.codes = np.load(os.path.join(directory, "codes.npy"), mmap_mode="r")
+        if kind == "int8":
+            codes.scales = np.load(os.path.join(directory, "scales.npy"), mmap_mode="r")
+            codes.norms = np.load(os.path.join(directory, "norms.npy"), mmap_mode="r")
+        return codes
+
+
+class FloatVectors:
+    """
+    Full-precision vectors, only read to rescore candidates.
+
+    With a path they live in an append-only file that is memory-mapped, so
+    just the pages of rescored rows are brought into memory and workers
+    share them through the page cache.
+    """
+
+    def __init__(self, dim: int, path: Optional[str] = None, rows: int = 0):
+        self.dim = dim
+        self.path = path
+        self.rows = rows
+        self.row_bytes = dim * np.dtype(np.float32).itemsize
+        self.data = np.zeros((0, dim), np.float32)
+        if path is None:
+            return
+
+        if self._stored() < rows:
+            raise ValueError(f"{path} holds fewer than {rows} vectors")
+        self._map()
+
+    def _stored(self) -> int:
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return size // self.row_bytes
+
+    def _map(self) -> None:
+        if self.rows:
+            self.data = np.memmap(
+                self.path, np.float32, mode="r", shape=(self.rows, self.dim)
+            )
+
+    def append(self, vectors: np.ndarray) -> int:
+        start = self.rows
+        if self.path is None:
+            self.data = _reserve(self.data, start + len(vectors))
+            self.data[start : start + len(vectors)] = vectors
+        else:
+            with open(self.path, "r+b" if os.path.exists(self.path) else "wb") as f:
+                f.seek(start * self.row_bytes)
+                f.write(vectors.tobytes())
+        self.rows += len(vectors)
+        if self.path is not None:
+            self._map()
+        return start
+
+    def adopt(self, count: int) -> int:
+        """
+        Count `count` rows already in the file as appended, when replaying
+        the log after a restart.
+        """
+        if self._stored() < self.rows + count:
+            raise ValueError(f"{self.path} holds fewer than {self.rows + count} vectors")
+        start = self.rows
+        self.rows += count
+        self._map()
+        return start
+
+    def truncate(self) -> None:
+        """
+        Drop rows past `rows`: appended before a crash, but never logged.
+        """
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(self.rows * self.row_bytes)
+
+    def take(self, rows) -> np.ndarray:
+        return np.asarray(self.data[rows], dtype=np.float32)
+
+    def flush(self) -> None:
+        if self.path is not None:
+            with open(self.path, "ab") as f:
+                os.fsync(f.fileno())
+
+
+class HNSWGraph:
+    """
+    Hierarchical navigable small world graph (Malkov & Yashunin) whose
+    searches compare quantized codes. Full vectors are only used to choose
+    neighbours while building.
+
+    Layer 0 links sit in a fixed-width array; the sparse upper layers are
+    dicts.
+    """
+
+    def __init__(
+        self,
+        codes: QuantizedCodes,
+        vectors: FloatVectors,
+        m: int,
+        ef_construction: int,
+    ):
+        self.codes = codes
+        self.vectors = vectors
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.level_mult = 1 / math.log(max(m, 2))
+        self.levels = np.zeros(0, np.int8)
+        self.layer0 = np.full((0, self.m0), -1, np.int32)
+        self.upper: List[Dict[int, List[int]]] = []
+        self.entry = -1
+        self.max_level = -1
+        self.rng = random.Random()
+
+    def reserve(self, capacity: int) -> None:
+        self.levels = _reserve(self.levels, capacity)
+        self.layer0 = _reserve(self.layer0, capacity, -1)
+
+    def insert(self, row: int, vector: np.ndarray) -> None:
+        level = min(
+            int(-math.log(1.0 - self.rng.random()) * self.level_mult), MAX_LEVEL
+        )
+        self.levels[row] = level
+        while len(self.upper) < level:
+            self.upper.append({})
+        for lc in range(1, level + 1):
+            self.upper[lc - 1][row] = []
+
+        if self.entry < 0:
+            self.entry, self.max_level = row, level
+            return
+
+        query = self.codes.prepare(vector)
+        entry = [self.entry]
+        for lc in range(self.max_level, level, -1):
+            entry = [self._search_layer(query, entry, 1, lc)[0][1]]
+
+        for lc in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(query, entry, self.ef_construction, lc)
+            found = [node for _, node in found]
+            neighbours = self._select(vector, found, self.m)
+            self._set_links(row, lc, neighbours)
+            for node in neighbours:
+                self._connect(node, row, lc)
+            entry = found
+
+        if level > self.max_level:
+            self.entry, self.max_level = row, level
+
+    def search(self, vector: np.ndarray, k: int, ef: int, accept=None) -> List[int]:
+        """
+        Approximate nearest rows to `vector`, closest first. `accept` limits
+        which rows may be returned; the walk still passes through the rest.
+        """
+        if self.entry < 0:
+            return []
+
+        query = self.codes.prepare(vector)
+        entry = [self.entry]
+        for lc in range(self.max_level, 0, -1):
+            entry = [self._search_layer(query, entry, 1, lc)[0][1]]
+        found = self._search_layer(query, entry, max(ef, k), 0, accept)
+        return [node for _, node in found[:k]]
+
+    def _search_layer(self, query, entry: List[int], ef: int, level: int, accept=None):
+        visited = set(entry)
+        distances = self.codes.distances(query, np.asarray(entry)).tolist()
+        candidates = list(zip(distances, entry))
+        heapq.heapify(candidates)
+        # Max-heap of the best `ef` accepted rows so far
+        results = []
+        for distance, node in candidates:
+            if accept is None or accept(node):
+                heapq.heappush(results, (-distance, node))
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if len(results) >= ef and distance > -results[0][0]:
+                break
+
+            neighbours = [n for n in self._links(node, level) if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+
+            distances = self.codes.distances(query, np.asarray(neighbours)).tolist()
+            for distance, neighbour in zip(distances, neighbours):
+                if len(results) < ef or distance < -results[0][0]:
+                    heapq.heappush(candidates, (distance, neighbour))
+                    if accept is None or accept(neighbour):
+                        heapq.heappush(results, (-distance, neighbour))
+                        if len(results) > ef:
+                            heapq.heappop(results)
+
+        return sorted((-distance, node) for distance, node in results)
+
+    def _select(self, base: np.ndarray, candidates: List[int], m: int) -> List[int]:
+        """
+        Keep up to `m` neighbours, skipping candidates closer to an already
+        kept neighbour than to `base` so links spread in all directions.
+        """
+        if len(candidates) <= m:
+            return candidates
+
+        vectors = self.vectors.take(candidates)
+        distances = ((vectors - base) ** 2).sum(axis=1)
+        norms = (vectors * vectors).sum(axis=1)
+        between = norms[:, None] + norms[None, :] - 2 * (vectors @ vectors.T)
+        # closer[i][j]: candidate i is nearer to candidate j than to base
+        closer = (between < distances[:, None]).tolist()
+        kept, pruned = [], []
+        for i in np.argsort(distances).tolist():
+            if len(kept) >= m:
+                break
+            row = closer[i]
+            if any(row[j] for j in kept):
+                pruned.append(i)
+                continue
+            kept.append(i)
+        kept.extend(pruned[: m - len(kept)])
+        return [candidates[i] for i in kept]
+
+    def _links(self, node: int, level: int) -> List[int]:
+        if level == 0:
+            links = self.layer0[node]
+            return links[links >= 0].tolist()
+        return self.upper[level - 1].get(node, [])
+
+    def _set_links(self, node: int, level: int, links: List[int]) -> None:
+        if level == 0:
+            self.layer0[node] = -1
+            self.layer0[node, : len(links)] = links
+        else:
+            self.upper[level - 1][node] = list(links)
+
+    def _connect(self, node: int, new: int, level: int) -> None:
+        links = self._links(node, level)
+        limit = self.m0 if level == 0 else self.m
+        if len(links) < limit:
+            links = links + [new]
+        else:
+            links = self._select(self.vectors.take([node])[0], links + [new], limit)
+        self._set_links(node, level, links)
+
+    def compact(
+        self, live: np.ndarray, codes: QuantizedCodes, vectors: FloatVectors
+    ) -> "HNSWGraph":
+        """
+        Copy of the graph over just the `live` rows, renumbered in order, on
+        the given (already compacted) codes and vectors.
+
+        A node that linked to removed rows takes their live neighbours as
+        candidates instead and keeps the best, so the graph stays connected
+        without reinserting anything.
+        """
+        remap = np.full(len(self.levels), -1, np.int64)
+        remap[live] = np.arange(len(live))
+        graph = HNSWGraph(codes, vectors, self.m, self.ef_construction)
+        graph.m0 = self.m0
+        graph.levels = np.array(self.levels[live])
+        graph.layer0 = np.full((len(live), self.m0), -1, np.int32)
+
+        def relink(node: int, level: int, limit: int) -> List[int]:
+            links = self._links(node, level)
+            removed = [n for n in links if remap[n] < 0]
+            if removed:
+                candidates = {n for n in links if remap[n] >= 0}
+                for n in removed:
+                    candidates.update(
+                        m for m in self._links(n, level) if remap[m] >= 0
+                    )
+                candidates.discard(node)
+                links = self._select(
+                    self.vectors.take([node])[0], sorted(candidates), limit
+                )
+            return [int(remap[n]) for n in links]
+
+        for new, node in enumerate(live.tolist()):
+            links = relink(node, 0, self.m0)
+            graph.layer0[new, : len(links)] = links
+        for level, layer in enumerate(self.upper, start=1):
+            graph.upper.append(
+                {
+                    int(remap[node]): relink(node, level, self.m)
+                    for node in layer
+                    if remap[node] >= 0
+                }
+            )
+
+        if len(live):
+            if remap[self.entry] >= 0:
+                graph.entry, graph.max_level = int(remap[self.entry]), self.max_level
+            else:
+                graph.entry = int(np.argmax(graph.levels))
+                graph.max_level = int(graph.levels[graph.entry])
+        while len(graph.upper) > max(graph.max_level, 0):
+            graph.upper.pop()
+        return graph
+
+    def save(self, directory: str, size: int) -> dict:
+        np.save(os.path.join(directory, "levels.npy"), self.levels[:size])
+        np.save(os.path.join(directory, "layer0.npy"), self.layer0[:size])
+        with open(os.path.join(directory, "upper.json"), "w") as f:
+            json.dump(
+                [{str(k): v for k, v in layer.items()} for layer in self.upper], f
+            )
+        return {"entry": self.entry, "max_level": self.max_level}
+
+    @classmethod
+    def load(
+        cls, directory: str, state: dict, codes: QuantizedCodes, vectors: FloatVectors
+    ) -> "HNSWGraph":
+        graph = cls(codes, vectors, settings.hnsw_m, settings.hnsw_ef_construction)
+        graph.levels = np.load(os.path.join(directory, "levels.npy"), mmap_mode="r")
+        graph.layer0 = np.load(os.path.join(directory, "layer0.npy"), mmap_mode="r")
+        if graph.layer0.shape[1] != graph.m0:
+            # Built with another hnsw_m; keep its layout
+            graph.m0 = graph.layer0.shape[1]
+            graph.m = graph.m0 // 2
+        with open(os.path.join(directory, "upper.json")) as f:
+            graph.upper = [
+                {int(k): v for k, v in layer.items()} for layer in json.load(f)
+            ]
+        graph.entry = state["entry"]
+        graph.max_level = state["max_level"]
+        return graph
+
+
+class QuantizedCollection:
+    """
+    In-process collection with the part of Chroma's collection API the app
+    uses, backed by an HNSW graph over quantized vectors.
+
+    Queries walk the graph on the compressed codes, then rescore a few
+    candidates per requested result with the full vectors, so
+    distances are exact squared L2 as with Chroma's default space. Filters
+    are answered from an index of metadata values; when few rows match (or
+    the collection is small) those rows are scanned exactly instead.
+
+    Deleted rows stay in the graph as waypoints but are never returned.
+    With a path, every write is appended to a log (synced before the call
+    returns) and `snapshot` periodically writes the full state, which is
+    memory-mapped back on load before the rest of the log is replayed.
+
+    Writes are serialized by `_write_lock`. Queries only wait on `_lock`,
+    which a write holds to update records and to link each new row into the
+    graph, one row at a time, so a large batch does not stall searches.
+    """
+
+    def __init__(self, name: str, path: Optional[str] = None, quantization="int8"):
+        self.name = name
+        self.path = path
+        self.quantization = quantization
+        self.ids: List[Optional[str]] = []
+        self.documents: List[Optional[str]] = []
+        self.metadatas: List[Optional[dict]] = []
+        self.rows: Dict[str, int] = {}
+        self.postings: Dict[tuple, Set[int]] = {}
+        self.codes: Optional[QuantizedCodes] = None
+        self.vectors: Optional[FloatVectors] = None
+        self.graph: Optional[HNSWGraph] = None
+        # Replaced by a new file whenever compaction renumbers the rows
+        self.vectors_file = VECTORS_FILE
+        self.dirty = False
+        # Last log record applied, and records written since the last commit
+        self.seq = 0
+        self._pending: List[dict] = []
+        self._replaying = False
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+
+    def add(self, ids, embeddings, metadatas=None, documents=None) -> None:
+        with self._write_lock:
+            try:
+                with self._lock:
+                    keep = [
+                        i for i, record_id in enumerate(ids) if record_id not in self.rows
+                    ]
+                    rows = self._insert(ids, embeddings, metadatas, documents, keep)
+            finally:
+                self._commit()
+            self._link(rows)
+
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None) -> None:
+        with self._write_lock:
+            rows = []
+            try:
+                with self._lock:
+                    if embeddings is None:
+                        missing = [
+                            record_id for record_id in ids if record_id not in self.rows
+                        ]
+                        if missing:
+                            raise ValueError(
+                                f"Embeddings are required for new ids: {missing}"
+                            )
+                        for i, record_id in enumerate(ids):
+                            self._replace(
+                                self.rows[record_id],
+                                _item(documents, i),
+                                _item(metadatas, i),
+                            )
+                    else:
+                        for record_id in ids:
+                            if record_id in self.rows:
+                                self._remove(self.rows[record_id])
+                        rows = self._insert(
+                            ids, embeddings, metadatas, documents, range(len(ids))
+                        )
+            finally:
+                self._commit()
+            self._link(rows)
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None) -> None:
+        with self._write_lock:
+            rows = []
+            try:
+                with self._lock:
+                    reinsert = []
+                    for i, record_id in enumerate(ids):
+                        row = self.rows.get(record_id)
+                        if row is None:
+                            continue
+                        metadata = dict(self.metadatas[row] or {})
+                        metadata.update(_item(metadatas, i) or {})
+                        document = _item(documents, i)
+                        if document is None:
+                            document = self.documents[row]
+                        if embeddings is None:
+                            self._replace(row, document, metadata)
+                        else:
+                            self._remove(row)
+                            reinsert.append((i, document, metadata))
+
+                    if reinsert:
+                        rows = self._insert(
+                            [ids[i] for i, _, _ in reinsert],
+                            [embeddings[i] for i, _, _ in reinsert],
+                            [metadata for _, _, metadata in reinsert],
+                            [document for _, document, _ in reinsert],
+                            range(len(reinsert)),
+                        )
+            finally:
+                self._commit()
+            self._link(rows)
+
+    def delete(self, ids=None, where=None) -> None:
+        with self._write_lock:
+            try:
+                with self._lock:
+                    for row in self._matching(ids, where):
+                        self._remove(row)
+            finally:
+                self._commit()
+
+    def get(
+        self,
+        ids=None,
+        where=None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include=("metadatas", "documents"),
+    ) -> dict:
+        with self._lock:
+            rows = sorted(self._matching(ids, where))
+            start = offset or 0
+            rows = rows[start : start + limit if limit is not None else None]
+            return {
+                "ids": [self.ids[row] for row in rows],
+                "documents": (
+                    [self.documents[row] for row in rows]
+                    if "documents" in include
+                    else None
+                ),
+                "metadatas": (
+                    [self.metadatas[row] for row in rows]
+                    if "metadatas" in include
+                    else None
+                ),
+                "embeddings": (
+                    self.vectors.take(rows)
+                    if "embeddings" in include and self.vectors is not None
+                    else None
+                ),
+            }
+
+    def query(
+        self,
+        query_embeddings,
+        n_results: int = 10,
+        where=None,
+        include=("metadatas", "documents", "distances"),
+    ) -> dict:
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._lock:
+            rows = self._filter(where)
+            for vector in np.asarray(query_embeddings, dtype=np.float32).reshape(
+                len(query_embeddings), -1
+            ):
+                found, distances = self._search(vector, n_results, rows)
+                results["ids"].append([self.ids[row] for row in found])
+                results["documents"].append([self.documents[row] for row in found])
+                results["metadatas"].append([self.metadatas[row] for row in found])
+                results["distances"].append(distances)
+
+        for key in ("documents", "metadatas", "distances"):
+            if key not in include:
+                results[key] = None
+        return results
+
+    def count(self) -> int:
+        return len(self.rows)
+
+    def _search(self, vector: np.ndarray, k: int, rows: Optional[Set[int]]):
+        if self.graph is None or not self.rows or k <= 0:
+            return [], []
+
+        live = len(self.rows) if rows is None else len(rows)
+        if live <= settings.vector_exact_search_rows:
+            candidates = list(self.rows.values() if rows is None else rows)
+        else:
+            wanted = k * (
+                settings.vector_rescore_factor or RESCORE_FACTORS[self.quantization]
+            )
+            accept = rows.__contains__ if rows is not None else self._live
+            candidates = self.graph.search(
+                vector, wanted, max(settings.hnsw_ef_search, wanted), accept
+            )
+        if not candidates:
+            return [], []
+
+        distances = ((self.vectors.take(candidates) - vector) ** 2).sum(axis=1)
+        order = np.argsort(distances)[:k]
+        return [candidates[i] for i in order], distances[order].tolist()
+
+    def _live(self, row: int) -> bool:
+        return self.ids[row] is not None
+
+    def _insert(self, ids, embeddings, metadatas, documents, keep) -> List[int]:
+        """
+        Store new rows and return them, still to be linked into the graph.
+        """
+        keep = list(keep)
+        if not keep:
+            return []
+        vectors = np.asarray([embeddings[i] for i in keep], dtype=np.float32)
+        if self.graph is None:
+            self._create_index(vectors.shape[1])
+        elif vectors.shape[1] != self.codes.dim:
+            raise ValueError(
+                f"Embedding dimension {vectors.shape[1]} does not match "
+                f"collection dimensionality {self.codes.dim}"
+            )
+
+        start = self.vectors.append(vectors)
+        record = {
+            "op": "insert",
+            "start": start,
+            "dim": self.codes.dim,
+            "ids": [ids[i] for i in keep],
+            "documents": [_item(documents, i) for i in keep],
+            "metadatas": [_item(metadatas, i) for i in keep],
+        }
+        self._log(record)
+        return self._store(
+            start, vectors, record["ids"], record["documents"], record["metadatas"]
+        )
+
+    def _store(self, start: int, vectors: np.ndarray, ids, documents, metadatas):
+        end = start + len(ids)
+        self.codes.reserve(end)
+        self.codes.set(np.arange(start, end), vectors)
+        self.graph.reserve(end)
+        for offset, record_id in enumerate(ids):
+            row = start + offset
+            self.ids.append(record_id)
+            self.documents.append(documents[offset])
+            self.metadatas.append(metadatas[offset])
+            self.rows[record_id] = row
+            self._index_metadata(row)
+        self.dirty = True
+        return list(range(start, end))
+
+    def _link(self, rows: List[int]) -> None:
+        """
+        Insert stored rows into the graph. Until then searches only miss
+        them; the lock is taken per row so queries can run in between.
+        """
+        for row in rows:
+            with self._lock:
+                self.graph.insert(row, self.vectors.take([row])[0])
+
+    def _create_index(self, dim: int) -> None:
+        self.codes = QuantizedCodes(self.quantization, dim)
+        self.vectors = FloatVectors(
+            dim, os.path.join(self.path, self.vectors_file) if self.path else None
+        )
+        self.graph = HNSWGraph(
+            self.codes, self.vectors, settings.hnsw_m, settings.hnsw_ef_construction
+        )
+
+    def _replace(self, row: int, document, metadata) -> None:
+        self._log(
+            {"op": "replace", "row": row, "document": document, "metadata": metadata}
+        )
+        self._unindex_metadata(row)
+        if document is not None:
+            self.documents[row] = document
+        if metadata is not None:
+            self.metadatas[row] = metadata
+        self._index_metadata(row)
+        self.dirty = True
+
+    def _remove(self, row: int) -> None:
+        self._log({"op": "remove", "row": row})
+        self._unindex_metadata(row)
+        del self.rows[self.ids[row]]
+        self.ids[row] = None
+        self.documents[row] = None
+        self.metadatas[row] = None
+        self.dirty = True
+
+    def _log(self, record: dict) -> None:
+        if self.path is not None and not self._replaying:
+            self._pending.append(record)
+
+    def _commit(self) -> None:
+        """
+        Append the writes made since the last commit to the log and sync it,
+        after the vectors they refer to.
+        """
+        if not self._pending:
+            return
+        if self.vectors is not None:
+            self.vectors.flush()
+        with open(os.path.join(self.path, LOG_FILE), "a") as f:
+            for record in self._pending:
+                self.seq += 1
+                record["seq"] = self.seq
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending = []
+
+    def _index_metadata(self, row: int) -> None:
+        for key, value in (self.metadatas[row] or {}).items():
+            self.postings.setdefault((key, value), set()).add(row)
+
+    def _unindex_metadata(self, row: int) -> None:
+        for key, value in (self.metadatas[row] or {}).items():
+            rows = self.postings.get((key, value))
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self.postings[(key, value)]
+
+    def _matching(self, ids, where) -> Set[int]:
+        rows = self._filter(where)
+        if rows is None:
+            rows = set(self.rows.values())
+        if ids is not None:
+            rows &= {self.rows[i] for i in ids if i in self.rows}
+        return rows
+
+    def _filter(self, where: Optional[dict]) -> Optional[Set[int]]:
+        """
+        Rows matching a Chroma `where` filter, or None for no filter. Supports
+        $and, $or, $eq, $ne, $in and $nin.
+        """
+        if not where:
+            return None
+        if len(where) > 1:
+            return set.intersection(
+                *(self._filter({key: value}) for key, value in where.items())
+            )
+
+        key, condition = next(iter(where.items()))
+        if key in ("$and", "$or"):
+            parts = [self._filter(part) for part in condition]
+            parts = [set(self.rows.values()) if p is None else p for p in parts]
+            if not parts:
+                return set()
+            return set.intersection(*parts) if key == "$and" else set.union(*parts)
+
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        rows = None
+        for op, value in condition.items():
+            if op in ("$eq", "$ne"):
+                matched = set(self.postings.get((key, value), ()))
+            elif op in ("$in", "$nin"):
+                matched = set().union(*(self.postings.get((key, v), ()) for v in value))
+            else:
+                raise ValueError(f"Unsupported where operator {op}")
+            if op in ("$ne", "$nin"):
+                matched = set(self.rows.values()) - matched
+            rows = matched if rows is None else rows & matched
+        return rows
+
+    def snapshot(self) -> None:
+        """
+        Write the graph, codes and records to `path`, replacing the previous
+        snapshot, then empty the log. Full vectors are already on disk and
+        just get synced. Queries keep running meanwhile; writes wait.
+
+        Once `hnsw_compact_ratio` of the rows are deleted, they are dropped
+        first (see `_compact`).
+        """
+        with self._write_lock:
+            if self.path is None or not self.dirty:
+                return
+            if self._should_compact():
+                self._compact()
+
+            directory = os.path.join(self.path, SNAPSHOT_DIR)
+            staging = directory + ".tmp"
+            previous = directory + ".old"
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+
+            size = len(self.ids)
+            meta = {
+                "size": size,
+                "dim": self.codes.dim if self.codes is not None else None,
+                "quantization": self.quantization,
+                "vectors_file": self.vectors_file,
+                # Log records up to here are part of this snapshot
+                "seq": self.seq,
+            }
+            if self.graph is not None:
+                self.vectors.flush()
+                self.codes.save(staging, size)
+                meta.update(self.graph.save(staging, size))
+            with open(os.path.join(staging, "records.json"), "w") as f:
+                json.dump(
+                    {
+                        "ids": self.ids,
+                        "documents": self.documents,
+                        "metadatas": self.metadatas,
+                    },
+                    f,
+                )
+            with open(os.path.join(staging, "meta.json"), "w") as f:
+                json.dump(meta, f)
+
+            shutil.rmtree(previous, ignore_errors=True)
+            if os.path.exists(directory):
+                os.replace(directory, previous)
+            os.replace(staging, directory)
+            shutil.rmtree(previous, ignore_errors=True)
+            open(os.path.join(self.path, LOG_FILE), "w").close()
+            self._remove_stale_vectors()
+            self.dirty = False
+
+    def _should_compact(self) -> bool:
+        removed = len(self.ids) - len(self.rows)
+        return (
+            self.graph is not None
+            and removed > 0
+            and removed >= settings.hnsw_compact_ratio * len(self.ids)
+        )
+
+    def _compact(self) -> None:
+        """
+        Drop deleted rows: copy the live ones, renumbered, into a new vectors
+        file and patch the graph around the gaps. Runs while writes are held
+        off; queries use the old state until the swap at the end.
+
+        The old vectors file stays until a snapshot naming the new one is in
+        place, so a crash in between loads the previous snapshot intact.
+        """
+        live = np.array(
+            [row for row, record_id in enumerate(self.ids) if record_id is not None],
+            np.int64,
+        )
+        vectors_file = f"vectors.{uuid.uuid4().hex[:12]}.f32"
+        path = os.path.join(self.path, vectors_file)
+        vectors = FloatVectors(self.codes.dim, path)
+        for start in range(0, len(live), COMPACT_BATCH):
+            vectors.append(self.vectors.take(live[start : start + COMPACT_BATCH]))
+        vectors.flush()
+
+        codes = QuantizedCodes(self.quantization, self.codes.dim)
+        codes.codes = np.array(self.codes.codes[live])
+        if self.quantization == "int8":
+            codes.scales = np.array(self.codes.scales[live])
+            codes.norms = np.array(self.codes.norms[live])
+        graph = self.graph.compact(live, codes, vectors)
+
+        ids = [self.ids[row] for row in live.tolist()]
+        documents = [self.documents[row] for row in live.tolist()]
+        metadatas = [self.metadatas[row] for row in live.tolist()]
+        with self._lock:
+            self.ids, self.documents, self.metadatas = ids, documents, metadatas
+            self.rows = {record_id: row for row, record_id in enumerate(ids)}
+            self.postings = {}
+            for row in range(len(ids)):
+                self._index_metadata(row)
+            self.codes, self.vectors, self.graph = codes, vectors, graph
+            self.vectors_file = vectors_file
+        self.dirty = True
+
+    def _remove_stale_vectors(self) -> None:
+        """
+        Delete vectors files other than the current one: replaced by a
+        compaction, or written before a crash with no record of their rows.
+        """
+        current = self.vectors_file if self.vectors is not None else None
+        for name in os.listdir(self.path):
+            if name.startswith("vectors") and name.endswith(".f32") and name != current:
+                os.remove(os.path.join(self.path, name))
+
+    def _load(self) -> None:
+        self._load_snapshot()
+        self._replay()
+        if self.vectors is not None:
+            self.vectors.truncate()
+        self._remove_stale_vectors()
+
+    def _load_snapshot(self) -> None:
+        directory = os.path.join(self.path, SNAPSHOT_DIR)
+        if not os.path.exists(directory):
+            # Interrupted between the two renames in `snapshot`
+            directory += ".old"
+        if not os.path.exists(directory):
+            return
+
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        with open(os.path.join(directory, "records.json")) as f:
+            records = json.load(f)
+
+        self.seq = meta.get("seq", 0)
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadatas = records["metadatas"]
+        for row, record_id in enumerate(self.ids):
+            if record_id is not None:
+                self.rows[record_id] = row
+                self._index_metadata(row)
+
+        if meta["dim"] is None:
+            return
+        # Stored codes keep the quantization they were built with
+        self.quantization = meta["quantization"]
+        self.vectors_file = meta.get("vectors_file", VECTORS_FILE)
+        self.codes = QuantizedCodes.load(directory, self.quantization, meta["dim"])
+        self.vectors = FloatVectors(
+            meta["dim"], os.path.join(self.path, self.vectors_file), rows=meta["size"]
+        )
+        self.graph = HNSWGraph.load(directory, meta, self.codes, self.vectors)
+
+    def _replay(self) -> None:
+        """
+        Apply the log records written after the snapshot. Replay stops at a
+        torn or inconsistent record, which is cut off with everything after.
+        """
+        path = os.path.join(self.path, LOG_FILE)
+        if not os.path.exists(path):
+            return
+
+        valid = 0
+        self._replaying = True
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if not line.endswith(b"\n"):
+                        break
+                    if record["seq"] > self.seq:
+                        if not self._apply(record):
+                            break
+                        self.seq = record["seq"]
+                        self.dirty = True
+                    valid += len(line)
+        finally:
+            self._replaying = False
+        with open(path, "r+b") as f:
+            f.truncate(valid)
+
+    def _apply(self, record: dict) -> bool:
+        if record["op"] == "insert":
+            if record["start"] != len(self.ids):
+                return False
+            if self.graph is None:
+                self._create_index(record["dim"])
+            try:
+                start = self.vectors.adopt(len(record["ids"]))
+            except ValueError as e:
+                print("Error replaying the vector index log:", e)
+                return False
+            rows = self._store(
+                start,
+                self.vectors.take(slice(start, start + len(record["ids"]))),
+                record["ids"],
+                record["documents"],
+                record["metadatas"],
+            )
+            self._link(rows)
+        elif record["op"] == "replace":
+            self._replace(record["row"], record["document"], record["metadata"])
+        elif record["op"] == "remove":
+            if self.ids[record["row"]] is not None:
+                self._remove(record["row"])
+        return True
+
+
+class QuantizedClient:
+    """
+    Sync client for `QuantizedCollection`s, shaped like Chroma's so that
+    `EmbeddedClient` can serve it to the app. Each collection lives in its
+    own directory under `path`; without a path everything stays in memory.
+
+    A path is locked for as long as the client is open: the index lives in
+    one process's memory, so a second process (another API worker, or the
+    reindex job while the server runs) fails to open it instead of
+    diverging from the first.
+    """
+
+    def __init__(self, path: Optional[str] = None, quantization: str = "int8"):
+        self.path = path
+        self.quantization = quantization
+        self.collections: Dict[str, QuantizedCollection] = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._lock_file = None
+        if path is None:
+            return
+
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = _lock_directory(path)
+        if settings.hnsw_snapshot_seconds > 0:
+            threading.Thread(
+                target=self._snapshot_periodically, name="hnsw-snapshot", daemon=True
+            ).start()
+
+    def get_or_create_collection(self, name: str, **kwargs) -> QuantizedCollection:
+        with self._lock:
+            collection = self.collections.get(name)
+            if collection is None:
+                collection = self.collections[name] = QuantizedCollection(
+                    name,
+                    os.path.join(self.path, name) if self.path else None,
+                    self.quantization,
+                )
+            return collection
+
+    def get_collection(self, name: str) -> QuantizedCollection:
+        if name not in self.list_collections():
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.get_or_create_collection(name)
+
+    def list_collections(self) -> List[str]:
+        names = set(self.collections)
+        if self.path and os.path.isdir(self.path):
+            names.update(
+                name
+                for name in os.listdir(self.path)
+                if os.path.isdir(os.path.join(self.path, name))
+            )
+        return sorted(names)
+
+    def snapshot(self) -> None:
+        for collection in list(self.collections.values()):
+            collection.snapshot()
+
+    def _snapshot_periodically(self) -> None:
+        # Writes are already durable in the logs; this bounds their replay
+        while not self._closed.wait(settings.hnsw_snapshot_seconds):
+            try:
+                self.snapshot()
+            except Exception as e:
+                print("Error snapshotting the vector index:", e)
+
+    def close(self) -> None:
+        self._closed.set()
+        self.snapshot()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def _lock_directory(path: str):
+    """
+    Take an exclusive lock on `path`, held until the returned file is closed
+    (or the process exits).
+    """
+    lock_file = open(os.path.join(path, LOCK_FILE), "a+")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.seek(0)
+        owner = lock_file.read().strip() or "unknown"
+        lock_file.close()
+        raise RuntimeError(
+            f"Vector index {path} is open in another process (pid {owner}); "
+            "the hnsw backend supports a single process per index"
+        )
+    lock_file.truncate(0)
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+
+def _item(values, i: int):
+    return values[i] if values is not None else None
@@ -0,0 +1,78 @@
+import ast
+import asyncio
+
+from app.db.chroma import close_vector_client, create_vector_client, document_id
+
+
+def _parse_legacy_document(document: str) -> dict | None:
+    """
+    Older user_store records were written as a stringified
+    `{"user_id": ..., "text": ...}` dict with no metadata.
+    """
+    try:
+        parsed = ast.literal_eval(document)
+    except (ValueError, SyntaxError):
+        return None
+    if not isinstance(parsed, dict) or "text" not in parsed or "user_id" not in parsed:
+        return None
+    return parsed
+
+
+async def migrate_user_store(batch_size: int = 500) -> dict:
+    """
+    Rewrite legacy user_store records as plain text documents with a
+    `user_id` metadata field and deterministic ids, so they can be found
+    by the server-side `where` filter.
+    """
+    client = await create_vector_client()
+    user_store = await client.get_or_create_collection(name="user_store")
+
+    migrated_ids = set()
+    skipped = 0
+    offset = 0
+    while True:
+        records = await user_store.get(
+            include=["documents", "metadatas", "embeddings"],
+            limit=batch_size,
+            offset=offset,
+        )
+        if not records["ids"]:
+            break
+
+        stale_ids, ids, documents, metadatas, embeddings = [], [], [], [], []
+        for i, record_id in enumerate(records["ids"]):
+            metadata = records["metadatas"][i] or {}
+            if record_id in migrated_ids:
+                continue
+            if "user_id" in metadata:
+                skipped += 1
+                continue
+
+            legacy = _parse_legacy_document(records["documents"][i] or "")
+            if legacy is None:
+                skipped += 1
+                continue
+
+            user_id = str(legacy["user_id"])
+            stale_ids.append(record_id)
+            ids.append(document_id(user_id, legacy["text"]))
+            documents.append(legacy["text"])
+            metadatas.append({"user_id": user_id})
+            embeddings.append(records["embeddings"][i])
+
+        if ids:
+            await user_store.upsert(
+                ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings
+            )
+            await user_store.delete(ids=[i for i in stale_ids if i not in ids])
+            migrated_ids.update(ids)
+
+        # Rewritten records sort differently, so only advance past untouched ones
+        offset += len(records["ids"]) - len(stale_ids)
+
+    await close_vector_client(client)
+    return {"migrated": len(migrated_ids), "skipped": skipped}
+
+
+if __name__ == "__main__":
+    print(asyncio.run(migrate_user_store()))
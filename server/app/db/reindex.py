@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import json
+import os
+import time
+from typing import Dict, Iterator, List
+
+from app.config import settings
+from app.db.chroma import VectorStore, create_vector_client
+from app.services.ingest import TextChunker
+
+ORIGIN = "corpus"
+# pipelines/ next to server/ in a checkout
+PIPELINES_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "pipelines"
+)
+
+
+def load_corpus_module():
+    """
+    Import pipelines/corpus.py, which writes the corpus, so it is read with
+    the same code rather than a copy of its shard format.
+    """
+    path = os.path.join(settings.pipelines_dir or PIPELINES_DIR, "corpus.py")
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"{path} not found; set PIPELINES_DIR to the pipelines directory "
+            "that wrote the corpus"
+        )
+    spec = importlib.util.spec_from_file_location("corpus", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def iter_corpus(directory: str) -> Iterator[dict]:
+    """
+    Yield the live record of every URL in a corpus, in on-disk order.
+    """
+    corpus = load_corpus_module()
+    # An empty reader would make the prune step delete every indexed article
+    if not os.path.exists(os.path.join(directory, corpus.INDEX_FILE)):
+        raise FileNotFoundError(f"{directory} has no {corpus.INDEX_FILE}")
+    with corpus.CorpusReader(directory) as reader:
+        yield from reader
+
+
+def chunk_id(url: str, chunk: str) -> str:
+    """
+    Content address for a chunk of an article: the same text keeps its id
+    wherever it moves, so only new or edited chunks need embedding.
+    """
+    url_key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:24]
+    text_key = chunk_hash(" ".join(chunk.split()))[:24]
+    return f"corpus:{url_key}:{text_key}"
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+async def load_indexed(collection, page_size: int = 5000) -> Dict[str, dict]:
+    """
+    Map each corpus URL already in the collection to its document hash and
+    the hash of every chunk id, in one paged metadata scan.
+    """
+    indexed: Dict[str, dict] = {}
+    offset = 0
+    while True:
+        page = await collection.get(
+            where={"origin": ORIGIN},
+            include=["metadatas"],
+            limit=page_size,
+            offset=offset,
+        )
+        if not page["ids"]:
+            break
+        for record_id, metadata in zip(page["ids"], page["metadatas"]):
+            doc = indexed.setdefault(
+                metadata["source"], {"doc_hash": metadata["doc_hash"], "chunks": {}}
+            )
+            doc["chunks"][record_id] = metadata["chunk_hash"]
+        offset += len(page["ids"])
+    return indexed
+
+
+class Reindexer:
+    """
+    Brings the global store in line with a scraped corpus, embedding only
+    new or changed chunks.
+    """
+
+    def __init__(self, vector_store: VectorStore, batch_size: int):
+        self.vector_store = vector_store
+        self.collection = vector_store.global_store
+        self.batch_size = batch_size
+        self.pending_ids: List[str] = []
+        self.pending_chunks: List[str] = []
+        self.pending_metadatas: List[dict] = []
+        self.stale_ids: List[str] = []
+        self.refreshed_ids: List[str] = []
+        self.refreshed_metadatas: List[dict] = []
+        self.counts = {
+            "documents": 0,
+            "unchanged": 0,
+            "new": 0,
+            "changed": 0,
+            "removed": 0,
+            "chunks_embedded": 0,
+            "chunks_deleted": 0,
+            "bytes": 0,
+        }
+
+    async def queue(self, record_id: str, chunk: str, metadata: dict) -> None:
+        self.pending_ids.append(record_id)
+        self.pending_chunks.append(chunk)
+        self.pending_metadatas.append(metadata)
+        if len(self.pending_ids) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if self.pending_ids:
+            # Straight to the model: the request-path batcher caps batches at
+            # embedding_batch_size
+            vectors = await asyncio.to_thread(
+                self.vector_store.embedding_model.encode,
+                self.pending_chunks,
+                batch_size=settings.reindex_embed_batch_size,
+            )
+            await self.collection.upsert(
+                ids=self.pending_ids,
+                documents=self.pending_chunks,
+                metadatas=self.pending_metadatas,
+                embeddings=vectors,
+            )
+            self.counts["chunks_embedded"] += len(self.pending_ids)
+            self.pending_ids, self.pending_chunks, self.pending_metadatas = [], [], []
+
+        if self.refreshed_ids:
+            await self.collection.update(
+                ids=self.refreshed_ids, metadatas=self.refreshed_metadatas
+            )
+            self.refreshed_ids, self.refreshed_metadatas = [], []
+
+        if self.stale_ids:
+            await self.collection.delete(ids=self.stale_ids)
+            self.counts["chunks_deleted"] += len(self.stale_ids)
+            self.stale_ids = []
+
+    async def index_document(self, record: dict, existing: dict | None) -> None:
+        url, text = record["url"], record["text"]
+        doc_hash = record.get("hash") or chunk_hash(text)
+        self.counts["documents"] += 1
+        self.counts["bytes"] += len(text.encode("utf-8"))
+
+        if existing is not None and existing["doc_hash"] == doc_hash:
+            self.counts["unchanged"] += 1
+            return
+        self.counts["changed" if existing is not None else "new"] += 1
+
+        chunker = TextChunker(
+            settings.ingest_chunk_size,
+            settings.ingest_chunk_overlap,
+            content_defined=True,
+        )
+        chunks = []
+        for line in text.splitlines():
+            chunks.extend(chunker.feed(line))
+        chunks.extend(chunker.finish())
+
+        old_chunks = existing["chunks"] if existing is not None else {}
+        live_ids = set()
+        for chunk in chunks:
+            record_id = chunk_id(url, chunk)
+            if record_id in live_ids:
+                continue
+            live_ids.add(record_id)
+            metadata = {
+                "source": url,
+                "origin": ORIGIN,
+                "doc_hash": doc_hash,
+                "chunk_hash": chunk_hash(chunk),
+            }
+            if old_chunks.get(record_id) == metadata["chunk_hash"]:
+                # Already embedded, only refresh the doc hash
+                self.refreshed_ids.append(record_id)
+                self.refreshed_metadatas.append(metadata)
+                continue
+            await self.queue(record_id, chunk, metadata)
+
+        self.stale_ids.extend(i for i in old_chunks if i not in live_ids)
+
+    async def remove_documents(self, indexed: Dict[str, dict], seen: set) -> None:
+        for url, doc in indexed.items():
+            if url not in seen:
+                self.counts["removed"] += 1
+                self.stale_ids.extend(doc["chunks"])
+
+
+async def reindex(corpus_dir: str, batch_size: int, prune: bool = True) -> dict:
+    """
+    Diff the corpus against the global store by content hash, upsert new or
+    changed chunks in large batches, and delete vectors for removed articles.
+    """
+    started = time.perf_counter()
+    chroma_client = await create_vector_client()
+    vector_store = await VectorStore.create(chroma_client)
+
+    try:
+        reindexer = Reindexer(vector_store, batch_size)
+        indexed = await load_indexed(vector_store.global_store)
+        seen = set()
+
+        for record in iter_corpus(corpus_dir):
+            seen.add(record["url"])
+            await reindexer.index_document(record, indexed.get(record["url"]))
+
+        if prune:
+            await reindexer.remove_documents(indexed, seen)
+        await reindexer.flush()
+    finally:
+        await vector_store.close()
+
+    elapsed = time.perf_counter() - started
+    counts = reindexer.counts
+    return {
+        **counts,
+        "seconds": round(elapsed, 2),
+        "documents_per_second": round(counts["documents"] / elapsed, 2),
+        "chunks_per_second": round(counts["chunks_embedded"] / elapsed, 2),
+        "mb_per_second": round(counts["bytes"] / elapsed / (1024 * 1024), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Incrementally index a scraped corpus into the global store"
+    )
+    parser.add_argument("corpus_dir")
+    parser.add_argument("--batch-size", type=int, default=settings.reindex_batch_size)
+    parser.add_argument(
+        "--no-prune",
+        action="store_true",
+        help="Keep vectors for articles that are no longer in the corpus",
+    )
+    args = parser.parse_args()
+
+    report = asyncio.run(reindex(args.corpus_dir, args.batch_size, not args.no_prune))
+    print(json.dumps(report))
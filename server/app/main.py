@@ -1,10 +1,43 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from app.config import settings
+from app.db.chroma import vector_store_state
 from app.routers import api
+from app.services.context import token_counter
+from app.services.llm import llm_clients
+from app.services.startup import startup_timings
+from app.services.telemetry import telemetry
+
+startup_timings.mark("imported")
+
+
+def _report_tokenizer_load(loading: asyncio.Future) -> None:
+    if not loading.cancelled() and loading.exception() is not None:
+        print("Error loading prompt tokenizer:", loading.exception())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    telemetry.setup()
+    llm_clients.open()
+    vector_store_state.start()
+    # Load the prompt tokenizer off the event loop before the first query
+    loading = asyncio.get_running_loop().run_in_executor(None, token_counter.load)
+    loading.add_done_callback(_report_tokenizer_load)
+    startup_timings.mark("serving")
+    yield
+    await vector_store_state.stop()
+    await llm_clients.close()
+    telemetry.shutdown()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,4 +51,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        with telemetry.span("request", method=request.method, path=request.url.path):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        telemetry.observe_request(
+            request.method,
+            route.path if route is not None else "unmatched",
+            status,
+            time.perf_counter() - started,
+        )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 app.include_router(api.router, prefix="/api/v1")
@@ -1,79 +1,231 @@
-from typing import List, Optional
+import asyncio
+import json
+import math
+from typing import AsyncIterator, List, Optional
 
-from fastapi import (APIRouter, Depends, File, Form, HTTPException, Request,
-                     UploadFile)
-from google import genai
-from groq import AsyncGroq
+from fastapi import (APIRouter, BackgroundTasks, Depends, File, Form,
+                     HTTPException, Request, Response, UploadFile)
+from fastapi.responses import StreamingResponse
 
-from app.db.chroma import VectorStore, get_vector_store
+from app.db.chroma import VectorStore, get_vector_store, vector_store_state
 from app.schema import QueryLLMRequest
-from app.services.llm import (extract_text_from_image, format_prompt,
-                              format_vibe_check_prompt, get_gemini_client,
-                              get_groq_client)
+from app.services.admission import Rejected, admission, client_ip
+from app.services.context import prompt_stats
+from app.services.images import ocr_cache
+from app.services.ingest import describe_job, run_ingest_job, start_ingest_job
+from app.services.llm import (LLMRouter, NoHealthyBackend, build_rag_prompt,
+                              extract_text_from_image, format_vibe_check_prompt,
+                              get_gemini_client, get_llm_router, llm_router,
+                              split_bubbles)
+from app.services.response_cache import (CACHE_HEADER, ResponseCache,
+                                         query_response_cache,
+                                         vibe_response_cache)
+from app.services.startup import startup_timings
+from app.services.telemetry import telemetry
 
 router = APIRouter()
 
+PROMPT_TOKENS_HEADER = "X-Prompt-Tokens"
+
+
+def ndjson_response(
+    events: AsyncIterator[dict], headers: Optional[dict] = None
+) -> StreamingResponse:
+    """
+    Stream events as newline-delimited JSON, ending with a `done` or `error`
+    event so clients can tell a finished stream from a dropped one.
+    """
+
+    async def encode() -> AsyncIterator[bytes]:
+        try:
+            async for event in events:
+                yield (json.dumps(event) + "\n").encode("utf-8")
+        except asyncio.TimeoutError:
+            yield b'{"type": "error", "detail": "LLM request timed out"}\n'
+            return
+        except Rejected as e:
+            yield (json.dumps({"type": "error", "detail": e.detail}) + "\n").encode(
+                "utf-8"
+            )
+            return
+        except Exception as e:
+            print("Error streaming LLM response:", e)
+            yield b'{"type": "error", "detail": "Unexpected error in querying LLM"}\n'
+            return
+        yield b'{"type": "done"}\n'
+
+    return StreamingResponse(
+        encode(), media_type="application/x-ndjson", headers=headers
+    )
+
+
+async def cache_stream(
+    pieces: AsyncIterator[str],
+    cache: ResponseCache,
+    key: str,
+    separator: str = "",
+    scope: str = "",
+    vector=None,
+) -> AsyncIterator[str]:
+    """
+    Pass streamed text through and cache the joined result once the stream
+    finishes cleanly.
+    """
+    collected = []
+    async for piece in pieces:
+        collected.append(piece)
+        yield piece
+    text = separator.join(collected)
+    telemetry.observe_payload("completion", len(text.encode("utf-8")))
+    cache.store(key, text, scope, vector)
+
+
+async def _single(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+def no_provider_error(error: NoHealthyBackend) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="No LLM provider is available",
+        headers={"Retry-After": str(math.ceil(error.retry_after))},
+    )
+
+
+def ensure_llm_available(llm_router: LLMRouter, task: str) -> None:
+    try:
+        llm_router.ensure_available(task)
+    except NoHealthyBackend as e:
+        raise no_provider_error(e)
+
+
+async def complete_with_router(llm_router: LLMRouter, task: str, content: str) -> str:
+    """
+    Run a completion through the provider router, mapping its failures to
+    HTTP errors.
+    """
+    try:
+        return await llm_router.complete(task, content)
+    except NoHealthyBackend as e:
+        raise no_provider_error(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="LLM request timed out")
+    except Exception as e:
+        print("Error querying LLM providers:", e)
+        raise HTTPException(status_code=502, detail="LLM providers failed")
+
 
 @router.get("/ping")
 async def pong():
-    return {"message": "pong"}
+    return {
+        "message": "pong",
+        "vector_store": vector_store_state.describe(),
+        "ocr_cache": ocr_cache.stats(),
+        "response_cache": {
+            "query": query_response_cache.stats(),
+            "vibe": vibe_response_cache.stats(),
+        },
+        "prompts": prompt_stats.stats(),
+        "llm": llm_router.describe(),
+        "admission": admission.stats(),
+        "startup": startup_timings.describe(),
+    }
 
 
 @router.post("/query")
 async def query(
     request: QueryLLMRequest,
+    http_request: Request,
+    response: Response,
     vector_store: VectorStore = Depends(get_vector_store),
-    groq_client: AsyncGroq = Depends(get_groq_client),
+    llm_router: LLMRouter = Depends(get_llm_router),
 ) -> dict:
     """
     Query LLM with RAG retrieval.
     """
-    # Retrieve global knowledge
-    global_context = await vector_store.retrieve_global_knowledge(request.query)
+    admission.check_rate(http_request, request.user_id)
 
-    # Retrieve user documents if user_id is provided
-    user_context = (
-        await vector_store.retrieve_user_docs(request.user_id, request.query)
-        if request.user_id
-        else []
+    # Retrieve global knowledge and, if user_id is provided, user documents
+    async with admission.slot("embedding"):
+        context = await vector_store.retrieve_context(request.query, request.user_id)
+    # Reused for the semantic response cache instead of embedding again
+    query_vector = context["query_vector"]
+    # Tokenizing runs in a thread so long documents don't stall the event loop
+    content, prompt_tokens = await asyncio.to_thread(
+        build_rag_prompt,
+        context["user"],
+        context["global"],
+        request.query,
+        llm_router.context_window("query"),
     )
+    telemetry.observe_payload("prompt", len(content.encode("utf-8")))
 
-    content = format_prompt(user_context, global_context, request.query)
-
-    res = ""
+    cache_key = ResponseCache.key(llm_router.cache_model("query"), content)
+    cache_scope = f"user:{request.user_id}" if request.user_id else "global"
+    cached, cache_status = query_response_cache.lookup(
+        cache_key, cache_scope, query_vector
+    )
 
-    try:
-        completion = await groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": content,
-                }
-            ],
-            model="llama3-8b-8192",
+    if request.stream:
+        if cached is None:
+            ensure_llm_available(llm_router, "query")
+            admission.ensure_capacity("llm")
+        pieces = (
+            _single(cached)
+            if cached is not None
+            else cache_stream(
+                admission.hold("llm", llm_router.stream("query", content)),
+                query_response_cache,
+                cache_key,
+                scope=cache_scope,
+                vector=query_vector,
+            )
         )
-        res = completion.choices[0].message.content
-    except Exception as e:
-        print("Error querying groq api: ", e)
-        raise HTTPException(status_code=500, detail="Unexpected error in querying LLM")
+        return ndjson_response(
+            ({"type": "token", "text": text} async for text in pieces),
+            headers={
+                CACHE_HEADER: cache_status,
+                PROMPT_TOKENS_HEADER: str(prompt_tokens),
+            },
+        )
+
+    response.headers[CACHE_HEADER] = cache_status
+    response.headers[PROMPT_TOKENS_HEADER] = str(prompt_tokens)
+    if cached is not None:
+        return {"message": "Completion successful", "result": cached}
+
+    async with admission.slot("llm"):
+        res = await complete_with_router(llm_router, "query", content)
+    telemetry.observe_payload("completion", len((res or "").encode("utf-8")))
+    query_response_cache.store(cache_key, res, cache_scope, query_vector)
 
     return {"message": "Completion successful", "result": res}
 
 
 @router.post("/query/vibe")
 async def vibe_check_query(
+    http_request: Request,
+    response: Response,
     query: Optional[str] = Form(None),
     images: Optional[List[UploadFile]] = File(None),
+    stream: bool = Form(False),
+    user_id: Optional[int] = Form(None),
     # vector_store: VectorStore = Depends(get_vector_store),
-    groq_client: AsyncGroq = Depends(get_groq_client),
-    gemini_client: genai.Client = Depends(get_gemini_client),
+    llm_router: LLMRouter = Depends(get_llm_router),
+    gemini_client=Depends(get_gemini_client),
 ) -> dict:
     """
     Query LLM for a vibe check with optional OCR-extracted text from images.
     """
 
+    # Each image costs as much as a query, OCR being the expensive part
+    admission.check_rate(http_request, user_id, cost=1 + len(images or []))
+
     # Extract text from images if provided
-    ocr_text = await extract_text_from_image(gemini_client, images) if images else None
+    ocr_text = None
+    if images:
+        async with admission.slot("ocr"):
+            ocr_text = await extract_text_from_image(gemini_client, images)
 
     # # Retrieve RAG-based knowledge
     # global_context = await vector_store.retrieve_global_knowledge(request.query)
@@ -85,25 +237,66 @@ async def vibe_check_query(
 
     # Format prompt for the vibe check
     content = format_vibe_check_prompt(user_prompt=query, ocr_text=ocr_text)
-    try:
-        # completion = await groq_client.chat.completions.create(
-        #     messages=[{"role": "user", "content": content}],
-        #     model="llama3-8b-8192",
-        # )
-        # response_text = completion.choices[0].message.content
-        response = gemini_client.models.generate_content(
-            model="gemini-2.0-pro-exp-02-05",
-            contents=content,
+    telemetry.observe_payload("prompt", len(content.encode("utf-8")))
+
+    # The semantic tier only applies once the shared embedding model is loaded,
+    # and only matches earlier answers to the same client
+    cache_key = ResponseCache.key(llm_router.cache_model("vibe"), content)
+    cache_scope = f"ip:{client_ip(http_request)}"
+    vibe_vector = None
+    if (
+        vibe_response_cache.enabled
+        and vibe_response_cache.semantic
+        and vector_store_state.ready
+    ):
+        async with admission.slot("embedding"):
+            vibe_vector = await vector_store_state.vector_store.embed_text(
+                f"{query or ''}\n{ocr_text or ''}"
+            )
+    cached, cache_status = vibe_response_cache.lookup(
+        cache_key, cache_scope, vibe_vector
+    )
+
+    if stream:
+        if cached is None:
+            ensure_llm_available(llm_router, "vibe")
+            admission.ensure_capacity("llm")
+        pieces = (
+            _single(cached)
+            if cached is not None
+            else cache_stream(
+                admission.hold("llm", llm_router.stream("vibe", content)),
+                vibe_response_cache,
+                cache_key,
+                scope=cache_scope,
+                vector=vibe_vector,
+            )
         )
-    except Exception as e:
-        print("Error querying Groq API:", e)
-        raise HTTPException(status_code=500, detail="Unexpected error in querying LLM")
+        return ndjson_response(
+            (
+                {"type": "bubble", "text": bubble}
+                async for bubble in split_bubbles(pieces)
+            ),
+            headers={CACHE_HEADER: cache_status},
+        )
+
+    response.headers[CACHE_HEADER] = cache_status
+    if cached is not None:
+        return {"message": "Vibe check complete", "result": cached}
+
+    async with admission.slot("llm"):
+        completion = await complete_with_router(llm_router, "vibe", content)
+    if completion:
+        telemetry.observe_payload("completion", len(completion.encode("utf-8")))
+    vibe_response_cache.store(cache_key, completion, cache_scope, vibe_vector)
 
-    return {"message": "Vibe check complete", "result": response}
+    return {"message": "Vibe check complete", "result": completion}
 
 
 @router.post("/upload/user")
 async def user_upload(
+    request: Request,
+    background_tasks: BackgroundTasks,
     user_id: Optional[int] = None,
     files: List[UploadFile] = File(...),
     vector_store: VectorStore = Depends(get_vector_store),
@@ -111,11 +304,20 @@ async def user_upload(
     """
     Store uploaded documents in user-only vector store.
     """
-    return {}
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="user_id is required")
+    admission.check_rate(request, user_id, cost=len(files))
+
+    job, paths = await start_ingest_job(files, user_id=user_id)
+    background_tasks.add_task(run_ingest_job, vector_store, job, paths)
+
+    return {"message": "Upload accepted", "result": job.describe()}
 
 
 @router.post("/upload/global")
 async def global_upload(
+    request: Request,
+    background_tasks: BackgroundTasks,
     user_id: Optional[int] = None,
     files: List[UploadFile] = File(...),
     vector_store: VectorStore = Depends(get_vector_store),
@@ -123,4 +325,21 @@ async def global_upload(
     """
     Store uploaded documents in global vector store.
     """
-    return {}
+    admission.check_rate(request, user_id, cost=len(files))
+
+    job, paths = await start_ingest_job(files)
+    background_tasks.add_task(run_ingest_job, vector_store, job, paths)
+
+    return {"message": "Upload accepted", "result": job.describe()}
+
+
+@router.get("/upload/jobs/{job_id}")
+async def upload_job(job_id: str) -> dict:
+    """
+    Poll the progress of an upload job.
+    """
+    job = describe_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+
+    return {"message": "Upload job status", "result": job}
@@ -6,3 +6,4 @@ from pydantic import BaseModel
 class QueryLLMRequest(BaseModel):
     user_id: Optional[int] = None
     query: str
+    stream: bool = False
@@ -0,0 +1,152 @@
+"""
+Prefork server: load the heavy models once, then fork Uvicorn workers that
+share them copy-on-write.
+
+`uvicorn --workers N` spawns fresh interpreters, so every worker imports
+the app and loads its own copy of the embedding model. Here the parent
+imports the app and loads the embedding model and prompt tokenizer first,
+freezes the GC so collections don't touch (and copy) the inherited pages,
+then forks workers that serve from one shared listening socket. Dead
+workers are replaced; SIGTERM/SIGINT stop them all.
+
+Directories that a single process locks can't be used with several
+workers: the hnsw vector index (vector_index_path) and the embedding disk
+cache (embedding_cache_dir). Upload job progress is written to files (see
+ingest_jobs_dir) so any worker can answer a poll.
+
+    python -m app.serve --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import os
+import signal
+import time
+
+import uvicorn
+
+from app.config import settings
+from app.services.startup import startup_timings
+
+
+def preload() -> None:
+    """
+    Import the app and load everything workers would otherwise each load.
+    """
+    with startup_timings.phase("preload"):
+        import app.main  # noqa: F401
+        from app.db.chroma import load_embedding_model
+        from app.services.context import token_counter
+
+        if settings.embedding_backend == "onnx":
+            # ONNX Runtime's thread pools don't survive a fork, so each worker
+            # opens its own session; only make sure the export exists
+            from app.services.onnx_embedding import ensure_exported
+
+            ensure_exported()
+        else:
+            load_embedding_model()
+        token_counter.load()
+
+
+def run_worker(config: uvicorn.Config, sock) -> None:
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+    # The inherited objects stay frozen; new allocations are collected as usual
+    gc.enable()
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    def __init__(self, config: uvicorn.Config, sock, workers: int):
+        self.config = config
+        self.sock = sock
+        self.workers = workers
+        self.pids: set[int] = set()
+        self.stopping = False
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.config, self.sock)
+            except BaseException as e:
+                print("Error in worker:", e)
+                code = 1
+            finally:
+                os._exit(code)
+        self.pids.add(pid)
+
+    def stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        # Stop the collector from rewriting the refcounted headers of
+        # everything loaded so far, which would un-share those pages
+        gc.disable()
+        gc.freeze()
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.pids:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            self.pids.discard(pid)
+            if not self.stopping:
+                print(f"Worker {pid} exited with status {status}, restarting")
+                # Don't spin if workers die straight away
+                time.sleep(1)
+                self.spawn()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=settings.app_port)
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 1))
+    )
+    parser.add_argument(
+        "--no-preload",
+        dest="preload",
+        action="store_false",
+        help="Let each worker import the app and load models itself",
+    )
+    args = parser.parse_args()
+    if args.workers > 1:
+        if settings.vector_backend == "hnsw":
+            parser.error(
+                "the hnsw vector backend keeps its index in a single process; "
+                "use --workers 1 or the chroma backend"
+            )
+        if settings.embedding_cache_dir:
+            parser.error(
+                "the embedding disk cache can only be opened by one process; "
+                "use --workers 1 or unset EMBEDDING_CACHE_DIR"
+            )
+
+    config = uvicorn.Config(
+        "app.main:app", host=args.host, port=args.port, timeout_graceful_shutdown=30
+    )
+    sock = config.bind_socket()
+    if args.preload:
+        preload()
+
+    Supervisor(config, sock, args.workers).run()
+
+
+if __name__ == "__main__":
+    main()
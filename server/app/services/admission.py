@@ -0,0 +1,282 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, Request
+
+from app.config import settings
+from app.services.telemetry import telemetry
+
+# Lower numbers are admitted first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+
+class Rejected(HTTPException):
+    """
+    A request turned away before doing the work: 429 for rate limits, 503
+    when a gate's queue is full or the wait timed out.
+    """
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, cost: float, now: float) -> float:
+        """
+        Spend `cost` tokens if available and return 0, otherwise return the
+        seconds until they will be.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token bucket per key, keeping at most `max_keys` buckets (least recently
+    used are forgotten, which only ever makes a client less limited).
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, max_keys: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def check(self, key: str, cost: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+
+        wait = bucket.take(min(cost, self.burst), now)
+        if wait:
+            telemetry.count_rejection(self.name, "rate_limited")
+            raise Rejected(429, "Too many requests", wait)
+
+
+class AdmissionGate:
+    """
+    Caps concurrent work of one class, with a bounded priority wait queue.
+
+    Up to `limit` holders run at once. Others wait, lowest priority value
+    first, for at most `queue_timeout` seconds; when `queue_size` are
+    already waiting, new arrivals are rejected immediately with a 503 and a
+    Retry-After estimated from recent service times.
+    """
+
+    def __init__(
+        self, name: str, limit: int, queue_size: int, queue_timeout: float
+    ):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.queue: list = []
+        self._order = itertools.count()
+        self.service_seconds = 1.0
+        self.rejected = 0
+
+    def ensure_capacity(self) -> None:
+        """
+        Reject now if a new arrival would be turned away by `acquire`.
+        """
+        if self.in_flight >= self.limit and self.waiting >= self.queue_size:
+            self._reject("queue_full")
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE, bounded=True):
+        if self.in_flight < self.limit and not self.queue:
+            self.in_flight += 1
+            self._report()
+            return
+
+        if bounded and self.waiting >= self.queue_size:
+            self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._order), waiter)
+        heapq.heappush(self.queue, entry)
+        if bounded:
+            self.waiting += 1
+        self._report()
+
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout if bounded else None)
+        except asyncio.TimeoutError:
+            self._dequeue(entry)
+            self._reject("queue_timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as we were cancelled: pass it on
+                self.release()
+            else:
+                self._dequeue(entry)
+            raise
+        finally:
+            if bounded:
+                self.waiting -= 1
+            self._report()
+            telemetry.observe_admission_wait(self.name, time.perf_counter() - started)
+
+    def release(self, service_seconds: Optional[float] = None) -> None:
+        if service_seconds is not None:
+            self.service_seconds = 0.9 * self.service_seconds + 0.1 * service_seconds
+
+        while self.queue:
+            _, _, waiter = heapq.heappop(self.queue)
+            if not waiter.done():
+                # Hand the slot straight to the next waiter
+                waiter.set_result(None)
+                self._report()
+                return
+
+        self.in_flight -= 1
+        self._report()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE, bounded=True):
+        await self.acquire(priority, bounded)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    def _dequeue(self, entry: tuple) -> None:
+        if entry in self.queue:
+            self.queue.remove(entry)
+            heapq.heapify(self.queue)
+
+    def _reject(self, reason: str) -> None:
+        self.rejected += 1
+        telemetry.count_rejection(self.name, reason)
+        # Time for everyone ahead to drain through `limit` slots
+        retry_after = self.service_seconds * (len(self.queue) + 1) / self.limit
+        raise Rejected(503, "Server is busy, try again shortly", retry_after)
+
+    def _report(self) -> None:
+        telemetry.set_admission_depth(self.name, self.in_flight, len(self.queue))
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": len(self.queue),
+            "rejected": self.rejected,
+            "service_ms": round(self.service_seconds * 1000, 1),
+        }
+
+
+class Admission:
+    """
+    Per-client rate limits and per-class concurrency gates for the API.
+    """
+
+    def __init__(self):
+        self.enabled = settings.admission_enabled
+        self.users = RateLimiter(
+            "user",
+            settings.rate_limit_user_rps,
+            settings.rate_limit_user_burst,
+            settings.rate_limit_max_keys,
+        )
+        self.ips = RateLimiter(
+            "ip",
+            settings.rate_limit_ip_rps,
+            settings.rate_limit_ip_burst,
+            settings.rate_limit_max_keys,
+        )
+        self.gates = {
+            name: AdmissionGate(
+                name,
+                limit,
+                settings.admission_queue_size,
+                settings.admission_queue_timeout_seconds,
+            )
+            for name, limit in (
+                ("ocr", settings.admission_ocr_limit),
+                ("llm", settings.admission_llm_limit),
+                ("embedding", settings.admission_embedding_limit),
+            )
+        }
+
+    def check_rate(
+        self, request: Request, user_id: Optional[int] = None, cost: float = 1.0
+    ) -> None:
+        """
+        Spend `cost` tokens from the caller's IP bucket and, if known, their
+        user bucket.
+        """
+        if not self.enabled:
+            return
+        self.ips.check(client_ip(request), cost)
+        if user_id is not None:
+            self.users.check(str(user_id), cost)
+
+    def ensure_capacity(self, gate: str) -> None:
+        if self.enabled:
+            self.gates[gate].ensure_capacity()
+
+    @asynccontextmanager
+    async def slot(
+        self, gate: str, priority: int = PRIORITY_INTERACTIVE, bounded: bool = True
+    ):
+        if not self.enabled:
+            yield
+            return
+        async with self.gates[gate].slot(priority, bounded):
+            yield
+
+    async def hold(self, gate: str, pieces: AsyncIterator) -> AsyncIterator:
+        """
+        Hold a slot for as long as a streamed response is being produced.
+        """
+        async with self.slot(gate):
+            async for piece in pieces:
+                yield piece
+
+    def stats(self) -> dict:
+        return {name: gate.stats() for name, gate in self.gates.items()}
+
+
+def client_ip(request: Request) -> str:
+    if settings.rate_limit_trust_forwarded:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+admission = Admission()
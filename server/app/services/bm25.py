@@ -0,0 +1,75 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    In-process inverted index scored with Okapi BM25.
+
+    Mirrors the chunks held in a Chroma collection so keyword matches can be
+    fused with vector matches. Postings are term -> {chunk id: term freq}.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.doc_terms: Dict[str, Counter] = {}
+        self.lengths: Dict[str, int] = {}
+        self.texts: Dict[str, str] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def add(self, doc_id: str, text: str) -> None:
+        if doc_id in self.doc_terms:
+            self.remove(doc_id)
+
+        terms = Counter(tokenize(text))
+        for term, freq in terms.items():
+            self.postings[term][doc_id] = freq
+        self.doc_terms[doc_id] = terms
+        self.lengths[doc_id] = sum(terms.values())
+        self.texts[doc_id] = text
+        self.total_length += self.lengths[doc_id]
+
+    def remove(self, doc_id: str) -> None:
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+        self.texts.pop(doc_id, None)
+        self.total_length -= self.lengths.pop(doc_id)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        if not self.doc_terms:
+            return []
+
+        n_docs = len(self.doc_terms)
+        avg_length = self.total_length / n_docs
+        scores: Dict[str, float] = defaultdict(float)
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings.items():
+                length = self.lengths[doc_id]
+                norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
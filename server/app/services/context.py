@@ -0,0 +1,181 @@
+import math
+import threading
+from typing import List, Optional
+
+from app.config import settings
+from app.services.telemetry import telemetry
+
+# Rough size of a token when no tokenizer could be loaded
+CHARS_PER_TOKEN = 4
+# Upper bound on characters per token, used to cut huge documents before
+# they are tokenized at all
+MAX_CHARS_PER_TOKEN = 8
+
+
+class TokenCounter:
+    """
+    Counts and truncates text by tokens with a Rust `tokenizers` tokenizer.
+
+    The tokenizer is loaded once per worker. If it cannot be loaded, counts
+    fall back to a characters-per-token estimate so prompts are still
+    bounded.
+    """
+
+    def __init__(self, tokenizer_name: Optional[str]):
+        self.tokenizer_name = tokenizer_name
+        self.tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.tokenizer_name:
+                return
+
+            try:
+                from tokenizers import Tokenizer
+
+                tokenizer = Tokenizer.from_pretrained(self.tokenizer_name)
+                tokenizer.no_truncation()
+                tokenizer.no_padding()
+                self.tokenizer = tokenizer
+            except Exception as e:
+                print("Error loading prompt tokenizer, estimating tokens:", e)
+
+    def count(self, text: str) -> int:
+        return self.count_many([text])[0]
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        self.load()
+        if self.tokenizer is None:
+            return [math.ceil(len(text) / CHARS_PER_TOKEN) for text in texts]
+
+        encodings = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [len(encoding.ids) for encoding in encodings]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Cut `text` down to at most `max_tokens` tokens, on a token boundary.
+        """
+        self.load()
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is None:
+            return text[: max_tokens * CHARS_PER_TOKEN]
+
+        encoding = self.tokenizer.encode(
+            text[: max_tokens * MAX_CHARS_PER_TOKEN], add_special_tokens=False
+        )
+        if len(encoding.ids) <= max_tokens:
+            return text[: max_tokens * MAX_CHARS_PER_TOKEN]
+        return text[: encoding.offsets[max_tokens - 1][1]]
+
+
+class ContextChunk:
+    def __init__(self, source: str, text: str, score: float, tokens: int):
+        self.source = source
+        self.text = text
+        self.score = score
+        self.tokens = tokens
+
+
+class PackedContext:
+    def __init__(self):
+        self.chunks: List[ContextChunk] = []
+        self.tokens = 0
+        self.dropped = 0
+        self.truncated = 0
+
+    def texts(self, source: str) -> List[str]:
+        return [chunk.text for chunk in self.chunks if chunk.source == source]
+
+
+def pack_context(
+    counter: TokenCounter,
+    budget: int,
+    user_hits: List[dict],
+    global_hits: List[dict],
+    max_chunk_tokens: int,
+    min_chunk_tokens: int,
+) -> PackedContext:
+    """
+    Greedily fill `budget` tokens with retrieved chunks.
+
+    User hits are packed before global hits, matching the prompt's priority,
+    and each group is taken highest score first. Chunks longer than
+    `max_chunk_tokens` are cut down, and the chunk that overflows the budget
+    is trimmed to fit as long as at least `min_chunk_tokens` remain.
+    """
+    candidates = []
+    seen = set()
+    for source, hits in (("user", user_hits), ("global", global_hits)):
+        for hit in sorted(hits, key=lambda hit: hit.get("score", 0.0), reverse=True):
+            text = (hit.get("text") or "").strip()
+            if not text or text in seen:
+                continue
+            seen.add(text)
+            # Never tokenize more of a document than could possibly be kept
+            text = text[: max_chunk_tokens * MAX_CHARS_PER_TOKEN]
+            candidates.append((source, text, hit.get("score", 0.0)))
+
+    packed = PackedContext()
+    token_counts = counter.count_many([text for _, text, _ in candidates])
+
+    for (source, text, score), tokens in zip(candidates, token_counts):
+        remaining = budget - packed.tokens
+        limit = min(max_chunk_tokens, remaining)
+        if limit < min_chunk_tokens and tokens > limit:
+            packed.dropped += 1
+            continue
+
+        if tokens > limit:
+            text = counter.truncate(text, limit)
+            tokens = counter.count(text)
+            packed.truncated += 1
+
+        packed.chunks.append(ContextChunk(source, text, score, tokens))
+        packed.tokens += tokens
+
+    return packed
+
+
+class PromptStats:
+    """
+    Running totals for assembled prompts, reported by `/ping`.
+    """
+
+    def __init__(self):
+        self.prompts = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self.last_tokens = 0
+        self.dropped_chunks = 0
+        self.truncated_chunks = 0
+
+    def record(self, tokens: int, packed: PackedContext) -> None:
+        self.prompts += 1
+        self.total_tokens += tokens
+        self.max_tokens = max(self.max_tokens, tokens)
+        self.last_tokens = tokens
+        self.dropped_chunks += packed.dropped
+        self.truncated_chunks += packed.truncated
+        telemetry.observe_prompt_tokens(tokens)
+
+    def stats(self) -> dict:
+        return {
+            "prompts": self.prompts,
+            "mean_tokens": (
+                round(self.total_tokens / self.prompts, 1) if self.prompts else 0.0
+            ),
+            "max_tokens": self.max_tokens,
+            "last_tokens": self.last_tokens,
+            "dropped_chunks": self.dropped_chunks,
+            "truncated_chunks": self.truncated_chunks,
+        }
+
+
+token_counter = TokenCounter(settings.prompt_tokenizer)
+prompt_stats = PromptStats()
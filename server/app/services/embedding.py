@@ -0,0 +1,116 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+EncodeFn = Callable[[List[str]], Sequence[Sequence[float]]]
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches embedding requests from concurrent coroutines.
+
+    Texts are queued and flushed as a single encode call on a dedicated
+    thread once `max_batch_size` texts are waiting or `max_wait_ms` has
+    passed since the first one arrived. The queue is bounded, so callers
+    wait for room instead of piling unbounded work onto the encoder.
+    """
+
+    def __init__(
+        self,
+        encode: EncodeFn,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        max_queue_size: int = 1024,
+    ):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue: asyncio.Queue[Tuple[str, asyncio.Future]] = asyncio.Queue(
+            maxsize=max_queue_size
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="embedding"
+        )
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        # Fail anything still queued so no awaiter hangs forever
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Embedding batcher stopped"))
+
+        self._executor.shutdown(wait=False)
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        Queue one text and wait for its vector.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def embed_many(self, texts: Sequence[str]) -> List[List[float]]:
+        """
+        Queue several texts and wait for all of their vectors, in order.
+        """
+        return list(await asyncio.gather(*(self.embed(text) for text in texts)))
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = await self._collect()
+            # Callers that were cancelled while queued don't need encoding
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            texts = [text for text, _ in batch]
+            try:
+                vectors = await loop.run_in_executor(
+                    self._executor, self.encode, texts
+                )
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Embedding batcher stopped"))
+                raise
+            except Exception as e:
+                print("Error encoding embedding batch:", e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
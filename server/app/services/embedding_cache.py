@@ -0,0 +1,240 @@
+import fcntl
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.services.telemetry import telemetry
+
+KEY_WIDTH = 64
+RECORD_WIDTH = KEY_WIDTH + 1
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    """
+    Content address for an embedding: the model name and text, hashed.
+    """
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class DiskEmbeddingTier:
+    """
+    Fixed-capacity ring of float32 vectors in a memory-mapped file.
+
+    Row `i` of `vectors.f32` belongs to the key stored in record `i` of
+    `keys.txt`, so the cache survives restarts without a separate index
+    rebuild step. Once full, the oldest rows are overwritten.
+
+    The directory is locked while open: each process keeps its own row map
+    and write position, so two processes sharing it would overwrite each
+    other's rows. A second process gets a RuntimeError.
+    """
+
+    def __init__(self, directory: str, capacity: int):
+        self.directory = directory
+        self.capacity = capacity
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.keys_path = os.path.join(directory, "keys.txt")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.lock_path = os.path.join(directory, "LOCK")
+
+        self.dim: Optional[int] = None
+        self.head = 0
+        self.rows: Dict[str, int] = {}
+        self.vectors: Optional[np.memmap] = None
+        self.keys_file = None
+
+        os.makedirs(directory, exist_ok=True)
+        self.lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise RuntimeError(f"{directory} is in use by another process")
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.meta_path):
+            return
+
+        with open(self.meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+
+        if meta.get("capacity") != self.capacity:
+            print("Embedding cache capacity changed, discarding on-disk tier")
+            for path in (self.vectors_path, self.keys_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+
+        self._open(meta["dim"])
+        self.head = meta.get("head", 0)
+
+        for row in range(self.capacity):
+            self.keys_file.seek(row * RECORD_WIDTH)
+            key = self.keys_file.read(KEY_WIDTH).decode("ascii").strip("\0")
+            if key:
+                self.rows[key] = row
+
+    def _open(self, dim: int) -> None:
+        self.dim = dim
+        mode = "r+" if os.path.exists(self.vectors_path) else "w+"
+        self.vectors = np.memmap(
+            self.vectors_path, dtype=np.float32, mode=mode, shape=(self.capacity, dim)
+        )
+
+        if not os.path.exists(self.keys_path):
+            with open(self.keys_path, "wb") as f:
+                f.truncate(self.capacity * RECORD_WIDTH)
+        self.keys_file = open(self.keys_path, "r+b")
+
+        self._write_meta()
+
+    def _write_meta(self) -> None:
+        staging = self.meta_path + ".tmp"
+        with open(staging, "w", encoding="utf-8") as f:
+            json.dump(
+                {"dim": self.dim, "capacity": self.capacity, "head": self.head}, f
+            )
+        os.replace(staging, self.meta_path)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        return np.array(self.vectors[row])
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        if key in self.rows:
+            return
+        if self.vectors is None:
+            self._open(vector.shape[0])
+        if vector.shape[0] != self.dim:
+            return
+
+        row = self.head
+        self.head = (self.head + 1) % self.capacity
+        # Saved as it moves so a restart after a crash doesn't overwrite
+        # the newest rows first
+        self._write_meta()
+
+        # Forget whichever key previously owned this row, and unlink it on
+        # disk before the vector changes so a crash can't pair the two
+        self.keys_file.seek(row * RECORD_WIDTH)
+        old_key = self.keys_file.read(KEY_WIDTH).decode("ascii").strip("\0")
+        if old_key:
+            self.rows.pop(old_key, None)
+            self.keys_file.seek(row * RECORD_WIDTH)
+            self.keys_file.write(b"\0" * KEY_WIDTH)
+            self.keys_file.flush()
+
+        self.vectors[row] = vector
+        self.keys_file.seek(row * RECORD_WIDTH)
+        self.keys_file.write(key.encode("ascii") + b"\n")
+        self.keys_file.flush()
+        self.rows[key] = row
+
+    def close(self) -> None:
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.keys_file.close()
+            self._write_meta()
+            self.vectors = None
+        self.lock_file.close()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache.
+
+    An in-memory LRU tier is bounded by `max_bytes`; an optional on-disk
+    tier keeps float32 vectors across restarts. Disk hits are promoted
+    back into memory.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        disk_capacity: int = 100_000,
+    ):
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = None
+        if disk_dir:
+            try:
+                self.disk = DiskEmbeddingTier(disk_dir, disk_capacity)
+            except RuntimeError as e:
+                print("Error opening the embedding disk cache, using memory only:", e)
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        return embedding_key(self.model_name, text)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.key(text)
+
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            telemetry.count_cache("embedding", "memory_hit")
+            return vector
+
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                self.disk_hits += 1
+                telemetry.count_cache("embedding", "disk_hit")
+                self._remember(key, vector)
+                return vector
+
+        self.misses += 1
+        telemetry.count_cache("embedding", "miss")
+        return None
+
+    def put(self, text: str, vector) -> None:
+        key = self.key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, vector)
+        if self.disk is not None:
+            self.disk.put(key, vector)
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        if vector.nbytes > self.max_bytes:
+            return
+
+        self.memory[key] = vector
+        self.memory_bytes += vector.nbytes
+
+        while self.memory_bytes > self.max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_bytes,
+            "disk_entries": len(self.disk.rows) if self.disk is not None else 0,
+        }
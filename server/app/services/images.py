@@ -0,0 +1,85 @@
+import hashlib
+import io
+from typing import List, Optional, Tuple
+
+from cachetools import TTLCache
+from PIL import Image, ImageOps
+
+from app.config import settings
+from app.services.telemetry import telemetry
+
+
+def preprocess_image(data: bytes, content_type: str) -> Tuple[bytes, str]:
+    """
+    Downscale an image so its longest side fits `ocr_max_image_side` and
+    re-encode it as JPEG. Images that are already small enough are passed
+    through untouched. CPU bound, so call it off the event loop.
+    """
+    max_side = settings.ocr_max_image_side
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+    except Exception as e:
+        print("Error decoding image, sending original bytes:", e)
+        return data, content_type
+
+    if max(image.size) <= max_side and len(data) <= settings.ocr_passthrough_bytes:
+        return data, content_type
+
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=settings.ocr_jpeg_quality, optimize=True)
+    encoded = out.getvalue()
+
+    # Re-encoding a small, already compressed image can make it bigger
+    if len(encoded) >= len(data):
+        return data, content_type
+    return encoded, "image/jpeg"
+
+
+class OCRCache:
+    """
+    TTL- and size-bounded cache of OCR text keyed on image content.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.entries: TTLCache = TTLCache(
+            maxsize=max_bytes, ttl=ttl_seconds, getsizeof=len
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, prompt: str, images: List[bytes]) -> str:
+        digest = hashlib.sha256(f"{model}\0{prompt}".encode("utf-8"))
+        for data in images:
+            digest.update(hashlib.sha256(data).digest())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        text = self.entries.get(key)
+        if text is None:
+            self.misses += 1
+            telemetry.count_cache("ocr", "miss")
+        else:
+            self.hits += 1
+            telemetry.count_cache("ocr", "hit")
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        if len(text) <= self.entries.maxsize:
+            self.entries[key] = text
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "size": self.entries.currsize,
+        }
+
+
+ocr_cache = OCRCache(settings.ocr_cache_max_bytes, settings.ocr_cache_ttl_seconds)
@@ -0,0 +1,284 @@
+import asyncio
+import codecs
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+import zlib
+from typing import AsyncIterator, List, Optional
+
+from fastapi import UploadFile
+
+from app.config import settings
+from app.services.admission import PRIORITY_BULK, admission
+from app.services.telemetry import telemetry
+
+MAX_TRACKED_JOBS = 1000
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+# Content-defined cuts: the characters hashed before a candidate whitespace,
+# and roughly how many candidates apart boundaries fall
+ANCHOR_WINDOW = 16
+ANCHOR_SPACING = 16
+
+
+class IngestJob:
+    """
+    Progress of one upload request, polled through /upload/jobs/{job_id}.
+
+    The job runs in the worker that accepted the upload, but polls may land
+    on any worker, so its state is written to a file in `jobs_dir()` as it
+    changes and polls read it back from there.
+    """
+
+    def __init__(self, files: List[str], user_id: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.files = files
+        self.status = "queued"
+        self.files_done = 0
+        self.chunks_indexed = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def describe(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "files_total": len(self.files),
+            "files_done": self.files_done,
+            "chunks_indexed": self.chunks_indexed,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    def save(self) -> None:
+        path = os.path.join(jobs_dir(), f"{self.id}.json")
+        staging = f"{path}.{os.getpid()}.tmp"
+        with open(staging, "w") as f:
+            json.dump(self.describe(), f)
+        os.replace(staging, path)
+
+
+def jobs_dir() -> str:
+    directory = settings.ingest_jobs_dir or os.path.join(
+        tempfile.gettempdir(), "ingest-jobs"
+    )
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def register_job(job: IngestJob) -> None:
+    job.save()
+    directory = jobs_dir()
+    saved = [entry for entry in os.scandir(directory) if entry.name.endswith(".json")]
+    if len(saved) <= MAX_TRACKED_JOBS:
+        return
+    saved.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in saved[: len(saved) - MAX_TRACKED_JOBS]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            # Pruned by another worker
+            pass
+
+
+def describe_job(job_id: str) -> Optional[dict]:
+    """
+    Last saved state of a job, from whichever worker runs it.
+    """
+    if not JOB_ID.fullmatch(job_id):
+        return None
+    try:
+        with open(os.path.join(jobs_dir(), f"{job_id}.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class TextChunker:
+    """
+    Incrementally normalizes lines and splits them into overlapping chunks.
+
+    Normalization matches `clean_text` in pipelines/utils/cleaning.py: each
+    line is stripped and runs of blank lines collapse to a single one. Only
+    the current chunk plus its overlap is held in memory.
+    """
+
+    def __init__(self, size: int, overlap: int, content_defined: bool = False):
+        # Cuts land at or after size // 2, so a smaller overlap guarantees
+        # each chunk starts at least size // 2 - overlap past the previous one
+        if not 0 <= overlap < size // 2:
+            raise ValueError(
+                f"Chunk overlap must be at least 0 and under half the chunk size "
+                f"(got size={size}, overlap={overlap})"
+            )
+        self.size = size
+        self.overlap = overlap
+        self.content_defined = content_defined
+        self.buffer = ""
+        self.blank_run = 0
+        self.started = False
+
+    def feed(self, line: str) -> List[str]:
+        line = line.strip()
+        if not line:
+            self.blank_run += 1
+            return []
+
+        if self.started:
+            self.buffer += "\n" * min(self.blank_run + 1, 2)
+        self.started = True
+        self.blank_run = 0
+        self.buffer += line
+
+        return self._split()
+
+    def finish(self) -> List[str]:
+        tail = self.buffer.strip()
+        self.buffer = ""
+        return [tail] if tail else []
+
+    def _split(self) -> List[str]:
+        chunks = []
+        while len(self.buffer) >= self.size:
+            cut = self._anchor() if self.content_defined else -1
+            if cut == -1:
+                cut = max(
+                    self.buffer.rfind(" ", self.size // 2, self.size),
+                    self.buffer.rfind("\n", self.size // 2, self.size),
+                )
+            if cut == -1:
+                cut = self.size
+            chunks.append(self.buffer[:cut].strip())
+            self.buffer = self.buffer[cut - self.overlap :]
+        return [chunk for chunk in chunks if chunk]
+
+    def _anchor(self) -> int:
+        """
+        First whitespace in the last third of the chunk whose preceding text
+        hashes to a boundary, or -1. Cuts then depend on the nearby text
+        rather than the offset, so an edit early in a document only changes
+        the chunks around it and later boundaries fall where they did before.
+        """
+        for i in range(self.size * 2 // 3, self.size):
+            if self.buffer[i] not in " \n":
+                continue
+            window = self.buffer[max(i - ANCHOR_WINDOW, 0) : i]
+            if zlib.crc32(window.encode("utf-8")) % ANCHOR_SPACING == 0:
+                return i
+        return -1
+
+
+async def spool_upload(upload: UploadFile) -> str:
+    """
+    Copy an upload to a temporary file in fixed-size reads, so the background
+    job can stream it after the request's UploadFile has been closed.
+    """
+    fd, path = tempfile.mkstemp(prefix="ingest-", dir=settings.ingest_spool_dir)
+    with os.fdopen(fd, "wb") as out:
+        await asyncio.to_thread(
+            shutil.copyfileobj, upload.file, out, settings.ingest_read_size
+        )
+        telemetry.observe_payload("upload", out.tell())
+    return path
+
+
+async def iter_file_lines(path: str) -> AsyncIterator[str]:
+    """
+    Read a spooled upload in fixed-size blocks and yield decoded lines.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+
+    with open(path, "rb") as f:
+        while True:
+            block = await asyncio.to_thread(f.read, settings.ingest_read_size)
+            text = decoder.decode(block, final=not block)
+            pending += text
+            lines = pending.split("\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line
+            if not block:
+                break
+
+    if pending:
+        yield pending
+
+
+async def ingest_file(vector_store, job: IngestJob, path: str, source: str) -> None:
+    """
+    Stream one spooled file through the chunker and index it in batches.
+    """
+    chunker = TextChunker(settings.ingest_chunk_size, settings.ingest_chunk_overlap)
+    batch: List[str] = []
+
+    async def index(chunks: List[str]) -> None:
+        # Share the embedding gate with queries, but always behind them
+        async with admission.slot("embedding", PRIORITY_BULK, bounded=False):
+            job.chunks_indexed += await vector_store.index_chunks(
+                chunks, source, user_id=job.user_id
+            )
+        job.save()
+
+    async def add(chunks: List[str]) -> None:
+        batch.extend(chunks)
+        while len(batch) >= settings.ingest_batch_size:
+            await index(batch[: settings.ingest_batch_size])
+            del batch[: settings.ingest_batch_size]
+
+    async for line in iter_file_lines(path):
+        await add(chunker.feed(line))
+    await add(chunker.finish())
+
+    if batch:
+        await index(batch)
+
+
+async def run_ingest_job(vector_store, job: IngestJob, paths: List[str]) -> None:
+    """
+    Index every spooled file of a job, removing the temporary copies as it goes.
+    """
+    job.status = "running"
+    job.save()
+    try:
+        for path, source in zip(paths, job.files):
+            await ingest_file(vector_store, job, path, source)
+            job.files_done += 1
+            job.save()
+            os.remove(path)
+
+        if job.user_id is not None:
+            await vector_store.maybe_shard_user(job.user_id)
+    except Exception as e:
+        print("Error ingesting uploaded documents:", e)
+        job.status = "failed"
+        job.error = str(e)
+    else:
+        job.status = "completed"
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        job.finished_at = time.time()
+        job.save()
+
+
+async def start_ingest_job(
+    files: List[UploadFile], user_id: Optional[int] = None
+) -> tuple[IngestJob, List[str]]:
+    """
+    Spool the uploads to disk and register a job for them. The caller
+    schedules `run_ingest_job` once the response has been sent.
+    """
+    paths = [await spool_upload(upload) for upload in files]
+    sources = [upload.filename or f"upload-{i}" for i, upload in enumerate(files)]
+    job = IngestJob(sources, user_id)
+    register_job(job)
+    return job, paths
@@ -1,50 +1,675 @@
-from typing import List
-
+import asyncio
+import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import (TYPE_CHECKING, AsyncIterator, Dict, List, Optional,
+                    Tuple)
+
+import httpx
 from fastapi import File, HTTPException, UploadFile
-from google import genai
-from google.genai import types
-from groq import AsyncGroq
 
 from app.config import settings
+from app.services.context import pack_context, prompt_stats, token_counter
+from app.services.images import ocr_cache, preprocess_image
+from app.services.startup import startup_timings
+from app.services.telemetry import telemetry
 
+if TYPE_CHECKING:
+    from google import genai
+    from groq import AsyncGroq
 
-async def get_groq_client() -> AsyncGroq:
-    return AsyncGroq(api_key=settings.groq_api_key)
+RAG_MODEL = "llama3-8b-8192"
+VIBE_MODEL = "gemini-2.0-pro-exp-02-05"
+OCR_MODEL = "gemini-2.0-flash"
+BUBBLE_DELIMITER = "$endbubble"
 
 
-async def get_gemini_client() -> genai.Client:
-    return genai.Client(api_key=settings.gemini_api_key)
+class LLMClients:
+    """
+    Long-lived upstream clients shared by every request on a worker.
 
+    Created in the app lifespan so connection pools and keep-alive sockets
+    are reused, with a per-provider semaphore capping requests in flight.
+    """
 
-async def extract_text_from_image(
-    client: genai.Client, images: List[UploadFile] = File(...)
-) -> str | None:
+    def __init__(self):
+        self.groq: Optional["AsyncGroq"] = None
+        self.gemini: Optional["genai.Client"] = None
+        # xAI speaks the OpenAI chat completions API, called directly over httpx
+        self.xai: Optional[httpx.AsyncClient] = None
+        self._groq_http: Optional[httpx.AsyncClient] = None
+        self._limits: dict[str, asyncio.Semaphore] = {}
+        self._timeouts: dict[str, float] = {}
+
+    def open(self) -> None:
+        # The SDKs take a while to import; only pay for it once serving
+        with startup_timings.phase("import llm sdks"):
+            from google import genai
+            from google.genai import types
+            from groq import AsyncGroq
+
+        limits = httpx.Limits(
+            max_connections=settings.llm_max_connections,
+            max_keepalive_connections=settings.llm_max_keepalive_connections,
+            keepalive_expiry=settings.llm_keepalive_expiry,
+        )
+        self._groq_http = httpx.AsyncClient(
+            limits=limits,
+            timeout=httpx.Timeout(settings.groq_timeout_seconds, connect=5.0),
+        )
+        self.groq = AsyncGroq(
+            api_key=settings.groq_api_key,
+            base_url=settings.groq_base_url,
+            http_client=self._groq_http,
+            max_retries=1,
+        )
+        self.gemini = genai.Client(
+            api_key=settings.gemini_api_key,
+            http_options=types.HttpOptions(
+                base_url=settings.gemini_base_url,
+                timeout=int(settings.gemini_timeout_seconds * 1000),
+            ),
+        )
+        if settings.xai_api_key:
+            self.xai = httpx.AsyncClient(
+                base_url=settings.xai_base_url,
+                headers={"Authorization": f"Bearer {settings.xai_api_key}"},
+                limits=limits,
+                timeout=httpx.Timeout(settings.xai_timeout_seconds, connect=5.0),
+            )
+
+        self._limits = {
+            "groq": asyncio.Semaphore(settings.groq_max_concurrency),
+            "gemini": asyncio.Semaphore(settings.gemini_max_concurrency),
+            "xai": asyncio.Semaphore(settings.xai_max_concurrency),
+        }
+        self._timeouts = {
+            "groq": settings.groq_timeout_seconds,
+            "gemini": settings.gemini_timeout_seconds,
+            "xai": settings.xai_timeout_seconds,
+        }
+
+    async def close(self) -> None:
+        if self._groq_http is not None:
+            await self._groq_http.aclose()
+        if self.xai is not None:
+            await self.xai.aclose()
+        self.groq = None
+        self.gemini = None
+        self.xai = None
+        self._groq_http = None
+
+    def available(self, provider: str) -> bool:
+        return getattr(self, provider, None) is not None
+
+    @asynccontextmanager
+    async def limit(self, provider: str):
+        """
+        Hold one of the provider's concurrency slots for the duration of a call.
+        """
+        async with self._limits[provider]:
+            yield
+
+    async def call(self, provider: str, coro):
+        """
+        Await an upstream call under the provider's concurrency limit and timeout.
+        """
+        async with self.limit(provider):
+            with telemetry.span(f"llm.{provider}"):
+                try:
+                    return await asyncio.wait_for(coro, self._timeouts[provider])
+                except Exception as e:
+                    telemetry.count_error(provider, e)
+                    raise
+
+    async def stream(self, provider: str, open_coro) -> AsyncIterator:
+        """
+        Open a streaming upstream call and yield its chunks, holding the
+        provider's concurrency slot until the stream is exhausted.
+        """
+        async with self.limit(provider):
+            with telemetry.span(f"llm.{provider}.stream", attach=False):
+                try:
+                    stream = await asyncio.wait_for(
+                        open_coro, self._timeouts[provider]
+                    )
+                    async for chunk in stream:
+                        yield chunk
+                except Exception as e:
+                    telemetry.count_error(provider, e)
+                    raise
+
+
+llm_clients = LLMClients()
+
+
+class NoHealthyBackend(Exception):
     """
-    Uses Google Gemini Vision to extract text from a list of images.
+    Every backend for a task is disabled or has its circuit breaker open.
     """
-    prompt_contents = []
-    prompt_contents.append(
-        "Read the text from this/these image(s). If possible, include the platform that you estimate this image originated from at the beginning of your response. Make sure you parse the post or text messages for relevant conversational or post content. Include this in your response. For an image or images withing the screenshot content, describe them in maximum detail."
-    )
 
-    for image in images:
-        if not image.content_type:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid file {image.filename} has no content type.",
+    def __init__(self, task: str, retry_after: float):
+        super().__init__(f"No healthy LLM backend for {task}")
+        self.retry_after = retry_after
+
+
+class UpstreamError(Exception):
+    """
+    Every backend tried for a request failed.
+    """
+
+    def __init__(self, errors: List[BaseException]):
+        super().__init__("; ".join(f"{type(e).__name__}: {e}" for e in errors))
+        self.errors = errors
+
+
+class BackendStats:
+    """
+    Rolling latency and error stats plus a circuit breaker for one backend.
+
+    The breaker opens after `breaker_failures` consecutive failures and
+    stays open for `cooldown` seconds. After that a single probe request is
+    let through: success closes it, failure opens it again.
+    """
+
+    def __init__(self, window: int, breaker_failures: int, cooldown: float):
+        self.breaker_failures = breaker_failures
+        self.cooldown = cooldown
+        self.latencies: deque = deque(maxlen=window)
+        self.first_chunks: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+        # Moving averages of full-call and first-chunk latency, in seconds
+        self.ewma: Dict[bool, Optional[float]] = {False: None, True: None}
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def available(self, now: float) -> bool:
+        if self.consecutive_failures < self.breaker_failures:
+            return True
+        return now >= self.open_until and not self.probing
+
+    def begin(self, now: float) -> None:
+        if self.consecutive_failures >= self.breaker_failures:
+            self.probing = True
+
+    def cancelled(self) -> None:
+        self.probing = False
+
+    def record_success(self, seconds: float, streaming: bool = False) -> None:
+        (self.first_chunks if streaming else self.latencies).append(seconds)
+        self.outcomes.append(True)
+        previous = self.ewma[streaming]
+        self.ewma[streaming] = (
+            seconds if previous is None else 0.8 * previous + 0.2 * seconds
+        )
+        self.consecutive_failures = 0
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self.probing = False
+        if self.consecutive_failures >= self.breaker_failures:
+            self.open_until = time.monotonic() + self.cooldown
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def p95(self, streaming: bool, min_samples: int) -> Optional[float]:
+        samples = self.first_chunks if streaming else self.latencies
+        if len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def describe(self) -> dict:
+        return {
+            "ewma_ms": _ms(self.ewma[False]),
+            "p95_ms": _ms(self.p95(False, 1)),
+            "first_chunk_ewma_ms": _ms(self.ewma[True]),
+            "first_chunk_p95_ms": _ms(self.p95(True, 1)),
+            "error_rate": round(self.error_rate(), 4),
+            "breaker": (
+                "open"
+                if self.consecutive_failures >= self.breaker_failures
+                else "closed"
+            ),
+        }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class Backend:
+    """
+    One provider/model pair that can answer a text prompt.
+    """
+
+    def __init__(self, spec: str):
+        self.provider, _, self.model = spec.partition(":")
+        if self.provider not in ("groq", "gemini", "xai") or not self.model:
+            raise ValueError(f"Invalid LLM backend {spec!r}")
+        self.name = spec
+        self.stats = BackendStats(
+            settings.llm_stats_window,
+            settings.llm_breaker_failures,
+            settings.llm_breaker_cooldown_seconds,
+        )
+
+    async def complete(self, content: str) -> str:
+        if self.provider == "groq":
+            completion = await llm_clients.groq.chat.completions.create(
+                messages=[{"role": "user", "content": content}], model=self.model
+            )
+            return completion.choices[0].message.content
+        if self.provider == "gemini":
+            response = await llm_clients.gemini.aio.models.generate_content(
+                model=self.model, contents=content
             )
+            return response.text
+        response = await llm_clients.xai.post(
+            "/chat/completions",
+            json={
+                "model": self.model,
+                "messages": [{"role": "user", "content": content}],
+            },
+        )
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def stream(self, content: str) -> AsyncIterator[str]:
+        async for chunk in llm_clients.stream(self.provider, self._open(content)):
+            text = self._chunk_text(chunk)
+            if text:
+                yield text
+
+    async def _open(self, content: str):
+        if self.provider == "groq":
+            return await llm_clients.groq.chat.completions.create(
+                messages=[{"role": "user", "content": content}],
+                model=self.model,
+                stream=True,
+            )
+        if self.provider == "gemini":
+            return await llm_clients.gemini.aio.models.generate_content_stream(
+                model=self.model, contents=content
+            )
+        # The xai request is only sent once the generator is iterated; pull
+        # the first chunk here so the open timeout covers the connection and
+        # first token, as it does for the SDKs
+        return await _primed(_xai_stream(self.model, content))
 
-        try:
-            image_data = await image.read()
-        except Exception as e:
-            print("Error reading image data:", e)
-            raise HTTPException(status_code=500, detail="Error reading image data")
+    def _chunk_text(self, chunk) -> Optional[str]:
+        if self.provider == "groq":
+            return chunk.choices[0].delta.content if chunk.choices else None
+        if self.provider == "gemini":
+            return chunk.text
+        return chunk
+
+
+async def _primed(stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Read the first item of `stream` now; return an iterator over all of it.
+    """
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        return stream
+
+    async def resumed() -> AsyncIterator[str]:
+        yield first
+        async for item in stream:
+            yield item
+
+    return resumed()
+
+
+async def _xai_stream(model: str, content: str) -> AsyncIterator[str]:
+    async with llm_clients.xai.stream(
+        "POST",
+        "/chat/completions",
+        json={
+            "model": model,
+            "messages": [{"role": "user", "content": content}],
+            "stream": True,
+        },
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: ") :]
+            if data == "[DONE]":
+                return
+            choices = json.loads(data).get("choices") or [{}]
+            text = choices[0].get("delta", {}).get("content")
+            if text:
+                yield text
+
+
+class LLMRouter:
+    """
+    Sends each prompt to the fastest healthy backend configured for its task.
+
+    Backends are ranked by a moving average of their observed latency, with
+    untried ones after tried ones in configured order and any whose recent
+    error rate exceeds `llm_max_error_rate` last. If the chosen backend
+    hasn't answered (or, when streaming, produced its first chunk) by its
+    rolling p95, a hedged request goes to the next backend and whichever
+    finishes first wins; the other is cancelled. Failed requests fail over
+    to the next backend, and backends that keep failing are skipped until
+    their circuit breaker lets a probe through.
+    """
 
+    def __init__(self, routes: Dict[str, List[str]]):
+        self.routes = {
+            task: [Backend(spec) for spec in specs] for task, specs in routes.items()
+        }
+        self.hedges: deque = deque(maxlen=settings.llm_stats_window)
+
+    def candidates(self, task: str, streaming: bool = False) -> List[Backend]:
+        now = time.monotonic()
+        backends = [
+            (index, backend)
+            for index, backend in enumerate(self.routes[task])
+            if llm_clients.available(backend.provider) and backend.stats.available(now)
+        ]
+
+        def rank(item: Tuple[int, Backend]) -> tuple:
+            index, backend = item
+            stats = backend.stats
+            erroring = (
+                len(stats.outcomes) >= settings.llm_min_samples
+                and stats.error_rate() > settings.llm_max_error_rate
+            )
+            ewma = stats.ewma[streaming]
+            return (erroring, ewma is None, ewma or 0.0, index)
+
+        return [backend for _, backend in sorted(backends, key=rank)]
+
+    def _hedge_delay(self, backend: Backend, streaming: bool) -> Optional[float]:
+        if not settings.llm_hedge_enabled:
+            return None
+        if self.hedges and (
+            self.hedges.count(True) / len(self.hedges) >= settings.llm_hedge_max_ratio
+        ):
+            return None
+        if settings.llm_hedge_delay_ms is not None:
+            return settings.llm_hedge_delay_ms / 1000
+        return backend.stats.p95(streaming, settings.llm_min_samples)
+
+    def cache_model(self, task: str) -> str:
+        """
+        What a task's answers are cached under: every backend that may have
+        produced them, so changing the route doesn't serve old answers.
+        """
+        return ",".join(backend.name for backend in self.routes[task])
+
+    def context_window(self, task: str) -> int:
+        """
+        The smallest context window among a task's backends. The prompt is
+        built before the router picks one (and may go to two when hedged),
+        so it has to fit all of them.
+        """
+        return min(
+            MODEL_CONTEXT_WINDOWS.get(backend.model, DEFAULT_CONTEXT_WINDOW)
+            for backend in self.routes[task]
+        )
+
+    def ensure_available(self, task: str) -> None:
+        """
+        Raise `NoHealthyBackend` up front, before a stream has started.
+        """
+        if not self.candidates(task):
+            raise self._unavailable(task)
+
+    def _unavailable(self, task: str) -> NoHealthyBackend:
+        reopen = [
+            backend.stats.open_until - time.monotonic()
+            for backend in self.routes[task]
+            if llm_clients.available(backend.provider)
+        ]
+        return NoHealthyBackend(task, max(1.0, min(reopen, default=1.0)))
+
+    async def complete(self, task: str, content: str) -> str:
+        """
+        Return the first successful completion, hedging and failing over
+        across the task's backends.
+        """
+        candidates = self.candidates(task)
+        if not candidates:
+            raise self._unavailable(task)
+
+        attempts: Dict[asyncio.Task, Backend] = {}
+        errors: List[BaseException] = []
+
+        def launch() -> Backend:
+            backend = candidates.pop(0)
+            backend.stats.begin(time.monotonic())
+            attempts[asyncio.create_task(self._attempt(backend, content))] = backend
+            return backend
+
+        hedge_delay = self._hedge_delay(launch(), streaming=False)
+        hedged = False
+        try:
+            while attempts:
+                done, _ = await asyncio.wait(
+                    attempts,
+                    timeout=hedge_delay if candidates and not hedged else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+
+                for attempt in done:
+                    attempts.pop(attempt)
+                    if attempt.exception() is None:
+                        return attempt.result()
+                    errors.append(attempt.exception())
+                if not attempts and candidates:
+                    launch()
+        finally:
+            self.hedges.append(hedged)
+            for attempt, backend in attempts.items():
+                if not attempt.done():
+                    attempt.cancel()
+                    backend.stats.cancelled()
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+        raise _failure(errors)
+
+    async def _attempt(self, backend: Backend, content: str) -> str:
+        started = time.perf_counter()
         try:
-            gemini_image_input = types.Part.from_bytes(
-                data=image_data,
-                mime_type=image.content_type,
+            text = await llm_clients.call(backend.provider, backend.complete(content))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            backend.stats.record_failure()
+            raise
+        backend.stats.record_success(time.perf_counter() - started)
+        return text
+
+    async def stream(self, task: str, content: str) -> AsyncIterator[str]:
+        """
+        Stream from whichever backend produces its first chunk first.
+
+        Hedging and failover only happen before the first chunk; once text
+        has been sent to the client the stream stays on that backend.
+        """
+        candidates = self.candidates(task, streaming=True)
+        if not candidates:
+            raise self._unavailable(task)
+
+        attempts: Dict[asyncio.Task, Tuple[Backend, AsyncIterator[str], float]] = {}
+        errors: List[BaseException] = []
+
+        def launch() -> Backend:
+            backend = candidates.pop(0)
+            backend.stats.begin(time.monotonic())
+            pieces = backend.stream(content)
+            attempt = asyncio.create_task(pieces.__anext__())
+            attempts[attempt] = (backend, pieces, time.perf_counter())
+            return backend
+
+        hedge_delay = self._hedge_delay(launch(), streaming=True)
+        hedged = False
+        winner = None
+        try:
+            while attempts and winner is None:
+                done, _ = await asyncio.wait(
+                    attempts,
+                    timeout=hedge_delay if candidates and not hedged else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+
+                for attempt in done:
+                    backend, pieces, started = attempts.pop(attempt)
+                    error = attempt.exception()
+                    if error is None or isinstance(error, StopAsyncIteration):
+                        backend.stats.record_success(
+                            time.perf_counter() - started, streaming=True
+                        )
+                        first = attempt.result() if error is None else None
+                        winner = (backend, pieces, first)
+                        break
+                    backend.stats.record_failure()
+                    errors.append(error)
+                if winner is None and not attempts and candidates:
+                    launch()
+        finally:
+            self.hedges.append(hedged)
+            await asyncio.gather(
+                *(
+                    _discard(attempt, backend, pieces, started)
+                    for attempt, (backend, pieces, started) in attempts.items()
+                )
             )
+
+        if winner is None:
+            raise _failure(errors)
+
+        backend, pieces, first = winner
+        if first is None:
+            return
+        yield first
+        try:
+            async for piece in pieces:
+                yield piece
+        except Exception:
+            backend.stats.record_failure()
+            raise
+
+    def describe(self) -> dict:
+        return {
+            task: {backend.name: backend.stats.describe() for backend in backends}
+            for task, backends in self.routes.items()
+        }
+
+
+async def _discard(
+    attempt: asyncio.Task, backend: Backend, pieces, started: float
+) -> None:
+    """
+    Cancel a losing stream and close it so it releases its connection and
+    concurrency slot.
+
+    An attempt that already finished (in the same wait as the winner) still
+    records its outcome, so a half-open breaker it was probing gets settled.
+    """
+    if not attempt.done():
+        attempt.cancel()
+        backend.stats.cancelled()
+        await asyncio.wait([attempt])
+    elif attempt.cancelled():
+        backend.stats.cancelled()
+    else:
+        error = attempt.exception()
+        if error is None or isinstance(error, StopAsyncIteration):
+            backend.stats.record_success(time.perf_counter() - started, streaming=True)
+        else:
+            backend.stats.record_failure()
+    await pieces.aclose()
+
+
+def _failure(errors: List[BaseException]) -> Exception:
+    if errors and all(isinstance(e, asyncio.TimeoutError) for e in errors):
+        return asyncio.TimeoutError()
+    return UpstreamError(errors)
+
+
+llm_router = LLMRouter(
+    {"query": settings.llm_query_backends, "vibe": settings.llm_vibe_backends}
+)
+
+
+async def get_llm_router() -> LLMRouter:
+    if llm_clients.groq is None:
+        raise HTTPException(status_code=503, detail="LLM clients are not ready")
+    return llm_router
+
+
+async def get_gemini_client() -> "genai.Client":
+    if llm_clients.gemini is None:
+        raise HTTPException(status_code=503, detail="LLM clients are not ready")
+    return llm_clients.gemini
+
+
+OCR_PROMPT = "Read the text from this/these image(s). If possible, include the platform that you estimate this image originated from at the beginning of your response. Make sure you parse the post or text messages for relevant conversational or post content. Include this in your response. For an image or images withing the screenshot content, describe them in maximum detail."
+
+
+async def _read_image(image: UploadFile) -> Tuple[bytes, str]:
+    if not image.content_type:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file {image.filename} has no content type.",
+        )
+
+    try:
+        image_data = await image.read()
+    except Exception as e:
+        print("Error reading image data:", e)
+        raise HTTPException(status_code=500, detail="Error reading image data")
+
+    return image_data, image.content_type
+
+
+async def _ocr_images(
+    client: "genai.Client", images: List[Tuple[bytes, str]]
+) -> str:
+    """
+    Run one OCR request over a group of images, served from the OCR cache
+    when the exact same images were seen recently.
+    """
+    key = ocr_cache.key(OCR_MODEL, OCR_PROMPT, [data for data, _ in images])
+    cached = ocr_cache.get(key)
+    if cached is not None:
+        return cached
+
+    for data, _ in images:
+        telemetry.observe_payload("ocr_image", len(data))
+
+    from google.genai import types
+
+    prompt_contents = [OCR_PROMPT]
+    prepared = await asyncio.gather(
+        *(asyncio.to_thread(preprocess_image, data, mime) for data, mime in images)
+    )
+    for data, mime in prepared:
+        try:
+            gemini_image_input = types.Part.from_bytes(data=data, mime_type=mime)
             prompt_contents.append(gemini_image_input)
         except Exception as e:
             print("Error calling Gemini API for OCR:", e)
@@ -52,20 +677,68 @@ async def extract_text_from_image(
                 status_code=500, detail="Error running OCR on uploaded image"
             )
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt_contents,
-    )
+    try:
+        response = await llm_clients.call(
+            "gemini",
+            client.aio.models.generate_content(
+                model=OCR_MODEL,
+                contents=prompt_contents,
+            ),
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="OCR request timed out")
 
-    print(response.text)
+    text = response.text if hasattr(response, "text") and response.text else None
+    if text is None:
+        return "No readable text found."
+    telemetry.observe_payload("ocr_text", len(text.encode("utf-8")))
 
-    return response.text if hasattr(response, "text") else "No readable text found."
+    ocr_cache.put(key, text)
+    return text
 
 
-def format_prompt(
-    user_rag_context: List[str], global_rag_context: List[str], query: str
+async def extract_text_from_image(
+    client: "genai.Client", images: List[UploadFile] = File(...)
+) -> str | None:
+    """
+    Uses Google Gemini Vision to extract text from a list of images.
+    """
+    image_inputs = [await _read_image(image) for image in images]
+
+    with telemetry.span("ocr", images=len(image_inputs)):
+        return await _extract_text(client, image_inputs)
+
+
+async def _extract_text(
+    client: "genai.Client", image_inputs: List[Tuple[bytes, str]]
 ) -> str:
-    return f"""
+    if settings.ocr_per_image and len(image_inputs) > 1:
+        texts = await asyncio.gather(
+            *(_ocr_images(client, [image_input]) for image_input in image_inputs)
+        )
+        return "\n\n".join(texts)
+
+    return await _ocr_images(client, image_inputs)
+
+
+async def split_bubbles(pieces: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Re-chunk streamed text into chat bubbles, yielding each one as soon as
+    its `$endbubble` marker arrives.
+    """
+    buffer = ""
+    async for piece in pieces:
+        buffer += piece
+        while BUBBLE_DELIMITER in buffer:
+            bubble, buffer = buffer.split(BUBBLE_DELIMITER, 1)
+            if bubble.strip():
+                yield bubble.strip()
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+RAG_PROMPT_PREFIX = """
 ### System Instruction ###
 You are an AI assistant that provides helpful, context-aware, and personalized responses.
 You will be given:
@@ -78,12 +751,37 @@ Your goal is to generate a response that:
 - Supplements with **Global RAG Context** if additional information is needed.
 - Directly addresses the **User Query** in a **clear, concise, and informative manner**.
 - If conflicts exist between **User-Specific** and **Global RAG Context**, prioritize the **User-Specific Context** unless explicitly instructed otherwise.
+""".strip()
+
+# Context windows in tokens; models not listed are assumed to have the
+# smallest common window
+MODEL_CONTEXT_WINDOWS = {
+    "llama3-8b-8192": 8192,
+    "llama-3.3-70b-versatile": 131072,
+    "grok-2-1212": 131072,
+    "gemini-2.0-flash": 1048576,
+    "gemini-2.0-pro-exp-02-05": 2097152,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+
+def _format_context(chunks: List[str]) -> str:
+    if not chunks:
+        return "(none)"
+    return "\n\n".join(f"[{i}] {chunk}" for i, chunk in enumerate(chunks, 1))
+
+
+def format_prompt(
+    user_rag_context: List[str], global_rag_context: List[str], query: str
+) -> str:
+    return f"""
+{RAG_PROMPT_PREFIX}
 
 ### User-Specific RAG Context ###
-{user_rag_context}
+{_format_context(user_rag_context)}
 
 ### Global RAG Context ###
-{global_rag_context}
+{_format_context(global_rag_context)}
 
 ### User Query ###
 {query}
@@ -93,6 +791,54 @@ Your goal is to generate a response that:
 """.strip()
 
 
+@lru_cache(maxsize=None)
+def _static_prompt_tokens() -> int:
+    """
+    Tokens taken by the fixed instruction prefix and section headers.
+    """
+    return token_counter.count(format_prompt([], [], ""))
+
+
+def build_rag_prompt(
+    user_hits: List[dict],
+    global_hits: List[dict],
+    query: str,
+    window: int = DEFAULT_CONTEXT_WINDOW,
+) -> Tuple[str, int]:
+    """
+    Format the RAG prompt within a `window`-token context.
+
+    Retrieved chunks are packed by score into whatever the window leaves
+    after the static prefix, the query and the reserved completion tokens,
+    capped at `prompt_context_tokens`. Counts come from the prompt
+    tokenizer rather than the target model's, so the window is shrunk by
+    `prompt_token_margin` first. Returns the prompt and its size in tokens.
+    """
+    query = token_counter.truncate(query, settings.prompt_max_query_tokens)
+    usable = int(
+        (window - settings.prompt_reserved_output_tokens)
+        / settings.prompt_token_margin
+    )
+    budget = min(
+        settings.prompt_context_tokens,
+        usable - _static_prompt_tokens() - token_counter.count(query),
+    )
+
+    packed = pack_context(
+        token_counter,
+        budget,
+        user_hits,
+        global_hits,
+        max_chunk_tokens=settings.prompt_max_chunk_tokens,
+        min_chunk_tokens=settings.prompt_min_chunk_tokens,
+    )
+    content = format_prompt(packed.texts("user"), packed.texts("global"), query)
+
+    tokens = token_counter.count(content)
+    prompt_stats.record(tokens, packed)
+    return content, tokens
+
+
 def _format_vibe_check_prompt(
     user_prompt: str | None = "", ocr_text: str | None = ""
 ) -> str:
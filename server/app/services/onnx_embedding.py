@@ -0,0 +1,432 @@
+"""
+ONNX Runtime backend for the embedding model, with int8 weights.
+
+`export` converts a SentenceTransformer model for CPU inference: the
+transformer is exported to ONNX, fused with the ONNX Runtime transformer
+optimizer and its weights quantized to int8 (dynamic quantization, so
+activations are quantized per batch at run time). The tokenizer and the
+pooling settings are saved alongside, so serving needs neither torch nor
+sentence_transformers. `check` compares the exported model's vectors with
+the PyTorch ones and times both.
+
+    python -m app.services.onnx_embedding export
+    python -m app.services.onnx_embedding check --texts sample.txt
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from app.config import settings
+
+MODEL_FILE = "model.onnx"
+CONFIG_FILE = "embedding.json"
+TOKENIZER_FILE = "tokenizer.json"
+
+# Padded lengths are rounded up to this, which keeps the number of distinct
+# shapes ONNX Runtime sees small at the cost of a few pad tokens
+PAD_MULTIPLE = 8
+
+SAMPLE_TEXTS = [
+    "hi",
+    "What's the vibe of this conversation?",
+    "Can you help me figure out how to reply to my friend?",
+    "He said he'd call after work but it's been two days and nothing.",
+    "Retrieval-augmented generation grounds a language model's answer in "
+    "documents fetched for the query, so the model can cite material it was "
+    "never trained on.",
+    "The quick brown fox jumps over the lazy dog. " * 12,
+    "Wir sehen uns morgen um acht vor dem Kino, vergiss die Karten nicht!",
+    "明天晚上一起吃饭吗？我知道一家新开的餐厅。",
+    "¿Me puedes explicar por qué dejó de responder a mis mensajes?",
+    "lol ok 😂 see u there",
+    " ".join(f"Sentence number {i} in a long message about plans." for i in range(60)),
+]
+
+
+def default_path(model_name: str = settings.embedding_model) -> str:
+    return settings.embedding_onnx_path or os.path.join(
+        "models", "onnx", model_name.replace("/", "--")
+    )
+
+
+def pooling_config(model) -> dict:
+    """
+    The pooling and normalization a SentenceTransformer applies on top of
+    its transformer, which the ONNX graph leaves out.
+    """
+    modules = list(model)
+    pooling = next(m for m in modules if type(m).__name__ == "Pooling")
+    if pooling.pooling_mode_cls_token:
+        mode = "cls"
+    elif pooling.pooling_mode_mean_tokens:
+        mode = "mean"
+    else:
+        raise ValueError(f"Unsupported pooling: {pooling.get_pooling_mode_str()}")
+
+    return {
+        "pooling": mode,
+        "normalize": any(type(m).__name__ == "Normalize" for m in modules),
+        "max_seq_length": model.max_seq_length,
+        "pad_token_id": model.tokenizer.pad_token_id,
+        "dim": model.get_sentence_embedding_dimension(),
+    }
+
+
+def export(model_name: str, path: str, opset: int = 17) -> dict:
+    """
+    Export, optimize and quantize `model_name` into the directory `path`.
+
+    Everything is written to a temporary directory first and renamed into
+    place, so workers starting at the same time never see a partial export.
+    """
+    import onnx
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from onnxruntime.transformers.optimizer import optimize_model
+    from sentence_transformers import SentenceTransformer
+
+    class Encoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(
+                input_ids=input_ids, attention_mask=attention_mask
+            ).last_hidden_state
+
+    model = SentenceTransformer(model_name, device="cpu")
+    config = {"model": model_name, **pooling_config(model)}
+    transformer = model[0].auto_model.eval()
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".onnx-export-", dir=parent)
+    try:
+        # The float32 graph can exceed protobuf's 2GB limit (bge-m3 does), so
+        # it goes in its own directory where its weights may be split out
+        float_dir = os.path.join(staging, "float32")
+        os.makedirs(float_dir)
+        float_path = os.path.join(float_dir, MODEL_FILE)
+        fused_path = os.path.join(float_dir, "fused.onnx")
+
+        dummy = model.tokenizer(["an example input"], return_tensors="pt")
+        with torch.no_grad():
+            torch.onnx.export(
+                Encoder(transformer),
+                (dummy["input_ids"], dummy["attention_mask"]),
+                float_path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"},
+                },
+                opset_version=opset,
+                dynamo=False,
+            )
+
+        # Fuse attention, GELU and layer norm into single kernels before
+        # quantizing, while the float32 patterns are still recognisable
+        hidden = transformer.config
+        fused = optimize_model(
+            float_path,
+            model_type="bert",
+            num_heads=hidden.num_attention_heads,
+            hidden_size=hidden.hidden_size,
+        )
+        fused.save_model_to_file(fused_path, use_external_data_format=True)
+        del fused
+
+        quantize_dynamic(
+            fused_path,
+            os.path.join(staging, MODEL_FILE),
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            # Shape inference can't type the outputs of the fused operators
+            extra_options={"DefaultTensorType": onnx.TensorProto.FLOAT},
+        )
+        shutil.rmtree(float_dir)
+
+        model.tokenizer.backend_tokenizer.save(os.path.join(staging, TOKENIZER_FILE))
+        with open(os.path.join(staging, CONFIG_FILE), "w") as f:
+            json.dump(config, f, indent=2)
+
+        os.chmod(staging, 0o755)
+        try:
+            os.rename(staging, path)
+        except OSError:
+            # Someone else finished an export first; theirs is as good
+            if not os.path.exists(os.path.join(path, CONFIG_FILE)):
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    return config
+
+
+class OnnxEmbeddingModel:
+    """
+    An exported embedding model run by ONNX Runtime, with the subset of the
+    SentenceTransformer interface `VectorStore` uses.
+
+    `encode` tokenizes every text up front, sorts them by length and cuts
+    the sorted list into batches that stay within one power-of-two length
+    bucket and at most `max_batch_tokens` padded tokens, so short texts are
+    never padded out to a long neighbour and long ones run in smaller
+    batches.
+    """
+
+    def __init__(self, path: str, threads: int = 0, max_batch_tokens: int = 16384):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(path, CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        self.max_seq_length = self.config["max_seq_length"]
+        self.max_batch_tokens = max_batch_tokens
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(self.max_seq_length)
+        self.tokenizer.no_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        # 0 lets ONNX Runtime use one thread per physical core
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            os.path.join(path, MODEL_FILE),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def batches(self, lengths: Sequence[int], batch_size: int) -> List[np.ndarray]:
+        """
+        Group indices into batches of texts from the same length bucket,
+        under both the batch size and the padded token cap.
+        """
+        batches, current, bucket = [], [], 0
+        for i in np.argsort(lengths, kind="stable"):
+            # Sorted ascending, so the newest index is the longest so far
+            padded = self._pad_length(lengths[i])
+            if current and (
+                _bucket(lengths[i]) != bucket
+                or len(current) >= batch_size
+                or (len(current) + 1) * padded > self.max_batch_tokens
+            ):
+                batches.append(np.array(current))
+                current = []
+            if not current:
+                bucket = _bucket(lengths[i])
+            current.append(i)
+        if current:
+            batches.append(np.array(current))
+        return batches
+
+    def encode(
+        self, texts: Sequence[str], batch_size: int = 32, **kwargs
+    ) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(list(texts))
+        lengths = [len(encoding.ids) for encoding in encodings]
+        vectors = np.empty((len(texts), self.config["dim"]), dtype=np.float32)
+
+        for batch in self.batches(lengths, max(1, batch_size)):
+            width = self._pad_length(lengths[batch[-1]])
+            input_ids = np.full(
+                (len(batch), width), self.config["pad_token_id"], dtype=np.int64
+            )
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            for row, i in enumerate(batch):
+                input_ids[row, : lengths[i]] = encodings[i].ids
+                attention_mask[row, : lengths[i]] = 1
+
+            (hidden,) = self.session.run(
+                ["last_hidden_state"],
+                {"input_ids": input_ids, "attention_mask": attention_mask},
+            )
+            vectors[batch] = self._pool(hidden, attention_mask)
+
+        return vectors
+
+    def _pad_length(self, length: int) -> int:
+        return min(-(-length // PAD_MULTIPLE) * PAD_MULTIPLE, self.max_seq_length)
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.config["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+        if self.config["normalize"]:
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            pooled = pooled / np.maximum(norms, 1e-12)
+        return pooled
+
+
+def _bucket(length: int) -> int:
+    """
+    Power-of-two length bucket, so no text in a batch is padded to more than
+    about twice its length.
+    """
+    return max(length - 1, 1).bit_length()
+
+
+def ensure_exported(path: Optional[str] = None) -> str:
+    """
+    Export the configured model to `path` unless that was already done.
+    """
+    path = path or default_path()
+    if not os.path.exists(os.path.join(path, CONFIG_FILE)):
+        print(f"Exporting {settings.embedding_model} to ONNX in {path}")
+        export(settings.embedding_model, path)
+    return path
+
+
+def load(path: Optional[str] = None) -> OnnxEmbeddingModel:
+    """
+    Open the export at `path`, exporting the configured model there first
+    if it doesn't exist yet.
+    """
+    path = ensure_exported(path)
+    return OnnxEmbeddingModel(
+        path,
+        threads=settings.embedding_onnx_threads,
+        max_batch_tokens=settings.embedding_onnx_batch_tokens,
+    )
+
+
+def _directory_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _throughput(encode, texts: List[str], repeats: int) -> float:
+    encode(texts[:2])
+    started = time.perf_counter()
+    for _ in range(repeats):
+        encode(texts)
+    return round(len(texts) * repeats / (time.perf_counter() - started), 2)
+
+
+def check(path: str, texts: List[str], repeats: int = 3) -> dict:
+    """
+    Encode `texts` with both backends and report how closely they agree and
+    how fast each one is.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    onnx_model = OnnxEmbeddingModel(
+        path,
+        threads=settings.embedding_onnx_threads,
+        max_batch_tokens=settings.embedding_onnx_batch_tokens,
+    )
+    torch_model = SentenceTransformer(onnx_model.config["model"], device="cpu")
+    batch_size = settings.embedding_batch_size
+
+    expected = torch_model.encode(
+        texts, batch_size=batch_size, normalize_embeddings=True
+    )
+    actual = onnx_model.encode(texts, batch_size=batch_size)
+    actual = actual / np.linalg.norm(actual, axis=1, keepdims=True)
+    cosine = (expected * actual).sum(axis=1)
+
+    # Whether each text's nearest other text is the same under both models
+    def neighbours(vectors: np.ndarray) -> np.ndarray:
+        scores = vectors @ vectors.T
+        np.fill_diagonal(scores, -np.inf)
+        return scores.argmax(axis=1)
+
+    return {
+        "model": onnx_model.config["model"],
+        "texts": len(texts),
+        "cosine_min": round(float(cosine.min()), 5),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "nearest_neighbour_agreement": round(
+            float((neighbours(expected) == neighbours(actual)).mean()), 4
+        ),
+        "texts_per_second": {
+            "torch": _throughput(
+                lambda t: torch_model.encode(t, batch_size=batch_size), texts, repeats
+            ),
+            "onnx": _throughput(
+                lambda t: onnx_model.encode(t, batch_size=batch_size), texts, repeats
+            ),
+        },
+        "onnx_model_mb": round(_directory_bytes(path) / (1024 * 1024), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser(
+        "export", help="Export and quantize the embedding model"
+    )
+    export_parser.add_argument("--model", default=settings.embedding_model)
+    export_parser.add_argument("--path", default=None)
+    export_parser.add_argument("--opset", type=int, default=17)
+
+    check_parser = commands.add_parser(
+        "check", help="Compare the ONNX export's vectors with PyTorch's"
+    )
+    check_parser.add_argument("--path", default=None)
+    check_parser.add_argument(
+        "--texts", help="File with one text per line (default: built-in samples)"
+    )
+    check_parser.add_argument("--repeats", type=int, default=3)
+    check_parser.add_argument(
+        "--min-cosine",
+        type=float,
+        default=0.99,
+        help="Exit non-zero if any text's vectors agree less than this",
+    )
+    args = parser.parse_args()
+
+    if args.command == "export":
+        path = args.path or default_path(args.model)
+        started = time.perf_counter()
+        config = export(args.model, path, args.opset)
+        print(
+            json.dumps(
+                {
+                    **config,
+                    "path": path,
+                    "model_mb": round(_directory_bytes(path) / (1024 * 1024), 1),
+                    "seconds": round(time.perf_counter() - started, 2),
+                }
+            )
+        )
+        return
+
+    texts = SAMPLE_TEXTS
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    report = check(args.path or default_path(), texts, args.repeats)
+    print(json.dumps(report))
+    if report["cosine_min"] < args.min_cosine:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
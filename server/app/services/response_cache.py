@@ -0,0 +1,154 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.services.telemetry import telemetry
+
+CACHE_HEADER = "X-Cache"
+
+
+class CachedResponse:
+    def __init__(
+        self, value: Any, scope: str, vector: Optional[np.ndarray], ttl: float
+    ):
+        self.value = value
+        self.scope = scope
+        self.vector = vector
+        self.expires_at = time.monotonic() + ttl
+
+
+class ResponseCache:
+    """
+    LLM response cache with an exact tier and a semantic tier.
+
+    Exact hits are keyed on the model name and the fully formatted prompt.
+    Semantic hits reuse the bge-m3 embedding of the user's input and match
+    any live entry in the same scope above `similarity_threshold`. Entries
+    expire after `ttl_seconds` and the least recently used are evicted past
+    `max_entries`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool,
+        max_entries: int,
+        ttl_seconds: float,
+        similarity_threshold: float,
+        semantic: bool = True,
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.semantic = semantic and settings.response_cache_semantic_enabled
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.entries: OrderedDict[str, CachedResponse] = OrderedDict()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(
+        self, key: str, scope: str = "", vector=None
+    ) -> Tuple[Optional[Any], str]:
+        """
+        Return `(value, status)` where status is the X-Cache header value.
+        """
+        value, status = self._lookup(key, scope, vector)
+        telemetry.count_cache(f"response_{self.name}", status.lower())
+        return value, status
+
+    def _lookup(self, key: str, scope: str, vector) -> Tuple[Optional[Any], str]:
+        if not self.enabled:
+            return None, "BYPASS"
+
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires_at > now:
+            self.entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry.value, "HIT"
+
+        if vector is not None and self.semantic:
+            match = self._most_similar(scope, _normalize(vector), now)
+            if match is not None:
+                self.entries.move_to_end(match)
+                self.semantic_hits += 1
+                return self.entries[match].value, "HIT-SEMANTIC"
+
+        self.misses += 1
+        return None, "MISS"
+
+    def store(self, key: str, value: Any, scope: str = "", vector=None) -> None:
+        if not self.enabled or value is None:
+            return
+
+        self.entries[key] = CachedResponse(
+            value,
+            scope,
+            _normalize(vector) if vector is not None else None,
+            self.ttl_seconds,
+        )
+        self.entries.move_to_end(key)
+        self._evict()
+
+    def _most_similar(
+        self, scope: str, vector: np.ndarray, now: float
+    ) -> Optional[str]:
+        best_key, best_score = None, self.similarity_threshold
+        for key, entry in self.entries.items():
+            if entry.vector is None or entry.scope != scope or entry.expires_at <= now:
+                continue
+            score = float(np.dot(entry.vector, vector))
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, entry in self.entries.items() if entry.expires_at <= now]:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "semantic": self.semantic,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+        }
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+query_response_cache = ResponseCache(
+    "query",
+    enabled=settings.response_cache_query_enabled,
+    max_entries=settings.response_cache_max_entries,
+    ttl_seconds=settings.response_cache_ttl_seconds,
+    similarity_threshold=settings.response_cache_similarity_threshold,
+)
+vibe_response_cache = ResponseCache(
+    "vibe",
+    enabled=settings.response_cache_vibe_enabled,
+    max_entries=settings.response_cache_max_entries,
+    ttl_seconds=settings.response_cache_ttl_seconds,
+    similarity_threshold=settings.response_cache_similarity_threshold,
+    semantic=settings.response_cache_vibe_semantic,
+)
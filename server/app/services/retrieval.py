@@ -0,0 +1,95 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from app.services.bm25 import tokenize
+
+# Cross-encoder calls get their own thread: one that outlives its budget
+# keeps running, and must not hold up the default executor meanwhile
+_rerank_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+_rerank_running: Optional[Future] = None
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> Dict[str, float]:
+    """
+    Fuse several ranked id lists: each list contributes 1 / (k + rank).
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (k + rank)
+    return scores
+
+
+def merge_hits(*hit_lists: List[dict]) -> List[dict]:
+    """
+    Merge hit lists whose scores are on different scales (RRF, cross-encoder
+    or dense similarity) by min-max normalising each list before sorting.
+    """
+    scored = []
+    for hits in hit_lists:
+        if not hits:
+            continue
+        low = min(hit["score"] for hit in hits)
+        span = max(hit["score"] for hit in hits) - low
+        scored.extend(
+            ((hit["score"] - low) / span if span else 1.0, hit) for hit in hits
+        )
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [hit for _, hit in scored]
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    tokens = tokenize(text)
+    if len(tokens) <= size:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def dedupe_hits(hits: List[dict], threshold: float) -> List[dict]:
+    """
+    Drop hits whose word 5-gram Jaccard similarity to a higher-ranked hit is
+    at least `threshold`, e.g. the overlapping tails of adjacent chunks or the
+    same article scraped twice.
+    """
+    kept: List[dict] = []
+    kept_shingles: List[set] = []
+    for hit in hits:
+        shingles = _shingles(hit["text"])
+        if any(
+            len(shingles & other) / len(shingles | other) >= threshold
+            for other in kept_shingles
+            if shingles | other
+        ):
+            continue
+        kept.append(hit)
+        kept_shingles.append(shingles)
+    return kept
+
+
+async def rerank_hits(
+    cross_encoder, query: str, hits: List[dict], budget_ms: float
+) -> Optional[List[dict]]:
+    """
+    Reorder hits with a cross-encoder, or return None if it doesn't finish
+    within `budget_ms` so the caller can keep the fused order. Also returns
+    None straight away while an earlier rerank is still running.
+    """
+    global _rerank_running
+    if not hits:
+        return hits
+    if _rerank_running is not None and not _rerank_running.done():
+        return None
+
+    pairs = [(query, hit["text"]) for hit in hits]
+    _rerank_running = _rerank_executor.submit(cross_encoder.predict, pairs)
+    try:
+        scores = await asyncio.wait_for(
+            asyncio.wrap_future(_rerank_running), budget_ms / 1000
+        )
+    except asyncio.TimeoutError:
+        return None
+
+    for hit, score in zip(hits, scores):
+        hit["rerank_score"] = float(score)
+    return sorted(hits, key=lambda hit: hit["rerank_score"], reverse=True)
@@ -0,0 +1,58 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from app.services.telemetry import telemetry
+
+
+def process_age() -> Optional[float]:
+    """
+    Seconds since this process started (or was forked), from /proc.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesised command name; starttime is 22nd
+            fields = f.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupTimings:
+    """
+    How long this worker took to import and start, reported by `/ping` and
+    as `y_startup_seconds`.
+
+    Marks are seconds since the process started; phases are the durations
+    of individual steps such as importing a heavy library or loading a
+    model. Workers forked by `app.serve` count later marks from their fork
+    and inherit whatever the parent recorded while preloading.
+    """
+
+    def __init__(self):
+        self.marks: dict[str, float] = {}
+        self.phases: dict[str, float] = {}
+
+    def mark(self, name: str) -> None:
+        age = process_age()
+        if age is not None:
+            self.marks[name] = round(age, 3)
+            telemetry.observe_startup(name, age)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.phases[name] = round(seconds, 3)
+            telemetry.observe_startup(name, seconds)
+
+    def describe(self) -> dict:
+        return {"pid": os.getpid(), "marks": self.marks, "phases": self.phases}
+
+
+startup_timings = StartupTimings()
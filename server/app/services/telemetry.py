@@ -0,0 +1,199 @@
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.config import settings
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+SIZE_BUCKETS = tuple(2**i for i in range(6, 27, 2))
+TOKEN_BUCKETS = (128, 256, 512, 1024, 2048, 3072, 4096, 6144, 8192)
+
+REQUEST_LATENCY = Histogram(
+    "y_request_duration_seconds",
+    "Time to the response head for each API request",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+SPAN_LATENCY = Histogram(
+    "y_span_duration_seconds",
+    "Duration of instrumented stages (embedding, Chroma queries, OCR, LLM calls)",
+    ["span"],
+    buckets=LATENCY_BUCKETS,
+)
+PAYLOAD_BYTES = Histogram(
+    "y_payload_bytes",
+    "Size of prompts, completions, images and uploads",
+    ["kind"],
+    buckets=SIZE_BUCKETS,
+)
+PROMPT_TOKENS = Histogram(
+    "y_prompt_tokens",
+    "Tokens in each assembled RAG prompt",
+    buckets=TOKEN_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "y_cache_lookups_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"],
+)
+UPSTREAM_ERRORS = Counter(
+    "y_upstream_errors_total",
+    "Failed calls to upstream LLM providers",
+    ["provider", "error"],
+)
+STARTUP_SECONDS = Gauge(
+    "y_startup_seconds",
+    "Worker startup: seconds since process start at each mark, or step duration",
+    ["step"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "y_admission_in_flight",
+    "Requests holding an admission slot, by gate",
+    ["gate"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "y_admission_queue_depth",
+    "Requests waiting for an admission slot, by gate",
+    ["gate"],
+)
+ADMISSION_WAIT = Histogram(
+    "y_admission_wait_seconds",
+    "Time spent queued for an admission slot",
+    ["gate"],
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_REJECTIONS = Counter(
+    "y_admission_rejections_total",
+    "Requests turned away by rate limits or full admission queues",
+    ["limit", "reason"],
+)
+
+
+class Telemetry:
+    """
+    Timing spans and Prometheus metrics for the request path.
+
+    Every span feeds `y_span_duration_seconds`. When `trace_otlp_endpoint`
+    is set, a `trace_sample_rate` fraction of requests is also traced with
+    OpenTelemetry and exported over OTLP. With `metrics_enabled`
+    off, spans and counters are no-ops.
+    """
+
+    def __init__(self):
+        self.enabled = settings.metrics_enabled
+        self.provider: Optional[TracerProvider] = None
+        self.tracer = trace.NoOpTracer()
+
+    def setup(self) -> None:
+        if (
+            not self.enabled
+            or not settings.trace_otlp_endpoint
+            or settings.trace_sample_rate <= 0
+        ):
+            return
+
+        self.provider = TracerProvider(
+            resource=Resource.create({"service.name": settings.trace_service_name}),
+            sampler=ParentBased(TraceIdRatioBased(settings.trace_sample_rate)),
+        )
+        try:
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import \
+                OTLPSpanExporter
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+            self.provider.add_span_processor(
+                BatchSpanProcessor(
+                    OTLPSpanExporter(endpoint=settings.trace_otlp_endpoint)
+                )
+            )
+        except Exception as e:
+            print("Error setting up trace exporter:", e)
+        self.tracer = self.provider.get_tracer("app")
+
+    def shutdown(self) -> None:
+        if self.provider is not None:
+            self.provider.shutdown()
+        self.provider = None
+        self.tracer = trace.NoOpTracer()
+
+    @contextmanager
+    def span(self, name: str, attach: bool = True, **attributes):
+        """
+        Time a stage of a request.
+
+        Pass `attach=False` from async generators: their body can resume in
+        a different context, so the span must not become the current one.
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        started = time.perf_counter()
+        try:
+            if attach:
+                with self.tracer.start_as_current_span(
+                    name, attributes=attributes
+                ) as span:
+                    yield span
+            else:
+                span = self.tracer.start_span(name, attributes=attributes)
+                try:
+                    yield span
+                except Exception as e:
+                    span.record_exception(e)
+                    span.set_status(trace.StatusCode.ERROR)
+                    raise
+                finally:
+                    span.end()
+        finally:
+            SPAN_LATENCY.labels(name).observe(time.perf_counter() - started)
+
+    def observe_request(
+        self, method: str, route: str, status: int, seconds: float
+    ) -> None:
+        if self.enabled:
+            REQUEST_LATENCY.labels(method, route, str(status)).observe(seconds)
+
+    def observe_payload(self, kind: str, size: int) -> None:
+        if self.enabled:
+            PAYLOAD_BYTES.labels(kind).observe(size)
+
+    def observe_prompt_tokens(self, tokens: int) -> None:
+        if self.enabled:
+            PROMPT_TOKENS.observe(tokens)
+
+    def count_cache(self, cache: str, result: str) -> None:
+        if self.enabled:
+            CACHE_LOOKUPS.labels(cache, result).inc()
+
+    def count_error(self, provider: str, error: BaseException) -> None:
+        if self.enabled:
+            UPSTREAM_ERRORS.labels(provider, type(error).__name__).inc()
+
+    def observe_startup(self, step: str, seconds: float) -> None:
+        if self.enabled:
+            STARTUP_SECONDS.labels(step).set(seconds)
+
+    def set_admission_depth(self, gate: str, in_flight: int, queued: int) -> None:
+        if self.enabled:
+            ADMISSION_IN_FLIGHT.labels(gate).set(in_flight)
+            ADMISSION_QUEUE_DEPTH.labels(gate).set(queued)
+
+    def observe_admission_wait(self, gate: str, seconds: float) -> None:
+        if self.enabled:
+            ADMISSION_WAIT.labels(gate).observe(seconds)
+
+    def count_rejection(self, limit: str, reason: str) -> None:
+        if self.enabled:
+            ADMISSION_REJECTIONS.labels(limit, reason).inc()
+
+
+telemetry = Telemetry()
@@ -0,0 +1,253 @@
+"""
+Fake Groq, xAI and Gemini HTTP endpoints for benchmarking the API offline.
+
+The app's real `AsyncGroq`, xAI and `genai.Client` clients talk to this
+server once GROQ_BASE_URL / XAI_BASE_URL / GEMINI_BASE_URL point at it, so
+client overhead, connection pooling and streaming are exercised exactly as
+in production.
+
+    python -m bench.fake_llm --port 9100 --latency-ms 300 --token-delay-ms 20
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import AsyncIterator
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "honestly this is kinda fire ngl the caption could be punchier but the vibe "
+    "is there people will def relate maybe post it in the evening for reach"
+).split()
+
+
+class FakeLLMConfig:
+    def __init__(
+        self,
+        latency_ms: float = 200.0,
+        jitter_ms: float = 50.0,
+        tokens: int = 40,
+        token_delay_ms: float = 10.0,
+        bubbles: int = 2,
+        error_rate: float = 0.0,
+    ):
+        # Time before the first byte (non-streaming: before the whole reply)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        # Completion length and pacing between streamed tokens
+        self.tokens = tokens
+        self.token_delay_ms = token_delay_ms
+        # Vibe checks are split into this many `$endbubble` bubbles
+        self.bubbles = bubbles
+        self.error_rate = error_rate
+
+    def describe(self) -> dict:
+        return dict(vars(self))
+
+
+def _words(n: int, bubbles: int = 0) -> list:
+    words = [random.choice(WORDS) + " " for _ in range(n)]
+    if bubbles:
+        step = max(1, n // bubbles)
+        for i in range(step - 1, n, step):
+            words[i] += "$endbubble "
+    return words
+
+
+def create_app(config: FakeLLMConfig) -> FastAPI:
+    app = FastAPI()
+    app.state.config = config
+    app.state.requests = 0
+
+    async def first_byte() -> None:
+        delay = config.latency_ms + random.uniform(-1, 1) * config.jitter_ms
+        await asyncio.sleep(max(0.0, delay) / 1000)
+
+    def failed() -> bool:
+        return random.random() < config.error_rate
+
+    async def paced(words: list, encode) -> AsyncIterator[bytes]:
+        for word in words:
+            yield encode(word)
+            await asyncio.sleep(config.token_delay_ms / 1000)
+
+    @app.post("/openai/v1/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def groq_completion(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        model = body.get("model", "llama3-8b-8192")
+        created = int(time.time())
+        await first_byte()
+        if failed():
+            return _error(503, "fake upstream error")
+
+        words = _words(config.tokens)
+        if not body.get("stream"):
+            await asyncio.sleep(config.tokens * config.token_delay_ms / 1000)
+            return {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(words)},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": config.tokens,
+                    "total_tokens": config.tokens,
+                },
+            }
+
+        def encode(word: str) -> bytes:
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": {"content": word}, "finish_reason": None}
+                ],
+            }
+            return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+        async def events() -> AsyncIterator[bytes]:
+            async for event in paced(words, encode):
+                yield event
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/{version}/models/{model}:generateContent")
+    async def gemini_generate(version: str, model: str, request: Request):
+        app.state.requests += 1
+        await request.body()
+        await first_byte()
+        if failed():
+            return _error(503, "fake upstream error")
+
+        await asyncio.sleep(config.tokens * config.token_delay_ms / 1000)
+        return _gemini_response("".join(_words(config.tokens, config.bubbles)))
+
+    @app.post("/{version}/models/{model}:streamGenerateContent")
+    async def gemini_stream(version: str, model: str, request: Request):
+        app.state.requests += 1
+        await request.body()
+        await first_byte()
+        if failed():
+            return _error(503, "fake upstream error")
+
+        def encode(word: str) -> bytes:
+            return f"data: {json.dumps(_gemini_response(word))}\n\n".encode("utf-8")
+
+        return StreamingResponse(
+            paced(_words(config.tokens, config.bubbles), encode),
+            media_type="text/event-stream",
+        )
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests, "config": config.describe()}
+
+    return app
+
+
+def _gemini_response(text: str) -> dict:
+    return {
+        "candidates": [
+            {
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0,
+            }
+        ],
+        "usageMetadata": {"promptTokenCount": 0, "candidatesTokenCount": 0},
+    }
+
+
+def _error(status: int, message: str) -> JSONResponse:
+    return JSONResponse(
+        {"error": {"code": status, "message": message, "status": "UNAVAILABLE"}},
+        status_code=status,
+    )
+
+
+class FakeLLMServer:
+    """
+    Run the fake endpoints on a background thread.
+    """
+
+    def __init__(self, config: FakeLLMConfig, host: str = "127.0.0.1", port: int = 0):
+        self.config = config
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "FakeLLMServer":
+        self.server = uvicorn.Server(
+            uvicorn.Config(
+                create_app(self.config),
+                host=self.host,
+                port=self.port,
+                log_level="warning",
+                access_log=False,
+            )
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        if not self.port:
+            self.port = self.server.servers[0].sockets[0].getsockname()[1]
+        return self
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.should_exit = True
+            self.thread.join(timeout=5)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--token-delay-ms", type=float, default=10.0)
+    parser.add_argument("--bubbles", type=int, default=2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+
+
+def config_from_args(args) -> FakeLLMConfig:
+    return FakeLLMConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens=args.tokens,
+        token_delay_ms=args.token_delay_ms,
+        bubbles=args.bubbles,
+        error_rate=args.error_rate,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port)
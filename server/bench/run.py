@@ -0,0 +1,513 @@
+"""
+Load-test the API offline and save the numbers as JSON.
+
+Starts the fake Groq/Gemini server, launches the app under uvicorn with
+in-process Chroma and the chosen embedding model, then drives one or more
+scenarios at a fixed concurrency and reports latency percentiles, RPS and
+the app's RSS.
+
+    python -m bench.run --scenario query --concurrency 16 --requests 500
+    python -m bench.run --scenario all --stream --latency-ms 400
+    python -m bench.run --scenario query --env RETRIEVAL_MODE=hybrid \\
+        --baseline bench/results/before.json
+
+Run from the server directory.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+
+from bench.fake_llm import FakeLLMServer, add_arguments, config_from_args
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(SERVER_DIR, "bench", "results")
+SCENARIOS = ("query", "vibe", "upload")
+SMALL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+VOCAB = (
+    "post caption reel story trend audio hook thread reply comment like share "
+    "follow creator brand launch drop fit outfit recipe gym travel study exam "
+    "meme clip edit filter hashtag algorithm reach views engagement niche "
+    "friend group chat text message date party weekend concert game stream "
+    "music playlist review tip hack routine skincare budget job interview "
+    "college campus dorm coffee sunset beach city night morning vibe energy"
+).split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCAB) for _ in range(words))
+
+
+def document(rng: random.Random, paragraphs: int) -> str:
+    return "\n\n".join(
+        ". ".join(sentence(rng, 12) for _ in range(5)) + "." for _ in range(paragraphs)
+    )
+
+
+def png_image(seed: int, side: int = 640) -> bytes:
+    from PIL import Image
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", (side, side), tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return round(ordered[rank], 2)
+
+
+def summarize(values: List[float]) -> dict:
+    if not values:
+        return {}
+    return {
+        "mean": round(sum(values) / len(values), 2),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": round(max(values), 2),
+    }
+
+
+class RSSSampler:
+    """
+    Poll a process's resident set size from /proc while a scenario runs.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def rss_mb(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/status", encoding="ascii") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            return None
+        return None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            rss = self.rss_mb()
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RSSSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {}
+        return {
+            "start": round(self.samples[0], 1),
+            "peak": round(max(self.samples), 1),
+            "end": round(self.samples[-1], 1),
+        }
+
+
+class Result:
+    def __init__(self, ok: bool, latency_ms: float, ttfb_ms: Optional[float] = None):
+        self.ok = ok
+        self.latency_ms = latency_ms
+        self.ttfb_ms = ttfb_ms
+
+
+class Scenarios:
+    """
+    Request builders for each scenario. Every call returns a `Result`.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.repeated = [sentence(self.rng, 8) for _ in range(16)]
+        self.images = [png_image(i) for i in range(args.images)]
+        self.upload_body = document(self.rng, max(1, args.upload_kb // 4)).encode(
+            "utf-8"
+        )[: args.upload_kb * 1024]
+        self.job_latencies: List[float] = []
+
+    def _query_text(self) -> str:
+        if self.rng.random() < self.args.repeat_ratio:
+            return self.rng.choice(self.repeated)
+        return sentence(self.rng, 8)
+
+    def _user_id(self) -> int:
+        return self.rng.randrange(1, self.args.users + 1)
+
+    async def query(self) -> Result:
+        body = {
+            "query": self._query_text(),
+            "user_id": self._user_id(),
+            "stream": self.args.stream,
+        }
+        return await self._send("POST", "/api/v1/query", json=body)
+
+    async def vibe(self) -> Result:
+        data = {"query": self._query_text(), "stream": str(self.args.stream).lower()}
+        files = [
+            ("images", (f"image-{i}.png", image, "image/png"))
+            for i, image in enumerate(self.images)
+        ]
+        return await self._send(
+            "POST", "/api/v1/query/vibe", data=data, files=files or None
+        )
+
+    async def upload(self) -> Result:
+        started = time.perf_counter()
+        response = await self.client.post(
+            "/api/v1/upload/user",
+            params={"user_id": self._user_id()},
+            files=[("files", ("bench.txt", self.upload_body, "text/plain"))],
+        )
+        latency = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            return Result(False, latency)
+
+        if self.args.wait_jobs:
+            job_id = response.json()["result"]["job_id"]
+            status = await wait_for_job(self.client, job_id)
+            self.job_latencies.append((time.perf_counter() - started) * 1000)
+            if status != "completed":
+                return Result(False, latency)
+        return Result(True, latency)
+
+    async def _send(self, method: str, url: str, **kwargs) -> Result:
+        started = time.perf_counter()
+        if not self.args.stream:
+            response = await self.client.request(method, url, **kwargs)
+            latency = (time.perf_counter() - started) * 1000
+            return Result(response.status_code == 200, latency)
+
+        ttfb = None
+        last = None
+        async with self.client.stream(method, url, **kwargs) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return Result(False, (time.perf_counter() - started) * 1000)
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                if ttfb is None:
+                    ttfb = (time.perf_counter() - started) * 1000
+                last = json.loads(line)
+        latency = (time.perf_counter() - started) * 1000
+        return Result(last is not None and last["type"] == "done", latency, ttfb)
+
+
+async def wait_for_job(client: httpx.AsyncClient, job_id: str) -> str:
+    while True:
+        response = await client.get(f"/api/v1/upload/jobs/{job_id}")
+        status = response.json()["result"]["status"]
+        if status in ("completed", "failed"):
+            return status
+        await asyncio.sleep(0.05)
+
+
+async def run_load(
+    send: Callable[[], Awaitable[Result]],
+    concurrency: int,
+    requests: int,
+    duration: Optional[float],
+) -> tuple:
+    """
+    Keep `concurrency` requests in flight until `requests` have been sent or
+    `duration` seconds have passed.
+    """
+    results: List[Result] = []
+    sent = 0
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker() -> None:
+        nonlocal sent
+        while sent < requests and (deadline is None or time.perf_counter() < deadline):
+            sent += 1
+            started = time.perf_counter()
+            try:
+                results.append(await send())
+            except httpx.HTTPError as e:
+                print("Error sending request:", e)
+                results.append(Result(False, (time.perf_counter() - started) * 1000))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+async def seed(client: httpx.AsyncClient, docs: int, rng: random.Random) -> None:
+    """
+    Fill the global store so retrieval has something to search.
+    """
+    jobs = []
+    for i in range(docs):
+        response = await client.post(
+            "/api/v1/upload/global",
+            files=[("files", (f"seed-{i}.txt", document(rng, 8), "text/plain"))],
+        )
+        response.raise_for_status()
+        jobs.append(response.json()["result"]["job_id"])
+    await asyncio.gather(*(wait_for_job(client, job_id) for job_id in jobs))
+
+
+async def run_scenarios(args, base_url: str, app_pid: int) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=timeout
+    ) as client:
+        if args.seed_docs:
+            print(f"Seeding {args.seed_docs} global documents")
+            await seed(client, args.seed_docs, random.Random(args.seed))
+
+        scenarios = Scenarios(client, args)
+        names = SCENARIOS if args.scenario == "all" else (args.scenario,)
+        report = {}
+
+        for name in names:
+            send = getattr(scenarios, name)
+            if args.warmup:
+                await run_load(
+                    send, min(args.concurrency, args.warmup), args.warmup, None
+                )
+            scenarios.job_latencies.clear()
+
+            print(f"Running {name}: {args.concurrency} concurrent")
+            with RSSSampler(app_pid) as rss:
+                results, elapsed = await run_load(
+                    send, args.concurrency, args.requests, args.duration
+                )
+
+            ok = [r for r in results if r.ok]
+            report[name] = {
+                "requests": len(results),
+                "errors": len(results) - len(ok),
+                "elapsed_seconds": round(elapsed, 3),
+                "rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+                "latency_ms": summarize([r.latency_ms for r in ok]),
+                "ttfb_ms": summarize([r.ttfb_ms for r in ok if r.ttfb_ms is not None]),
+                "job_ms": summarize(scenarios.job_latencies),
+                "rss_mb": rss.summary(),
+            }
+            print(json.dumps(report[name], indent=2))
+
+        return report
+
+
+def start_app(args, llm_url: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update(
+        {
+            "APP_PORT": str(args.port),
+            "CHROMA_PORT": "8000",
+            "CHROMA_MODE": "embedded",
+            "CHROMA_GLOBAL_STORE": "global_store",
+            "CHROMA_USER_STORE": "user_store",
+            "GROQ_API_KEY": "bench",
+            "XAI_API_KEY": "bench",
+            "GEMINI_API_KEY": "bench",
+            "GROQ_BASE_URL": llm_url,
+            "GEMINI_BASE_URL": llm_url,
+            "XAI_BASE_URL": f"{llm_url}/v1",
+            "EMBEDDING_MODEL": args.embedding_model,
+            # Every bench request comes from one IP and a handful of users;
+            # concurrency gates still apply
+            "RATE_LIMIT_IP_RPS": "0",
+            "RATE_LIMIT_USER_RPS": "0",
+        }
+    )
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(args.port),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        cwd=SERVER_DIR,
+        env=env,
+    )
+
+
+def wait_until_ready(base_url: str, app: subprocess.Popen, timeout: float) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if app.poll() is not None:
+            raise RuntimeError(f"App exited with code {app.returncode}")
+        try:
+            ping = httpx.get(f"{base_url}/api/v1/ping", timeout=2).json()
+        except httpx.HTTPError:
+            time.sleep(0.2)
+            continue
+        status = ping["vector_store"]["status"]
+        if status == "ready":
+            return ping["vector_store"]
+        if status == "retrying":
+            raise RuntimeError(f"Vector store failed: {ping['vector_store']['error']}")
+        time.sleep(0.2)
+    raise RuntimeError("Timed out waiting for the app to become ready")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SERVER_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """
+    Print the change in headline numbers against a previous run.
+    """
+    metrics = [
+        ("rps", ("rps",)),
+        ("p50 ms", ("latency_ms", "p50")),
+        ("p95 ms", ("latency_ms", "p95")),
+        ("p99 ms", ("latency_ms", "p99")),
+        ("ttfb p50 ms", ("ttfb_ms", "p50")),
+        ("peak rss mb", ("rss_mb", "peak")),
+    ]
+    for name, result in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None:
+            continue
+        print(f"\n{name} vs {baseline['meta'].get('commit')}")
+        for label, path in metrics:
+            before, after = old, result
+            for key in path:
+                before = (before or {}).get(key)
+                after = (after or {}).get(key)
+            if before is None or after is None:
+                continue
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+            print(f"  {label:<12} {before:>10} -> {after:>10}  {change}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="query")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument(
+        "--duration", type=float, help="Stop each scenario after this many seconds"
+    )
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument(
+        "--repeat-ratio",
+        type=float,
+        default=0.0,
+        help="Fraction of queries drawn from a small repeated pool (cache hits)",
+    )
+    parser.add_argument("--images", type=int, default=0, help="Images per vibe check")
+    parser.add_argument("--upload-kb", type=int, default=64)
+    parser.add_argument("--wait-jobs", action="store_true")
+    parser.add_argument("--seed-docs", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--embedding-model", default=SMALL_EMBEDDING_MODEL)
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Extra app settings, e.g. RETRIEVAL_MODE=hybrid",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument(
+        "--out", help="Results file (default: bench/results/<time>.json)"
+    )
+    parser.add_argument("--baseline", help="Previous results file to compare against")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    llm = FakeLLMServer(config_from_args(args)).start()
+    base_url = f"http://127.0.0.1:{args.port}"
+    app = start_app(args, llm.url)
+
+    try:
+        started = time.perf_counter()
+        vector_store = wait_until_ready(base_url, app, args.ready_timeout)
+        startup_seconds = round(time.perf_counter() - started, 3)
+        scenarios = asyncio.run(run_scenarios(args, base_url, app.pid))
+    finally:
+        app.terminate()
+        app.wait(timeout=30)
+        llm.stop()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "fake_llm": llm.config.describe(),
+            "startup_seconds": startup_seconds,
+            "warmup_seconds": vector_store.get("warmup_seconds"),
+        },
+        "scenarios": scenarios,
+    }
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os
+import sys
+from pathlib import Path
+
+# Settings are read at import time; give the required ones harmless values
+for name, value in (
+    ("APP_PORT", "8000"),
+    ("CHROMA_PORT", "8080"),
+    ("GROQ_API_KEY", "test"),
+    ("XAI_API_KEY", "test"),
+    ("GEMINI_API_KEY", "test"),
+    ("CHROMA_GLOBAL_STORE", "global_store"),
+    ("CHROMA_USER_STORE", "user_store"),
+):
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
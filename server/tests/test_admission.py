@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+
+from app.services.admission import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    AdmissionGate,
+    RateLimiter,
+    Rejected,
+    TokenBucket,
+)
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2.0, burst=2.0, now=0.0)
+    assert bucket.take(1, now=0.0) == 0.0
+    assert bucket.take(1, now=0.0) == 0.0
+    assert bucket.take(1, now=0.0) == pytest.approx(0.5)
+    assert bucket.take(1, now=0.5) == 0.0
+    # Idle time never fills past the burst
+    bucket.take(0, now=100.0)
+    assert bucket.tokens == 2.0
+
+
+def test_rate_limiter_rejects_with_429_per_key():
+    limiter = RateLimiter("test", rate=0.001, burst=2, max_keys=10)
+    limiter.check("a")
+    limiter.check("a")
+    with pytest.raises(Rejected) as excinfo:
+        limiter.check("a")
+    assert excinfo.value.status_code == 429
+    assert int(excinfo.value.headers["Retry-After"]) >= 1
+    # Another key has its own bucket
+    limiter.check("b")
+
+
+def test_rate_limiter_forgets_least_recently_used():
+    limiter = RateLimiter("test", rate=0.001, burst=1, max_keys=2)
+    limiter.check("a")
+    limiter.check("b")
+    limiter.check("c")
+    assert list(limiter.buckets) == ["b", "c"]
+
+
+def test_release_hands_slot_to_lowest_priority_value():
+    async def run():
+        gate = AdmissionGate("test", limit=1, queue_size=10, queue_timeout=5)
+        await gate.acquire()
+        order = []
+
+        async def waiter(name, priority):
+            await gate.acquire(priority)
+            order.append(name)
+            gate.release()
+
+        tasks = [
+            asyncio.create_task(waiter("bulk", PRIORITY_BULK)),
+            asyncio.create_task(waiter("interactive", PRIORITY_INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        assert len(gate.queue) == 2
+        gate.release()
+        await asyncio.gather(*tasks)
+        return gate, order
+
+    gate, order = asyncio.run(run())
+    assert order == ["interactive", "bulk"]
+    assert gate.in_flight == 0
+    assert gate.waiting == 0
+    assert not gate.queue
+
+
+def test_handoff_keeps_in_flight_at_limit():
+    async def run():
+        gate = AdmissionGate("test", limit=1, queue_size=10, queue_timeout=5)
+        await gate.acquire()
+        task = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        gate.release()
+        await task
+        # The waiter took over the slot rather than a new one being counted
+        assert gate.in_flight == 1
+        # And a new arrival still queues behind it instead of jumping in
+        late = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert not late.done()
+        gate.release()
+        await late
+        gate.release()
+        return gate
+
+    gate = asyncio.run(run())
+    assert gate.in_flight == 0
+
+
+def test_cancelled_waiter_passes_handed_slot_on():
+    async def run():
+        gate = AdmissionGate("test", limit=1, queue_size=10, queue_timeout=5)
+        await gate.acquire()
+        first = asyncio.create_task(gate.acquire())
+        second = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        # Hand the slot to `first` and cancel it before it can run
+        gate.release()
+        first.cancel()
+        (outcome,) = await asyncio.gather(first, return_exceptions=True)
+        if not isinstance(outcome, asyncio.CancelledError):
+            # Before 3.12 wait_for lets a result that raced the cancel win,
+            # so `first` holds the slot and must give it back itself
+            gate.release()
+        await asyncio.wait_for(second, 1)
+        assert gate.in_flight == 1
+        gate.release()
+        return gate
+
+    gate = asyncio.run(run())
+    assert gate.in_flight == 0
+    assert gate.waiting == 0
+    assert not gate.queue
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        gate = AdmissionGate("test", limit=1, queue_size=10, queue_timeout=5)
+        await gate.acquire()
+        task = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert not gate.queue
+        assert gate.waiting == 0
+        gate.release()
+        return gate
+
+    assert asyncio.run(run()).in_flight == 0
+
+
+def test_full_queue_rejects_with_503():
+    async def run():
+        gate = AdmissionGate("test", limit=1, queue_size=1, queue_timeout=5)
+        await gate.acquire()
+        queued = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as excinfo:
+            gate.ensure_capacity()
+        assert excinfo.value.status_code == 503
+        with pytest.raises(Rejected):
+            await gate.acquire()
+        # Unbounded (background) waiters are never turned away
+        background = asyncio.create_task(gate.acquire(PRIORITY_BULK, bounded=False))
+        await asyncio.sleep(0)
+        gate.release()
+        await queued
+        gate.release()
+        await background
+        gate.release()
+        return gate
+
+    gate = asyncio.run(run())
+    assert gate.rejected == 2
+    assert gate.in_flight == 0
+
+
+def test_queue_timeout_rejects_with_503():
+    async def run():
+        gate = AdmissionGate("test", limit=1, queue_size=1, queue_timeout=0.01)
+        await gate.acquire()
+        with pytest.raises(Rejected) as excinfo:
+            await gate.acquire()
+        assert excinfo.value.status_code == 503
+        assert not gate.queue
+        assert gate.waiting == 0
+        gate.release()
+        return gate
+
+    assert asyncio.run(run()).in_flight == 0
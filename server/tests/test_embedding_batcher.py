@@ -0,0 +1,118 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services.embedding import EmbeddingBatcher
+
+
+class Encoder:
+    """
+    Records each batch it is called with and returns each text's length.
+    """
+
+    def __init__(self, release=None):
+        self.batches = []
+        self.threads = set()
+        self.release = release
+
+    def __call__(self, texts):
+        if self.release is not None:
+            self.release.wait(5)
+        self.batches.append(list(texts))
+        self.threads.add(threading.current_thread().name)
+        return [[float(len(text))] for text in texts]
+
+
+def test_concurrent_requests_share_a_batch():
+    encoder = Encoder()
+
+    async def run():
+        batcher = EmbeddingBatcher(encoder, max_batch_size=8, max_wait_ms=50)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.embed("x" * n) for n in range(5)))
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(run()) == [[float(n)] for n in range(5)]
+    assert len(encoder.batches) == 1
+    assert all(name.startswith("embedding") for name in encoder.threads)
+
+
+def test_batches_are_capped_and_order_is_kept():
+    encoder = Encoder()
+
+    async def run():
+        batcher = EmbeddingBatcher(encoder, max_batch_size=3, max_wait_ms=50)
+        batcher.start()
+        try:
+            return await batcher.embed_many(["x" * n for n in range(7)])
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(run()) == [[float(n)] for n in range(7)]
+    assert [len(batch) for batch in encoder.batches] == [3, 3, 1]
+
+
+def test_encoder_error_fails_only_its_batch():
+    calls = []
+
+    def encode(texts):
+        calls.append(texts)
+        if len(calls) == 1:
+            raise ValueError("bad batch")
+        return [[1.0] for _ in texts]
+
+    async def run():
+        batcher = EmbeddingBatcher(encode, max_batch_size=8, max_wait_ms=1)
+        batcher.start()
+        try:
+            with pytest.raises(ValueError):
+                await batcher.embed("first")
+            return await batcher.embed("second")
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(run()) == [1.0]
+
+
+def test_cancelled_caller_is_not_encoded():
+    release = threading.Event()
+    encoder = Encoder(release)
+
+    async def run():
+        batcher = EmbeddingBatcher(encoder, max_batch_size=1, max_wait_ms=1)
+        batcher.start()
+        try:
+            busy = asyncio.create_task(batcher.embed("busy"))
+            await asyncio.sleep(0.05)
+            abandoned = asyncio.create_task(batcher.embed("abandoned"))
+            await asyncio.sleep(0.01)
+            abandoned.cancel()
+            kept = asyncio.create_task(batcher.embed("kept"))
+            await asyncio.sleep(0.01)
+            release.set()
+            return await busy, await kept
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(run()) == ([4.0], [4.0])
+    assert encoder.batches == [["busy"], ["kept"]]
+
+
+def test_stop_fails_queued_requests():
+    release = threading.Event()
+
+    async def run():
+        batcher = EmbeddingBatcher(Encoder(release), max_batch_size=1, max_wait_ms=1)
+        batcher.start()
+        first = asyncio.create_task(batcher.embed("first"))
+        second = asyncio.create_task(batcher.embed("second"))
+        await asyncio.sleep(0.05)
+        await batcher.stop()
+        release.set()
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    for outcome in asyncio.run(run()):
+        assert isinstance(outcome, RuntimeError)
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from app.services.embedding_cache import (
+    DiskEmbeddingTier,
+    EmbeddingCache,
+    embedding_key,
+)
+
+
+def vector(value, dim=4):
+    return np.full(dim, value, dtype=np.float32)
+
+
+def key(n):
+    return embedding_key("model", f"text {n}")
+
+
+def test_disk_tier_wraps_around_oldest_first(tmp_path):
+    tier = DiskEmbeddingTier(str(tmp_path), capacity=3)
+    for n in range(5):
+        tier.put(key(n), vector(n))
+
+    assert tier.get(key(0)) is None
+    assert tier.get(key(1)) is None
+    for n in (2, 3, 4):
+        np.testing.assert_array_equal(tier.get(key(n)), vector(n))
+    assert len(tier.rows) == 3
+    assert tier.head == 2
+    tier.close()
+
+
+def test_disk_tier_reopens_with_rows_and_head(tmp_path):
+    tier = DiskEmbeddingTier(str(tmp_path), capacity=3)
+    for n in range(4):
+        tier.put(key(n), vector(n))
+    tier.close()
+
+    tier = DiskEmbeddingTier(str(tmp_path), capacity=3)
+    assert tier.head == 1
+    assert tier.get(key(0)) is None
+    for n in (1, 2, 3):
+        np.testing.assert_array_equal(tier.get(key(n)), vector(n))
+
+    # Writing resumes at the oldest row rather than the newest
+    tier.put(key(4), vector(4))
+    assert tier.get(key(1)) is None
+    np.testing.assert_array_equal(tier.get(key(3)), vector(3))
+    tier.close()
+
+
+def test_disk_tier_reopens_after_crash(tmp_path):
+    tier = DiskEmbeddingTier(str(tmp_path), capacity=3)
+    for n in range(4):
+        tier.put(key(n), vector(n))
+    # No close(): the process died with the head saved on every put
+    tier.lock_file.close()
+
+    tier = DiskEmbeddingTier(str(tmp_path), capacity=3)
+    assert tier.head == 1
+    for n in (1, 2, 3):
+        np.testing.assert_array_equal(tier.get(key(n)), vector(n))
+    tier.close()
+
+
+def test_disk_tier_discards_on_capacity_change(tmp_path):
+    tier = DiskEmbeddingTier(str(tmp_path), capacity=3)
+    tier.put(key(0), vector(0))
+    tier.close()
+
+    tier = DiskEmbeddingTier(str(tmp_path), capacity=4)
+    assert tier.get(key(0)) is None
+    assert not tier.rows
+    tier.close()
+
+
+def test_disk_tier_ignores_other_dimensions(tmp_path):
+    tier = DiskEmbeddingTier(str(tmp_path), capacity=3)
+    tier.put(key(0), vector(0))
+    tier.put(key(1), vector(1, dim=8))
+    assert tier.get(key(1)) is None
+    assert tier.head == 1
+    tier.close()
+
+
+def test_disk_tier_is_locked_while_open(tmp_path):
+    tier = DiskEmbeddingTier(str(tmp_path), capacity=3)
+    with pytest.raises(RuntimeError):
+        DiskEmbeddingTier(str(tmp_path), capacity=3)
+    tier.close()
+    DiskEmbeddingTier(str(tmp_path), capacity=3).close()
+
+
+def test_cache_falls_back_to_memory_when_locked(tmp_path):
+    tier = DiskEmbeddingTier(str(tmp_path), capacity=3)
+    cache = EmbeddingCache("model", disk_dir=str(tmp_path), disk_capacity=3)
+    assert cache.disk is None
+    cache.put("hello", [1.0, 2.0])
+    np.testing.assert_array_equal(cache.get("hello"), [1.0, 2.0])
+    cache.close()
+    tier.close()
+
+
+def test_cache_promotes_disk_hits(tmp_path):
+    cache = EmbeddingCache("model", disk_dir=str(tmp_path), disk_capacity=3)
+    cache.put("hello", [1.0, 2.0])
+    cache.close()
+
+    cache = EmbeddingCache("model", disk_dir=str(tmp_path), disk_capacity=3)
+    np.testing.assert_array_equal(cache.get("hello"), [1.0, 2.0])
+    cache.get("hello")
+    assert cache.get("missing") is None
+    assert (cache.disk_hits, cache.memory_hits, cache.misses) == (1, 1, 1)
+    cache.close()
+
+
+def test_cache_memory_tier_is_bounded():
+    cache = EmbeddingCache("model", max_bytes=2 * vector(0).nbytes)
+    for n in range(3):
+        cache.put(f"text {n}", vector(n))
+    assert cache.get("text 0") is None
+    assert cache.memory_bytes == 2 * vector(0).nbytes
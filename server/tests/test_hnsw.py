@@ -0,0 +1,183 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.db.hnsw import LOG_FILE, QuantizedClient, QuantizedCollection
+
+DIM = 16
+
+
+@pytest.fixture(autouse=True)
+def graph_search(monkeypatch):
+    """
+    Always walk the graph, even for collections this small.
+    """
+    monkeypatch.setattr(settings, "vector_exact_search_rows", 0)
+    monkeypatch.setattr(settings, "hnsw_snapshot_seconds", 0)
+    monkeypatch.setattr(settings, "hnsw_compact_ratio", 0.25)
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).standard_normal((200, DIM)).astype(np.float32)
+
+
+def ids(count, start=0):
+    return [f"id{n}" for n in range(start, start + count)]
+
+
+def fill(collection, vectors):
+    collection.add(
+        ids=ids(len(vectors)),
+        embeddings=vectors.tolist(),
+        documents=[f"doc {n}" for n in range(len(vectors))],
+        metadatas=[{"parity": n % 2} for n in range(len(vectors))],
+    )
+
+
+def nearest(collection, vector, k=1, where=None):
+    result = collection.query([vector.tolist()], n_results=k, where=where)
+    return result["ids"][0]
+
+
+def test_query_returns_exact_match_first(vectors):
+    collection = QuantizedCollection("test")
+    fill(collection, vectors)
+    hits = sum(nearest(collection, vectors[n]) == [f"id{n}"] for n in range(50))
+    assert hits >= 48
+    result = collection.query([vectors[7].tolist()], n_results=3)
+    assert result["distances"][0][0] == pytest.approx(0.0, abs=1e-4)
+
+
+def test_where_filter(vectors):
+    collection = QuantizedCollection("test")
+    fill(collection, vectors)
+    found = nearest(collection, vectors[4], k=10, where={"parity": 1})
+    assert len(found) == 10
+    assert all(int(record_id[2:]) % 2 == 1 for record_id in found)
+
+
+def test_deleted_rows_are_never_returned(vectors):
+    collection = QuantizedCollection("test")
+    fill(collection, vectors)
+    deleted = set(ids(100))
+    collection.delete(ids=list(deleted))
+
+    assert collection.count() == 100
+    assert collection.get(ids=["id0", "id150"])["ids"] == ["id150"]
+    for n in range(0, 200, 10):
+        found = nearest(collection, vectors[n], k=10)
+        assert len(found) == 10
+        assert not deleted & set(found)
+
+
+def test_upsert_replaces_vector_and_metadata(vectors):
+    collection = QuantizedCollection("test")
+    fill(collection, vectors)
+    collection.upsert(
+        ids=["id3"], embeddings=[vectors[150].tolist()], metadatas=[{"parity": 9}]
+    )
+    assert collection.count() == 200
+    assert set(nearest(collection, vectors[150], k=2)) == {"id3", "id150"}
+    assert collection.get(where={"parity": 9})["ids"] == ["id3"]
+
+
+def test_reopen_from_snapshot(tmp_path, vectors):
+    collection = QuantizedCollection("test", str(tmp_path))
+    fill(collection, vectors)
+    collection.snapshot()
+    assert os.path.getsize(tmp_path / LOG_FILE) == 0
+    expected = [nearest(collection, vectors[n], k=5) for n in range(20)]
+
+    reopened = QuantizedCollection("test", str(tmp_path))
+    assert reopened.count() == 200
+    assert [nearest(reopened, vectors[n], k=5) for n in range(20)] == expected
+    assert reopened.get(ids=["id5"])["documents"] == ["doc 5"]
+
+
+def test_log_replays_writes_made_after_the_snapshot(tmp_path, vectors):
+    collection = QuantizedCollection("test", str(tmp_path))
+    fill(collection, vectors[:100])
+    collection.snapshot()
+    collection.add(ids=ids(100, 100), embeddings=vectors[100:].tolist())
+    collection.delete(ids=["id1", "id150"])
+    collection.update(ids=["id2"], metadatas=[{"tag": "x"}])
+    # No snapshot: the process goes away with only the log to go on
+
+    reopened = QuantizedCollection("test", str(tmp_path))
+    assert reopened.count() == 198
+    assert reopened.get(ids=["id1", "id150"])["ids"] == []
+    assert reopened.get(where={"tag": "x"})["ids"] == ["id2"]
+    assert nearest(reopened, vectors[180]) == ["id180"]
+    assert "id150" not in nearest(reopened, vectors[150], k=10)
+
+
+def test_log_replays_without_any_snapshot(tmp_path, vectors):
+    collection = QuantizedCollection("test", str(tmp_path))
+    fill(collection, vectors[:50])
+    collection.delete(where={"parity": 0})
+
+    reopened = QuantizedCollection("test", str(tmp_path))
+    assert reopened.count() == 25
+    assert sorted(reopened.get()["ids"]) == sorted(ids(50)[1::2])
+    assert nearest(reopened, vectors[7]) == ["id7"]
+
+
+def test_torn_log_record_is_cut_off(tmp_path, vectors):
+    collection = QuantizedCollection("test", str(tmp_path))
+    fill(collection, vectors[:50])
+    collection.delete(ids=["id3"])
+    log = tmp_path / LOG_FILE
+    intact = os.path.getsize(log)
+    with open(log, "a") as f:
+        f.write('{"op": "remove", "row": 4, "se')
+
+    reopened = QuantizedCollection("test", str(tmp_path))
+    assert reopened.count() == 49
+    assert reopened.get(ids=["id4"])["ids"] == ["id4"]
+    assert os.path.getsize(log) == intact
+
+    # Later writes append after the cut rather than after the torn bytes
+    reopened.delete(ids=["id5"])
+    again = QuantizedCollection("test", str(tmp_path))
+    assert again.count() == 48
+
+
+def test_snapshot_compacts_deleted_rows(tmp_path, vectors):
+    collection = QuantizedCollection("test", str(tmp_path))
+    fill(collection, vectors)
+    collection.snapshot()
+    collection.delete(ids=ids(100))
+    collection.snapshot()
+
+    assert len(collection.ids) == 100
+    assert collection.vectors_file != "vectors.f32"
+    assert [
+        name for name in os.listdir(tmp_path) if name.endswith(".f32")
+    ] == [collection.vectors_file]
+    for n in range(100, 200, 10):
+        assert nearest(collection, vectors[n]) == [f"id{n}"]
+
+    reopened = QuantizedCollection("test", str(tmp_path))
+    assert reopened.count() == 100
+    assert reopened.get(where={"parity": 1}, include=[])["ids"][:2] == [
+        "id101",
+        "id103",
+    ]
+    for n in range(100, 200, 10):
+        assert nearest(reopened, vectors[n]) == [f"id{n}"]
+
+
+def test_client_locks_its_directory(tmp_path, vectors):
+    client = QuantizedClient(str(tmp_path))
+    fill(client.get_or_create_collection("chunks"), vectors[:20])
+    with pytest.raises(RuntimeError):
+        QuantizedClient(str(tmp_path))
+    client.close()
+
+    reopened = QuantizedClient(str(tmp_path))
+    assert reopened.list_collections() == ["chunks"]
+    assert reopened.get_collection("chunks").count() == 20
+    reopened.close()
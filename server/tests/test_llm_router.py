@@ -0,0 +1,194 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.services.llm import BackendStats, LLMRouter, UpstreamError, llm_clients
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    """
+    Mark the providers as open without creating any upstream clients.
+    """
+    monkeypatch.setattr(llm_clients, "groq", object())
+    monkeypatch.setattr(llm_clients, "gemini", object())
+    monkeypatch.setattr(llm_clients, "xai", None)
+    monkeypatch.setattr(
+        llm_clients,
+        "_limits",
+        {provider: asyncio.Semaphore(10) for provider in ("groq", "gemini")},
+    )
+    monkeypatch.setattr(llm_clients, "_timeouts", {"groq": 5.0, "gemini": 5.0})
+    monkeypatch.setattr(settings, "llm_hedge_enabled", True)
+    monkeypatch.setattr(settings, "llm_hedge_delay_ms", 20.0)
+    monkeypatch.setattr(settings, "llm_hedge_max_ratio", 0.5)
+    monkeypatch.setattr(settings, "llm_breaker_failures", 2)
+    monkeypatch.setattr(settings, "llm_breaker_cooldown_seconds", 30.0)
+
+
+def replying(text, delay=0.0):
+    async def complete(content):
+        await asyncio.sleep(delay)
+        return text
+
+    return complete
+
+
+def failing(delay=0.0):
+    async def complete(content):
+        await asyncio.sleep(delay)
+        raise RuntimeError("upstream failed")
+
+    return complete
+
+
+def streaming(pieces, delay=0.0):
+    async def stream(content):
+        await asyncio.sleep(delay)
+        for piece in pieces:
+            yield piece
+
+    return stream
+
+
+def make_router(monkeypatch, **methods):
+    router = LLMRouter({"query": ["groq:primary", "gemini:secondary"]})
+    primary, secondary = router.routes["query"]
+    for name, (first, second) in methods.items():
+        monkeypatch.setattr(primary, name, first)
+        monkeypatch.setattr(secondary, name, second)
+    return router, primary, secondary
+
+
+def test_breaker_opens_probes_and_closes():
+    stats = BackendStats(window=10, breaker_failures=2, cooldown=30.0)
+    stats.record_failure()
+    assert stats.available(0.0)
+    stats.record_failure()
+    assert stats.describe()["breaker"] == "open"
+    assert not stats.available(stats.open_until - 1)
+
+    # After the cooldown exactly one probe is let through
+    assert stats.available(stats.open_until)
+    stats.begin(stats.open_until)
+    assert not stats.available(stats.open_until)
+
+    stats.record_success(0.1)
+    assert stats.describe()["breaker"] == "closed"
+    assert stats.available(0.0)
+
+
+def test_failed_probe_reopens_breaker():
+    stats = BackendStats(window=10, breaker_failures=1, cooldown=30.0)
+    stats.record_failure()
+    first_open = stats.open_until
+    stats.begin(first_open)
+    stats.record_failure()
+    assert not stats.probing
+    assert stats.open_until >= first_open
+    assert not stats.available(first_open)
+
+
+def test_cancelled_probe_lets_the_next_one_through():
+    stats = BackendStats(window=10, breaker_failures=1, cooldown=0.0)
+    stats.record_failure()
+    stats.begin(stats.open_until)
+    assert not stats.available(stats.open_until)
+    stats.cancelled()
+    assert stats.available(stats.open_until)
+
+
+def test_complete_fails_over_to_next_backend(clients, monkeypatch):
+    router, primary, secondary = make_router(
+        monkeypatch, complete=(failing(), replying("fallback"))
+    )
+    assert asyncio.run(router.complete("query", "hi")) == "fallback"
+    assert primary.stats.consecutive_failures == 1
+    assert list(secondary.stats.outcomes) == [True]
+    assert list(router.hedges) == [False]
+
+
+def test_complete_raises_when_every_backend_fails(clients, monkeypatch):
+    router, primary, secondary = make_router(
+        monkeypatch, complete=(failing(), failing())
+    )
+    with pytest.raises(UpstreamError):
+        asyncio.run(router.complete("query", "hi"))
+    assert primary.stats.consecutive_failures == 1
+    assert secondary.stats.consecutive_failures == 1
+
+
+def test_slow_backend_is_hedged_and_cancelled(clients, monkeypatch):
+    router, primary, secondary = make_router(
+        monkeypatch, complete=(replying("slow", delay=5), replying("fast"))
+    )
+    assert asyncio.run(router.complete("query", "hi")) == "fast"
+    assert list(router.hedges) == [True]
+    # The cancelled loser is neither a success nor a failure
+    assert not primary.stats.outcomes
+    assert list(secondary.stats.outcomes) == [True]
+
+
+def test_hedging_stops_at_max_ratio(clients, monkeypatch):
+    router, primary, secondary = make_router(
+        monkeypatch, complete=(replying("slow", delay=0.1), replying("fast"))
+    )
+    router.hedges.extend([True, False])
+    assert asyncio.run(router.complete("query", "hi")) == "slow"
+    assert list(router.hedges) == [True, False, False]
+    assert not secondary.stats.outcomes
+
+
+def test_hedged_probe_is_released_when_cancelled(clients, monkeypatch):
+    router, primary, secondary = make_router(
+        monkeypatch, complete=(replying("slow", delay=5), replying("fast"))
+    )
+    primary.stats.consecutive_failures = settings.llm_breaker_failures
+    primary.stats.open_until = 0.0
+
+    assert asyncio.run(router.complete("query", "hi")) == "fast"
+    assert not primary.stats.probing
+    assert primary in router.candidates("query")
+
+
+def test_open_breaker_is_skipped(clients, monkeypatch):
+    router, primary, secondary = make_router(
+        monkeypatch, complete=(replying("primary"), replying("secondary"))
+    )
+    primary.stats.record_failure()
+    primary.stats.record_failure()
+    assert router.candidates("query") == [secondary]
+    assert asyncio.run(router.complete("query", "hi")) == "secondary"
+
+
+def test_stream_is_hedged_before_first_chunk(clients, monkeypatch):
+    router, primary, secondary = make_router(
+        monkeypatch,
+        stream=(streaming(["slow"], delay=5), streaming(["fast", " answer"])),
+    )
+
+    async def collect():
+        return [piece async for piece in router.stream("query", "hi")]
+
+    assert asyncio.run(collect()) == ["fast", " answer"]
+    assert list(router.hedges) == [True]
+    assert not primary.stats.outcomes
+    assert list(secondary.stats.outcomes) == [True]
+
+
+def test_stream_fails_over_before_first_chunk(clients, monkeypatch):
+    async def broken(content):
+        raise RuntimeError("upstream failed")
+        yield
+
+    router, primary, secondary = make_router(
+        monkeypatch, stream=(broken, streaming(["ok"]))
+    )
+
+    async def collect():
+        return [piece async for piece in router.stream("query", "hi")]
+
+    assert asyncio.run(collect()) == ["ok"]
+    assert primary.stats.consecutive_failures == 1
+    assert list(router.hedges) == [False]
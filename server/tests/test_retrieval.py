@@ -0,0 +1,98 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services import retrieval
+from app.services.bm25 import BM25Index
+from app.services.retrieval import (
+    dedupe_hits,
+    merge_hits,
+    reciprocal_rank_fusion,
+    rerank_hits,
+)
+
+
+def test_bm25_ranks_rarer_terms_higher():
+    index = BM25Index()
+    index.add("a", "the cat sat on the mat")
+    index.add("b", "the dog sat on the log")
+    index.add("c", "the cat and the dog")
+    ranked = [doc_id for doc_id, _ in index.search("cat mat", top_k=3)]
+    assert ranked[0] == "a"
+    assert "b" not in ranked
+
+
+def test_bm25_remove_and_replace_keep_totals():
+    index = BM25Index()
+    index.add("a", "alpha beta")
+    index.add("b", "beta gamma delta")
+    index.add("a", "gamma")
+    assert index.total_length == 4
+    assert [doc_id for doc_id, _ in index.search("alpha", 5)] == []
+
+    index.remove("b")
+    index.remove("missing")
+    assert len(index) == 1
+    assert index.total_length == 1
+    assert "beta" not in index.postings
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    scores = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "a"]], k=60)
+    assert max(scores, key=scores.get) == "b"
+    assert scores["a"] == pytest.approx(1 / 61 + 1 / 63)
+
+
+def test_merge_hits_normalises_each_list():
+    dense = [{"id": "d1", "score": 0.9}, {"id": "d2", "score": 0.8}]
+    fused = [{"id": "f1", "score": 0.03}, {"id": "f2", "score": 0.01}]
+    merged = [hit["id"] for hit in merge_hits(dense, fused, [])]
+    assert set(merged[:2]) == {"d1", "f1"}
+    assert set(merged[2:]) == {"d2", "f2"}
+
+
+def test_dedupe_hits_drops_near_duplicates():
+    text = "one two three four five six seven eight nine ten"
+    hits = [
+        {"id": "a", "text": text},
+        {"id": "b", "text": text + " eleven"},
+        {"id": "c", "text": "something else entirely with different words here"},
+    ]
+    assert [hit["id"] for hit in dedupe_hits(hits, threshold=0.8)] == ["a", "c"]
+
+
+class CrossEncoder:
+    def __init__(self, release=None):
+        self.release = release
+
+    def predict(self, pairs):
+        if self.release is not None:
+            self.release.wait(5)
+        return [len(text) for _, text in pairs]
+
+
+def test_rerank_orders_by_cross_encoder_score():
+    hits = [{"text": "short"}, {"text": "much longer text"}]
+    reranked = asyncio.run(rerank_hits(CrossEncoder(), "q", hits, budget_ms=1000))
+    assert [hit["text"] for hit in reranked] == ["much longer text", "short"]
+
+
+def test_rerank_gives_up_after_budget_and_while_busy():
+    release = threading.Event()
+    hits = [{"text": "a"}, {"text": "bb"}]
+
+    async def run():
+        slow = CrossEncoder(release)
+        timed_out = await rerank_hits(slow, "q", hits, budget_ms=10)
+        # The first call is still running on the rerank thread
+        busy = await rerank_hits(CrossEncoder(), "q", hits, budget_ms=1000)
+        release.set()
+        await asyncio.wrap_future(retrieval._rerank_running)
+        after = await rerank_hits(CrossEncoder(), "q", hits, budget_ms=1000)
+        return timed_out, busy, after
+
+    timed_out, busy, after = asyncio.run(run())
+    assert timed_out is None
+    assert busy is None
+    assert [hit["text"] for hit in after] == ["bb", "a"]